@@ -18,8 +18,7 @@ load_dotenv(os.path.join(os.path.dirname(__file__), env_file))
 log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(level=getattr(logging, log_level, logging.INFO))
 
-# IMPORTANT MANUAL DB STEP:
-# ALTER TABLE email MODIFY COLUMN raw_data LONGBLOB;
+# IMPORTANT MANUAL DB STEPS: see the SQL in README.txt (raw messages now live in email_blob)
 
 migrate = Migrate()  # Initialize Migrate outside the function
 
@@ -47,6 +46,10 @@ def create_app():
     from .routes import init_routes
     init_routes(app)
 
+    # flask import-archive <email_account_id> <path> loads .mbox/.eml exports without IMAP
+    from .mbox_import import import_archive_command
+    app.cli.add_command(import_archive_command)
+
     # Check database connectivity and set lock wait timeout
     with app.app_context():
         try:
@@ -0,0 +1,188 @@
+import os
+import re
+import hashlib
+import logging
+import tempfile
+from email.parser import BytesHeaderParser
+from email.policy import compat32
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Where attachments are moved out of email_blob.raw_data: a local directory or s3://bucket/prefix.
+# Empty keeps whole messages in the database.
+ATTACHMENT_STORE = os.getenv("ATTACHMENT_STORE", "")
+
+# Attachment parts smaller than this stay inline
+ATTACHMENT_MIN_BYTES = int(os.getenv("ATTACHMENT_MIN_BYTES", 32 * 1024))
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+# The whole body of an externalized part in the stored message
+BLOB_STUB = re.compile(rb'X-Email-Filter-Blob: sha256:([0-9a-f]{64}):(\d+)')
+
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+_store = None
+
+
+class LocalBlobStore:
+    """Content-addressed blobs in a local directory, sharded by the first bytes of their SHA-256."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a reader never sees a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as blob_file:
+                blob_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as blob_file:
+            return blob_file.read()
+
+
+class S3BlobStore:
+    """Content-addressed blobs in an S3 bucket, under an optional key prefix."""
+
+    def __init__(self, bucket, prefix=''):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3_client = boto3.client('s3')
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, key, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+
+
+def get_blob_store():
+    """Return the store configured by ATTACHMENT_STORE (one per process), or None when it is not set."""
+    global _store
+    if _store is None and ATTACHMENT_STORE:
+        if ATTACHMENT_STORE.startswith('s3://'):
+            bucket, _, prefix = ATTACHMENT_STORE[len('s3://'):].partition('/')
+            _store = S3BlobStore(bucket, prefix)
+        else:
+            _store = LocalBlobStore(ATTACHMENT_STORE)
+    return _store
+
+
+def _split_part(part):
+    """Split a MIME entity into (headers, separator, body) bytes."""
+    if part.startswith((b'\r\n', b'\n')):
+        # An entity without headers
+        return b'', b'', part
+    match = _HEADER_END.search(part)
+    if match is None:
+        return part, b'', b''
+    return part[:match.start()], match.group(), part[match.end():]
+
+
+def _is_attachment(headers):
+    disposition = (headers.get('Content-Disposition') or '').split(';')[0].strip().lower()
+    if disposition == 'attachment':
+        return True
+    # Inline parts with a file name that are not text, e.g. embedded images and PDFs
+    return bool(headers.get_filename()) and headers.get_content_maintype() not in ('text', 'multipart', 'message')
+
+
+def _map_leaf_parts(part, transform):
+    """
+    Rebuild a MIME entity with the body of each leaf part replaced by transform(headers, body);
+    everything else (headers, preamble, delimiters, epilogue) is kept byte for byte.
+    """
+    header_data, separator, body = _split_part(part)
+    if not separator:
+        return part
+    headers = BytesHeaderParser(policy=compat32).parsebytes(header_data + separator)
+
+    if headers.get_content_maintype() == 'multipart':
+        boundary = headers.get_param('boundary')
+        if not boundary:
+            return part
+        # The line break before a delimiter belongs to the delimiter, so joining the pieces
+        # gives back the exact body
+        delimiter = re.compile(rb'((?:^|\r?\n)--' + re.escape(str(boundary).encode()) + rb'(?:--)?[ \t]*)(?=\r?\n|$)')
+        pieces = delimiter.split(body)
+        for i in range(2, len(pieces) - 1, 2):
+            line_break = b'\r\n' if pieces[i].startswith(b'\r\n') else b'\n' if pieces[i].startswith(b'\n') else b''
+            pieces[i] = line_break + _map_leaf_parts(pieces[i][len(line_break):], transform)
+        return header_data + separator + b''.join(pieces)
+
+    return header_data + separator + transform(headers, body)
+
+
+def externalize_attachments(raw_email_data, store=None, min_bytes=ATTACHMENT_MIN_BYTES):
+    """
+    Move the (still transfer-encoded) bodies of large attachment parts to the blob store and
+    replace each with a stub line naming its SHA-256, so identical attachments are stored once.
+    Returns the message unchanged when no store is configured.
+    """
+    store = store or get_blob_store()
+    if store is None:
+        return raw_email_data
+
+    def externalize(headers, body):
+        if len(body) < min_bytes or not _is_attachment(headers):
+            return body
+        key = hashlib.sha256(body).hexdigest()
+        if not store.exists(key):
+            store.put(key, body)
+        return b'X-Email-Filter-Blob: sha256:%s:%d' % (key.encode(), len(body))
+
+    return _map_leaf_parts(raw_email_data, externalize)
+
+
+def rehydrate_attachments(raw_data, store=None):
+    """
+    Put the attachment bodies back into a stored message, giving the original bytes. Only an
+    attachment part whose whole body is a stub is replaced, so stub text elsewhere is left alone.
+    """
+    if b'X-Email-Filter-Blob: sha256:' not in raw_data:
+        return raw_data
+    store = store or get_blob_store()
+    if store is None:
+        raise RuntimeError("Email has externalized attachments but ATTACHMENT_STORE is not set")
+
+    def rehydrate(headers, body):
+        match = BLOB_STUB.fullmatch(body)
+        if match is None or not _is_attachment(headers):
+            return body
+        data = store.get(match.group(1).decode())
+        if len(data) != int(match.group(2)):
+            raise RuntimeError(f"Attachment blob {match.group(1).decode()} has the wrong size")
+        return data
+
+    return _map_leaf_parts(raw_data, rehydrate)
@@ -1,16 +1,43 @@
 from .extensions import db
-from .models import Email, EmailAddress, EmailFolder
+from .models import Email, EmailAddress, EmailBlob, EmailFolder, email_folder_links, email_participants, email_receivers
 from bs4 import BeautifulSoup
-from datetime import timedelta
-from email.parser import BytesParser
-from email.policy import default
-from imaplib import IMAP4_SSL
+from datetime import datetime, timedelta
+from imaplib import IMAP4, IMAP4_SSL
 import re
-from email.utils import parsedate_to_datetime
 from email_filter.globals import scan_status
 from email.message import EmailMessage
-from email.utils import getaddresses
+from email_filter.imap_pool import IMAPConnectionPool, get_pool_size, is_throttle_error
+from email_filter.imap_compress import IMAP_COMPRESS, enable_compression
+from email_filter.ingest_pipeline import IngestPipeline, merge_date_ranges, parse_header_addresses, parse_message_id
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import bindparam, func
+from flask import current_app
+from dotenv import load_dotenv
 import logging
+import json
+import os
+import queue
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Fetch batches are sized to a byte budget (using RFC822.SIZE) rather than a fixed count
+FETCH_BATCH_BYTES = int(os.getenv("FETCH_BATCH_BYTES", 4 * 1024 * 1024))
+FETCH_BATCH_MAX_COUNT = int(os.getenv("FETCH_BATCH_MAX_COUNT", 200))
+
+# Messages at or above this size are fetched on their own
+LARGE_MESSAGE_BYTES = int(os.getenv("LARGE_MESSAGE_BYTES", 8 * 1024 * 1024))
+
+# Number of messages whose headers are fetched per round trip in headers-first scans
+HEADER_FETCH_BATCH_SIZE = int(os.getenv("HEADER_FETCH_BATCH_SIZE", 500))
+
+# Headers fetched in the first phase of a headers-first scan
+HEADER_FIELDS = 'FROM TO CC BCC DATE SUBJECT MESSAGE-ID'
+
+# Bounds of the date range of a scan without start and end dates (EmailFolder.synced_ranges)
+SYNC_RANGE_MIN = '0001-01-01'
+SYNC_RANGE_MAX = '9999-12-31'
 
 # Use the global logger
 logger = logging.getLogger(__name__)
@@ -92,11 +119,422 @@ def connect_email_server(data):
         # Use the provided server details directly
         email_client = IMAP4_SSL(data['imap_server'], int(data['imap_port'])) if data['imap_use_ssl'] else IMAP4_SSL(data['imap_server'])
         email_client.login(data['email_address'], data['password'])
+
+        # Servers often advertise extensions such as CONDSTORE only after login
+        status, capabilities = email_client.capability()
+        if status == 'OK' and capabilities and capabilities[-1]:
+            email_client.capabilities = tuple(capabilities[-1].decode().upper().split())
+
+        # Message bodies are mostly text and HTML, compressing the stream cuts the bytes fetched
+        if IMAP_COMPRESS and enable_compression(email_client):
+            logger.debug(f"COMPRESS=DEFLATE enabled for {data['imap_server']}")
         return email_client
     except Exception as e:
         raise Exception(f"Connection failed: {str(e)}")
 
 
+def parse_status_response(response):
+    """Parse a STATUS response such as '"INBOX" (UIDNEXT 44 UIDVALIDITY 1)' into a dict."""
+    text = response.decode(errors='ignore') if isinstance(response, bytes) else str(response)
+    items = text[text.rfind('(') + 1:text.rfind(')')].split()
+    return {
+        items[i].upper(): int(items[i + 1])
+        for i in range(0, len(items) - 1, 2)
+        if items[i + 1].isdigit()
+    }
+
+
+def get_folder_sync_status(email_client, mailbox_name):
+    """Return MESSAGES, UIDVALIDITY, UIDNEXT and, when CONDSTORE is offered, HIGHESTMODSEQ for a mailbox."""
+    items = 'MESSAGES UIDVALIDITY UIDNEXT'
+    if 'CONDSTORE' in email_client.capabilities:
+        items += ' HIGHESTMODSEQ'
+    status, data = email_client.status(mailbox_name, f'({items})')
+    if status != 'OK' or not data or not data[0]:
+        logger.warning(f"Failed to get status for mailbox {mailbox_name}: {data}")
+        return {}
+    return parse_status_response(data[0])
+
+
+def is_folder_unchanged(email_folder, sync_status):
+    """True when the folder checkpoint shows no new UIDs (and no flag changes, if HIGHESTMODSEQ is known)."""
+    if email_folder is None or not email_folder.last_uid:
+        return False
+    if sync_status.get('UIDVALIDITY') != email_folder.uid_validity:
+        return False
+    uid_next = sync_status.get('UIDNEXT')
+    highest_modseq = sync_status.get('HIGHESTMODSEQ')
+    unchanged = uid_next is not None and uid_next <= email_folder.last_uid + 1
+    if highest_modseq is not None and email_folder.highest_modseq is not None:
+        unchanged = unchanged and highest_modseq == email_folder.highest_modseq
+    return unchanged
+
+
+def get_sync_range(start_date, end_date):
+    """Return the [start, end) date range a scan covers as ISO date strings, unbounded unless both dates are set."""
+    if start_date and end_date:
+        return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    return SYNC_RANGE_MIN, SYNC_RANGE_MAX
+
+
+def get_uncovered_ranges(email_folder, sync_range):
+    """
+    Return the parts of sync_range the folder has not been scanned for yet, e.g. after the
+    account's date range was widened. Folders checkpointed before ranges were recorded count
+    as covering any range.
+    """
+    if email_folder is None or not email_folder.last_uid or email_folder.synced_ranges is None:
+        return []
+    start, end = sync_range
+    uncovered = []
+    for synced_start, synced_end in merge_date_ranges(json.loads(email_folder.synced_ranges)):
+        if synced_end <= start:
+            continue
+        if synced_start >= end:
+            break
+        if synced_start > start:
+            uncovered.append((start, synced_start))
+        start = max(start, synced_end)
+    if start < end:
+        uncovered.append((start, end))
+    return uncovered
+
+
+def date_range_criteria(date_range):
+    """IMAP SEARCH criteria for a [start, end) date range, leaving out unbounded ends."""
+    start, end = date_range
+    criteria = []
+    if start != SYNC_RANGE_MIN:
+        criteria.append(f'SINCE "{datetime.strptime(start, "%Y-%m-%d").strftime("%d-%b-%Y")}"')
+    if end != SYNC_RANGE_MAX:
+        criteria.append(f'BEFORE "{datetime.strptime(end, "%Y-%m-%d").strftime("%d-%b-%Y")}"')
+    return ' '.join(criteria)
+
+
+def parse_fetch_uid(response_header):
+    """Extract the UID from a FETCH response header such as b'1 (UID 123 BODY[] {456}'."""
+    match = re.search(rb'UID (\d+)', response_header)
+    return int(match.group(1)) if match else None
+
+
+def compress_uid_set(uids):
+    """Turn a sorted list of UIDs into an IMAP sequence set such as '1:5,7,9:12'."""
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+def fetch_message_headers(email_client, uids):
+    """Return ({uid: header bytes}, {uid: RFC822.SIZE}) for the given UIDs of the selected mailbox."""
+    headers = {}
+    sizes = {}
+    status, data = email_client.uid('FETCH', compress_uid_set(uids),
+                                    f'(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])')
+    if status != 'OK':
+        logger.warning(f"Failed to fetch message headers: {data}")
+        return headers, sizes
+    for response_part in data:
+        if isinstance(response_part, tuple):
+            uid = parse_fetch_uid(response_part[0])
+            match = re.search(rb'RFC822\.SIZE (\d+)', response_part[0])
+            if uid:
+                headers[uid] = response_part[1]
+                if match:
+                    sizes[uid] = int(match.group(1))
+    return headers, sizes
+
+
+def fetch_message_ids(email_client, uids, chunk_size=1000):
+    """Return ({uid: normalized Message-ID}, {uid: RFC822.SIZE}) for the given UIDs of the selected mailbox."""
+    message_ids = {}
+    sizes = {}
+    for i in range(0, len(uids), chunk_size):
+        status, data = email_client.uid('FETCH', compress_uid_set(uids[i:i + chunk_size]),
+                                        '(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        if status != 'OK':
+            logger.warning(f"Failed to fetch message ids: {data}")
+            continue
+        for response_part in data:
+            if isinstance(response_part, tuple):
+                uid = parse_fetch_uid(response_part[0])
+                match = re.search(rb'RFC822\.SIZE (\d+)', response_part[0])
+                if uid and match:
+                    sizes[uid] = int(match.group(1))
+                    message_id = parse_message_id(response_part[1])
+                    if message_id:
+                        message_ids[uid] = message_id
+    return message_ids, sizes
+
+
+def find_stored_copies(email_account_id, message_ids, sizes):
+    """
+    Return the UIDs whose message is already stored for the account, matched by Message-ID and
+    RFC822.SIZE, so only a folder link is needed instead of fetching the body again.
+    """
+    stored = set()
+    unique_ids = list(set(message_ids.values()))
+    for i in range(0, len(unique_ids), 1000):
+        stored.update(db.session.query(Email.message_id, Email.raw_size).filter(
+            Email.email_account_id == email_account_id,
+            Email.message_id.in_(unique_ids[i:i + 1000]),
+            Email.raw_size.isnot(None)
+        ).all())
+    return {uid for uid, message_id in message_ids.items() if (message_id, sizes.get(uid)) in stored}
+
+
+def parse_mailbox_name(mailbox):
+    """Turn a LIST response line into the quoted mailbox name used for SELECT and EmailFolder.folder_name."""
+    mailbox_decoded = mailbox.decode()
+    mailbox_split = mailbox_decoded.split(' "/" ')[-1]
+    mailbox_stripped = mailbox_split.strip('"')
+    mailbox_escaped = mailbox_stripped.replace('"', '\"')
+    return f'"{mailbox_escaped}"'
+
+
+def find_gmail_all_mail(email_client):
+    """Return the name of Gmail's All Mail mailbox (flagged \\All, its name is localized), or None."""
+    status, mailboxes = email_client.list()
+    if status != 'OK':
+        return None
+    for mailbox in mailboxes:
+        if isinstance(mailbox, bytes) and re.search(rb'\(.*\\All\b.*\)', mailbox.split(b' "/" ')[0]):
+            return parse_mailbox_name(mailbox)
+    return None
+
+
+def join_fetch_responses(data):
+    """Join imaplib FETCH data into one bytes line per message, inlining literals as quoted strings."""
+    lines = []
+    continued = False
+    for part in data:
+        if isinstance(part, tuple):
+            literal = b'"' + part[1].replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+            text = re.sub(rb'\{\d+\}$', b'', part[0]) + literal
+            if continued:
+                lines[-1] += text
+            else:
+                lines.append(text)
+            continued = True
+        elif part is not None:
+            if continued:
+                lines[-1] += part
+            else:
+                lines.append(part)
+            continued = False
+    return lines
+
+
+def parse_gmail_labels(line):
+    """Extract the labels from a FETCH response line such as b'1 (X-GM-LABELS (\\Inbox "My Label") UID 5)'."""
+    text = line.decode(errors='replace')
+    pos = text.find('X-GM-LABELS (')
+    if pos < 0:
+        return []
+    pos += len('X-GM-LABELS (')
+    labels = []
+    while pos < len(text):
+        char = text[pos]
+        if char == ')':
+            break
+        if char == ' ':
+            pos += 1
+        elif char == '"':
+            match = re.match(r'"((?:[^"\\]|\\.)*)"', text[pos:])
+            if not match:
+                break
+            labels.append(re.sub(r'\\(.)', r'\1', match.group(1)))
+            pos += match.end()
+        else:
+            match = re.match(r'[^\s()]+', text[pos:])
+            labels.append(match.group(0))
+            pos += match.end()
+    return labels
+
+
+def fetch_gmail_labels(email_client, uids, chunk_size=1000):
+    """Return {uid: [X-GM-LABELS]} for the given UIDs of the selected mailbox."""
+    labels = {}
+    for i in range(0, len(uids), chunk_size):
+        status, data = email_client.uid('FETCH', compress_uid_set(uids[i:i + chunk_size]), '(UID X-GM-LABELS)')
+        if status != 'OK':
+            logger.warning(f"Failed to fetch Gmail labels: {data}")
+            continue
+        for line in join_fetch_responses(data):
+            uid = parse_fetch_uid(line)
+            if uid:
+                labels[uid] = parse_gmail_labels(line)
+    return labels
+
+
+def get_label_folders(user_id, email_account_id, labels, uids, recount=False):
+    """
+    Map Gmail labels to EmailFolder rows, creating the missing ones, and return {uid: [email_folder_id]}.
+    \\Inbox maps to the INBOX folder; other system labels (\\Sent, \\Starred, ...) are not mapped.
+    The folders' email_count is increased by the labeled UIDs, or set from them with recount.
+    """
+    folder_names = {}
+    label_counts = {}
+    for uid in uids:
+        names = []
+        for label in labels.get(uid, []):
+            if label == '\\Inbox':
+                label = 'INBOX'
+            elif label.startswith('\\'):
+                continue
+            names.append(f'"{label}"'[:255])
+        folder_names[uid] = names
+        for name in names:
+            label_counts[name] = label_counts.get(name, 0) + 1
+
+    folders = {folder.folder_name: folder for folder in EmailFolder.query.filter_by(
+        user_id=user_id, email_account_id=email_account_id
+    ).all()}
+    for name, count in label_counts.items():
+        if name in folders:
+            folders[name].email_count = count if recount else folders[name].email_count + count
+        else:
+            folders[name] = EmailFolder(user_id=user_id, email_account_id=email_account_id, folder_name=name,
+                                        email_count=count)
+            db.session.add(folders[name])
+    db.session.commit()
+
+    return {uid: [folders[name].id for name in names] for uid, names in folder_names.items() if names}
+
+
+def get_address_rules(user_id, email_account_id):
+    """Return {email_address: action} for the account's addresses set to include or exclude."""
+    return dict(db.session.query(EmailAddress.email_address, EmailAddress.action).filter(
+        EmailAddress.user_id == user_id,
+        EmailAddress.email_account_id == email_account_id,
+        EmailAddress.action.in_(['include', 'exclude'])
+    ).all())
+
+
+def is_excluded_by_address(header_data, address_rules):
+    """
+    True when the address rules already decide the email is excluded: one of its addresses is
+    set to exclude and none is set to include (include wins, as in process_email_addresses).
+    """
+    try:
+        sender, recipients = parse_header_addresses(header_data)
+    except Exception:
+        return False
+    actions = {address_rules.get(address) for address in [sender, *recipients]}
+    return 'exclude' in actions and 'include' not in actions
+
+
+def plan_fetch_batches(uids, sizes, byte_budget=FETCH_BATCH_BYTES, max_count=FETCH_BATCH_MAX_COUNT,
+                       large_message_bytes=LARGE_MESSAGE_BYTES):
+    """
+    Split sorted UIDs into fetch batches of at most byte_budget bytes and max_count messages.
+    Very large messages get a batch of their own. UIDs without a known size count as 64KB.
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for uid in uids:
+        size = sizes.get(uid, 64 * 1024)
+        if size >= large_message_bytes:
+            if batch:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batches.append([uid])
+            continue
+        if batch and (batch_bytes + size > byte_budget or len(batch) >= max_count):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(uid)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def subtract_email_counts(email_ids):
+    """Take emails that are about to be deleted off the folder and address counters."""
+    folder_counts = Counter(dict(db.session.query(Email.email_folder_id, func.count()).filter(
+        Email.id.in_(email_ids)
+    ).group_by(Email.email_folder_id).all()))
+    folder_counts.update(dict(db.session.query(email_folder_links.c.email_folder_id, func.count()).filter(
+        email_folder_links.c.email_id.in_(email_ids)
+    ).group_by(email_folder_links.c.email_folder_id).all()))
+    for email_folder_id, count in folder_counts.items():
+        db.session.execute(EmailFolder.__table__.update().where(EmailFolder.id == email_folder_id).values(
+            stored_count=func.greatest(EmailFolder.stored_count - count, 0)
+        ))
+
+    address_counts = {}
+    for email_address_id, role, count in db.session.query(
+        email_participants.c.email_address_id, email_participants.c.role, func.count()
+    ).filter(email_participants.c.email_id.in_(email_ids)).group_by(
+        email_participants.c.email_address_id, email_participants.c.role
+    ):
+        counts = address_counts.setdefault(email_address_id, {'b_id': email_address_id, 'sent': 0, 'received': 0, 'emails': 0})
+        counts['sent' if role == 'sender' else 'received'] = count
+    for email_address_id, count in db.session.query(
+        email_participants.c.email_address_id, func.count(func.distinct(email_participants.c.email_id))
+    ).filter(email_participants.c.email_id.in_(email_ids)).group_by(email_participants.c.email_address_id):
+        address_counts[email_address_id]['emails'] = count
+    if address_counts:
+        email_address_table = EmailAddress.__table__
+        db.session.execute(email_address_table.update().where(email_address_table.c.id == bindparam('b_id')).values(
+            count=func.greatest(email_address_table.c.count - bindparam('emails'), 0),
+            sent_count=func.greatest(email_address_table.c.sent_count - bindparam('sent'), 0),
+            received_count=func.greatest(email_address_table.c.received_count - bindparam('received'), 0)
+        ), list(address_counts.values()))
+
+
+def delete_folder_emails(user_id, email_account_id, email_folder_id):
+    """
+    Delete the stored emails of a folder, e.g. after its UIDVALIDITY changed. An email also
+    linked to another folder is kept and moved to that folder, whose checkpoint already covers it.
+    """
+    email_ids = [row[0] for row in db.session.query(Email.id).filter_by(
+        user_id=user_id, email_account_id=email_account_id, email_folder_id=email_folder_id
+    ).all()]
+    batch_size = 1000
+
+    moved = {}
+    for i in range(0, len(email_ids), batch_size):
+        for email_id, link_folder_id, imap_id in db.session.query(
+            email_folder_links.c.email_id, email_folder_links.c.email_folder_id, email_folder_links.c.email_imap_id
+        ).filter(
+            email_folder_links.c.email_id.in_(email_ids[i:i + batch_size]),
+            email_folder_links.c.email_folder_id != email_folder_id
+        ).order_by(email_folder_links.c.email_folder_id):
+            moved.setdefault(email_id, {'b_id': email_id, 'b_folder_id': link_folder_id, 'b_imap_id': imap_id})
+    if moved:
+        # The link becomes the email's own folder and UID, its stored_count stays the same
+        email_table = Email.__table__
+        db.session.execute(email_table.update().where(email_table.c.id == bindparam('b_id')).values(
+            email_folder_id=bindparam('b_folder_id'), email_imap_id=bindparam('b_imap_id')
+        ), list(moved.values()))
+        db.session.execute(email_folder_links.delete().where(
+            email_folder_links.c.email_id == bindparam('b_id'),
+            email_folder_links.c.email_folder_id == bindparam('b_folder_id')
+        ), [{'b_id': row['b_id'], 'b_folder_id': row['b_folder_id']} for row in moved.values()])
+        db.session.commit()
+        email_ids = [email_id for email_id in email_ids if email_id not in moved]
+
+    for i in range(0, len(email_ids), batch_size):
+        batch = email_ids[i:i + batch_size]
+        subtract_email_counts(batch)
+        db.session.execute(email_receivers.delete().where(email_receivers.c.email_id.in_(batch)))
+        db.session.execute(email_folder_links.delete().where(email_folder_links.c.email_id.in_(batch)))
+        db.session.execute(email_participants.delete().where(email_participants.c.email_id.in_(batch)))
+        EmailBlob.query.filter(EmailBlob.email_id.in_(batch)).delete(synchronize_session=False)
+        Email.query.filter(Email.id.in_(batch)).delete(synchronize_session=False)
+        db.session.commit()
+    # The folder may also hold copies of emails stored under another folder
+    db.session.execute(email_folder_links.delete().where(email_folder_links.c.email_folder_id == email_folder_id))
+    EmailFolder.query.filter_by(id=email_folder_id).update({'stored_count': 0})
+    db.session.commit()
+
+
 # Utility function: Normalize email addresses
 def normalize_email(addresses):
     if not addresses:
@@ -118,27 +556,29 @@ def normalize_email(addresses):
     return normalized_emails
 
 
-def get_folders(email_client, account, user_id, start_date, end_date):
-    """Retrieve mailboxes and create EmailFolder entries."""
+def get_folders(email_client, account, user_id, start_date, end_date, sync_mode='incremental', mailbox_names=None):
+    """
+    Retrieve mailboxes and create EmailFolder entries. mailbox_names limits the scan to those mailboxes.
+    Returns {mailbox_name: {'status': STATUS values, 'uids': UIDs in the date range or None}}
+    for the mailboxes with emails, so the fetch stage does not have to ask the server again.
+    """
     try:
         # List all mailboxes
         status, mailboxes = email_client.list()
         if status != 'OK':
             logger.warning("Failed to retrieve mailboxes")
-            return []
+            return {}
 
         # Load all existing folders into a dictionary for quick lookup
         existing_folders = {folder.folder_name: folder for folder in EmailFolder.query.filter_by(user_id=user_id, email_account_id=account.id).all()}
-        mailboxes_with_emails = []
+        mailboxes_with_emails = {}
 
         for mailbox in mailboxes:
             try:
                 # Extract and clean mailbox name
-                mailbox_decoded = mailbox.decode()
-                mailbox_split = mailbox_decoded.split(' "/" ')[-1]
-                mailbox_stripped = mailbox_split.strip('"')
-                mailbox_escaped = mailbox_stripped.replace('"', '\"')
-                mailbox_name = f'"{mailbox_escaped}"'
+                mailbox_name = parse_mailbox_name(mailbox)
+                if mailbox_names is not None and mailbox_name not in mailbox_names:
+                    continue
 
                 # Skip folders that start with "[Gmail]"
                 if mailbox_name.startswith("[Gmail]"):
@@ -149,34 +589,36 @@ def get_folders(email_client, account, user_id, start_date, end_date):
                     logger.info(f"Skipping Notes folder: {mailbox_name}")
                     continue
                 
-                # Use SELECT with readonly=True to get the number of messages without fetching all IDs
-                status, data = email_client.select(mailbox_name, readonly=True)
-                if status != 'OK':
-                    logger.warning(f"Failed to examine mailbox {mailbox_name}: {data}")
+                # One STATUS round trip gives the message count and the UID state for the fetch stage
+                sync_status = get_folder_sync_status(email_client, mailbox_name)
+                if 'MESSAGES' not in sync_status:
                     continue
-
-                # If start_date and end_date are set, filter emails by date range
-                if start_date and end_date:
-                    status, email_ids_data = email_client.search(None, f'(SINCE "{start_date.strftime("%d-%b-%Y")}" BEFORE "{end_date.strftime("%d-%b-%Y")}")')
+                email_count = sync_status['MESSAGES']
+                uids = None
+
+                # If start_date and end_date are set, filter emails by date range. The UIDs found here
+                # are handed to the fetch stage, unless an incremental scan will skip the folder anyway.
+                existing_folder = existing_folders.get(mailbox_name)
+                unchanged = (sync_mode == 'incremental' and is_folder_unchanged(existing_folder, sync_status)
+                             and not get_uncovered_ranges(existing_folder, get_sync_range(start_date, end_date)))
+                if email_count > 0 and start_date and end_date and not unchanged:
+                    status, data = email_client.select(mailbox_name, readonly=True)
+                    if status != 'OK':
+                        logger.warning(f"Failed to examine mailbox {mailbox_name}: {data}")
+                        continue
+                    status, email_ids_data = email_client.uid('SEARCH', None, f'(SINCE "{start_date.strftime("%d-%b-%Y")}" BEFORE "{end_date.strftime("%d-%b-%Y")}")')
                     if status != "OK":
                         logger.warning(f"Failed to search emails in mailbox {mailbox_name}")
                         continue
                     # Count the number of emails in the date range
-                    email_count = len(email_ids_data[0].decode().split()) if email_ids_data[0] else 0
-                else:
-                    status, data = email_client.select(mailbox_name, readonly=True)
-                    if status != 'OK':
-                        logger.warning(f"Failed to examine mailbox {mailbox_name}")
-                        continue
-
-                    # Extract the number of messages from the response
-                    email_count = int(data[0].decode())
+                    uids = sorted(int(uid) for uid in email_ids_data[0].decode().split()) if email_ids_data[0] else []
+                    email_count = len(uids)
 
                 if email_count > 0:
                     # Check if the folder already exists
                     if mailbox_name in existing_folders:
                         logger.info(f"Found existing folder: {mailbox_name}")
-                        mailboxes_with_emails.append(mailbox_name)
+                        mailboxes_with_emails[mailbox_name] = {'status': sync_status, 'uids': uids}
                         continue
 
                     # Truncate the mailbox name to fit the database column size
@@ -195,8 +637,8 @@ def get_folders(email_client, account, user_id, start_date, end_date):
                     db.session.add(new_folder)
                     db.session.commit()  # Commit the folder size
 
-                    # Add mailbox to the list of mailboxes with emails
-                    mailboxes_with_emails.append(mailbox_name)
+                    # Add mailbox to the mailboxes with emails
+                    mailboxes_with_emails[mailbox_name] = {'status': sync_status, 'uids': uids}
                     # Add the new folder to existing folders to prevent future duplicates
                     existing_folders[mailbox_name] = new_folder
             except Exception as e:
@@ -208,219 +650,361 @@ def get_folders(email_client, account, user_id, start_date, end_date):
 
     except Exception as e:
         logger.error(f"Error in get_folders: {str(e)}")
-        return []
+        return {}
 
 
-def read_imap_emails(account, user_id):
+def fetch_email_bodies(email_client, pipeline, user_id, email_account_id, mailbox_name, email_folder_id, batches,
+                       total, label_folders=None, backoff=None):
+    """
+    Fetch the full messages of the planned UID batches into the pipeline, checkpointing after each batch.
+    label_folders ({uid: [email_folder_id]}) links the stored emails to more folders, e.g. their Gmail labels.
+    Throttling responses wait on backoff (the pool's ThrottleBackoff) instead of using up the retries.
+    A batch that cannot be fetched stops the folder, so its checkpoint never moves past missing UIDs.
+    Returns False when the scan was stopped by the user, True otherwise.
+    """
+    fetched = 0
+    for i, batch_ids in enumerate(batches):
+        logger.info(f"{mailbox_name} email batch: {fetched} of {total}")
+        fetched += len(batch_ids)
+        try:
+            # Check if scan_status is "stopping"
+            if scan_status.get((user_id, email_account_id)) == 'stopping':
+                return False
+
+            batch_ids_str = compress_uid_set(batch_ids)
+
+            # Retry logic for fetching emails
+            retries = 3
+            while retries > 0:
+                try:
+                    # Fetch the entire raw email content
+                    status, msg_data = email_client.uid('FETCH', batch_ids_str, "(UID BODY.PEEK[])")
+                    if status == 'OK':
+                        if backoff is not None:
+                            backoff.success()
+                        break
+                    if backoff is not None and is_throttle_error(msg_data):
+                        backoff.wait(msg_data)
+                        continue
+                    logger.warning(f"Error fetching emails: {msg_data}")
+                except (IMAP4.abort, OSError):
+                    # The connection is gone, retrying on it cannot succeed
+                    raise
+                except Exception as e:
+                    if backoff is not None and is_throttle_error(e):
+                        backoff.wait(e)
+                        continue
+                    logger.warning(f"Error fetching emails: {e}")
+                retries -= 1
+                if retries == 0:
+                    raise Exception("Failed to fetch emails after multiple attempts")
+
+            for response_part in msg_data:
+                if isinstance(response_part, tuple):
+                    email_id = parse_fetch_uid(response_part[0])
+                    pipeline.submit(email_folder_id, email_id, response_part[1])
+                    if label_folders and email_id in label_folders:
+                        pipeline.add_folders(email_folder_id, email_id, label_folders[email_id])
+
+            # Advance the folder checkpoint once the writer has stored the batch
+            pipeline.checkpoint(email_folder_id, last_uid=batch_ids[-1])
+        except Exception as e:
+            # Stop here: the next scan resumes the folder from the last committed batch
+            logger.error(f"Error processing emails in batch {i} of {mailbox_name}: {e}")
+            raise
+    return True
+
+
+def ingest_folder(pool, pipeline, user_id, email_account_id, mailbox_name, email_folder_id, sync_mode,
+                  start_date, end_date, headers_first=False, discovery=None, resume=True, gmail_labels=False):
+    """
+    Fetch one mailbox over a pooled connection and hand its emails to the ingest pipeline,
+    checkpointing after every batch. discovery is the mailbox's entry from get_folders.
+    headers_first skips the body of emails an address rule excludes, resume continues after
+    the last committed batch, and gmail_labels links each email to its label folders.
+    Returns False when the scan was stopped by the user, True otherwise.
+    """
+    email_folder = db.session.get(EmailFolder, email_folder_id)
+    discovery = discovery or {}
+
+    with pool.connection() as email_client:
+        # Compare the server's UID state with the folder checkpoint
+        sync_status = discovery.get('status') or get_folder_sync_status(email_client, mailbox_name)
+        uid_validity = sync_status.get('UIDVALIDITY')
+        highest_modseq = sync_status.get('HIGHESTMODSEQ')
+
+        sync_range = get_sync_range(start_date, end_date)
+        uncovered_ranges = []
+        min_uid = 1
+        if sync_mode == 'incremental' and email_folder.uid_validity is not None:
+            if uid_validity != email_folder.uid_validity:
+                # UIDs from the previous scan are no longer valid, resync the folder
+                logger.info(f"UIDVALIDITY changed for {mailbox_name}, resyncing folder")
+                delete_folder_emails(user_id, email_account_id, email_folder.id)
+                email_folder.last_uid = None
+                email_folder.highest_modseq = None
+                email_folder.scan_progress_uid = None
+                email_folder.synced_ranges = None
+            elif email_folder.last_uid:
+                uncovered_ranges = get_uncovered_ranges(email_folder, sync_range)
+                if not uncovered_ranges and is_folder_unchanged(email_folder, sync_status):
+                    logger.info(f"No new emails in {mailbox_name}, skipping")
+                    return True
+                min_uid = email_folder.last_uid + 1
+
+        if uid_validity != email_folder.uid_validity:
+            email_folder.uid_validity = uid_validity
+            email_folder.last_uid = None
+            email_folder.highest_modseq = None
+            email_folder.scan_progress_uid = None
+            email_folder.synced_ranges = None
+            db.session.commit()
+
+        if resume and email_folder.scan_progress_uid:
+            # An earlier scan stopped inside this folder, skip what it already committed
+            logger.info(f"Resuming {mailbox_name} after UID {email_folder.scan_progress_uid}")
+            min_uid = max(min_uid, email_folder.scan_progress_uid + 1)
+
+        # Use SELECT with readonly=True to get the number of messages without fetching all IDs
+        status, data = email_client.select(mailbox_name, readonly=True)
+        if status != 'OK':
+            logger.warning(f"Failed to select mailbox {mailbox_name}: {data}")
+            return True
+
+        if discovery.get('uids') is not None:
+            # The date-range search already ran during folder discovery
+            email_ids = [uid for uid in discovery['uids'] if uid >= min_uid]
+        else:
+            criteria = f'UID {min_uid}:*' if min_uid > 1 else 'ALL'
+            if start_date and end_date:
+                criteria = f'({criteria} SINCE "{start_date.strftime("%d-%b-%Y")}" BEFORE "{end_date.strftime("%d-%b-%Y")}")'
+            status, email_ids_data = email_client.uid('SEARCH', None, criteria)
+            if status != "OK":
+                logger.warning(f"Failed to search emails in mailbox {mailbox_name}")
+                return True
+
+            # Convert email_ids_data from bytes to a sorted list of UIDs
+            # ("n:*" always matches the last message, so drop UIDs below the checkpoint)
+            email_ids = email_ids_data[0].decode().split() if email_ids_data[0] else []
+            email_ids = sorted(int(uid) for uid in email_ids if int(uid) >= min_uid)
+
+        if uncovered_ranges and min_uid > 1:
+            # The date range was widened: the older UIDs are only searched in the new dates
+            gap_ids = set()
+            for uncovered_range in uncovered_ranges:
+                criteria = f'(UID 1:{min_uid - 1} {date_range_criteria(uncovered_range)})'
+                status, email_ids_data = email_client.uid('SEARCH', None, criteria)
+                if status != "OK":
+                    logger.warning(f"Failed to search emails in mailbox {mailbox_name}")
+                    return True
+                gap_ids.update(int(uid) for uid in (email_ids_data[0].decode().split() if email_ids_data[0] else [])
+                               if int(uid) < min_uid)
+            if gap_ids:
+                logger.info(f"{mailbox_name}: fetching {len(gap_ids)} older emails in the widened date range")
+            email_ids = sorted(gap_ids.union(email_ids))
+
+        label_folders = {}
+        if gmail_labels:
+            # One download per message: labels become folder links instead of separate folder walks
+            label_folders = get_label_folders(user_id, email_account_id, fetch_gmail_labels(email_client, email_ids),
+                                              email_ids, recount=min_uid == 1)
+
+        if headers_first:
+            # Two-phase fetch: read the address headers first and skip downloading the body of
+            # every email an address rule already excludes. Those are stored headers-only.
+            address_rules = get_address_rules(user_id, email_account_id)
+            skipped = 0
+            for i in range(0, len(email_ids), HEADER_FETCH_BATCH_SIZE):
+                if scan_status.get((user_id, email_account_id)) == 'stopping':
+                    return False
+                chunk_ids = email_ids[i:i + HEADER_FETCH_BATCH_SIZE]
+                headers, sizes = fetch_message_headers(email_client, chunk_ids)
+
+                message_ids = {}
+                for email_id, header_data in headers.items():
+                    message_id = parse_message_id(header_data)
+                    if message_id:
+                        message_ids[email_id] = message_id
+                stored_ids = find_stored_copies(email_account_id, message_ids, sizes)
+
+                body_ids = []
+                for email_id in chunk_ids:
+                    header_data = headers.get(email_id)
+                    if email_id in stored_ids:
+                        pipeline.link(email_folder_id, email_id, message_ids[email_id], sizes[email_id])
+                    elif header_data is not None and is_excluded_by_address(header_data, address_rules):
+                        pipeline.submit(email_folder_id, email_id, header_data, headers_only=True)
+                        skipped += 1
+                    else:
+                        body_ids.append(email_id)
+                        continue
+                    if email_id in label_folders:
+                        pipeline.add_folders(email_folder_id, email_id, label_folders[email_id])
+
+                if not fetch_email_bodies(email_client, pipeline, user_id, email_account_id, mailbox_name,
+                                          email_folder_id, plan_fetch_batches(body_ids, sizes), len(email_ids),
+                                          label_folders=label_folders, backoff=pool.backoff):
+                    return False
+                pipeline.checkpoint(email_folder_id, last_uid=chunk_ids[-1])
+            logger.info(f"{mailbox_name}: skipped the body of {skipped} excluded emails out of {len(email_ids)}")
+        else:
+            # Size the fetch batches from RFC822.SIZE so a batch of attachments cannot blow memory
+            # while small notifications are fetched many at a time. Messages already stored from
+            # another folder (same Message-ID and size) are only linked, not downloaded again.
+            message_ids, sizes = fetch_message_ids(email_client, email_ids)
+            stored_ids = find_stored_copies(email_account_id, message_ids, sizes)
+            for email_id in email_ids:
+                if email_id in stored_ids:
+                    pipeline.link(email_folder_id, email_id, message_ids[email_id], sizes[email_id])
+                    if email_id in label_folders:
+                        pipeline.add_folders(email_folder_id, email_id, label_folders[email_id])
+            body_ids = [email_id for email_id in email_ids if email_id not in stored_ids]
+            if stored_ids:
+                logger.info(f"{mailbox_name}: linking {len(stored_ids)} emails already stored from another folder")
+            if not fetch_email_bodies(email_client, pipeline, user_id, email_account_id, mailbox_name,
+                                      email_folder_id, plan_fetch_batches(body_ids, sizes), len(email_ids),
+                                      label_folders=label_folders, backoff=pool.backoff):
+                return False
+            if email_ids:
+                pipeline.checkpoint(email_folder_id, last_uid=email_ids[-1])
+
+        # Only record HIGHESTMODSEQ and the covered dates once the whole folder has been read,
+        # and end its resumable scan
+        pipeline.checkpoint(email_folder_id, highest_modseq=highest_modseq, complete=True, synced_range=sync_range)
+
+    return True
+
+
+def read_imap_emails(account, user_id, sync_mode='incremental', parallel=False, headers_first=False, resume=True,
+                     gmail_all_mail=True, job=None):
+    """
+    Scan the account's mailboxes into the Email table, folder by folder (see ingest_folder).
+    sync_mode is 'incremental' (new UIDs only) or 'full'. parallel scans several folders over
+    an IMAP connection pool, and gmail_all_mail fetches Gmail's All Mail once, mapping labels
+    to folders. job is the ScanJob to keep up to date with progress.
+    """
     global scan_status
     if scan_status is None:
         scan_status = {}
 
-    scan_status[(user_id, account.id)] = 'running'
+    if job is None:
+        scan_status[(user_id, account.id)] = 'running'
+    elif scan_status.get((user_id, account.id)) == 'stopping':
+        # submit_scan already set 'running'; /stop_scan came after the job left the queue
+        scan_status[(user_id, account.id)] = 'stopped'
+        return {'success': False, 'error': 'stopped by user request'}
+    pool = None
+    pipeline = None
     try:
-        email_client = connect_email_server({
+        # Snapshot the account: worker threads must not touch ORM objects of this session
+        email_account_id = account.id
+        connection_data = {
             'email_type': account.provider,
             'imap_server': account.imap_server,
             'imap_port': account.imap_port,
             'imap_use_ssl': account.imap_use_ssl,
             'email_address': account.email_address,
             'password': account.password
-        })
+        }
+        pool_size = get_pool_size(account.provider) if parallel else 1
+        pool = IMAPConnectionPool(lambda: connect_email_server(connection_data), pool_size, provider=account.provider)
 
         # Convert start and end dates to the required format
         start_date = account.start_date
         end_date = account.end_date + timedelta(days=1) if account.end_date else None
 
-        # Initialize an empty set for existing email addresses
-        existing_email_addresses = {
-            email_address.email_address: email_address for email_address in EmailAddress.query.filter_by(user_id=user_id, email_account_id=account.id).all()
-        }
-
-        # Initialize a set to keep track of unique email addresses
-        unique_email_addresses = set()
+        # Fetch threads feed the pipeline, which parses in a process pool and writes from one thread
+        pipeline = IngestPipeline(user_id, email_account_id).start()
+        if job is not None:
+            job.pipeline = pipeline
 
         # Get mailboxes with emails
-        mailboxes_with_emails = get_folders(email_client, account, user_id, start_date, end_date)
+        with pool.connection() as email_client:
+            all_mail = None
+            if gmail_all_mail and account.provider == 'GMAIL' and 'X-GM-EXT-1' in email_client.capabilities:
+                all_mail = find_gmail_all_mail(email_client)
+                if all_mail:
+                    logger.info(f"Scanning Gmail labels through {all_mail}")
+            mailboxes_with_emails = get_folders(email_client, account, user_id, start_date, end_date, sync_mode=sync_mode,
+                                                mailbox_names={all_mail} if all_mail else None)
 
         # Retrieve existing folders and their email counts from the Email table
-        existing_folders = {folder.folder_name: folder for folder in EmailFolder.query.filter_by(user_id=user_id, email_account_id=account.id).all()}
+        existing_folders = {folder.folder_name: folder for folder in EmailFolder.query.filter_by(user_id=user_id, email_account_id=email_account_id).all()}
 
+        folders_to_scan = []
         for mailbox_name in mailboxes_with_emails:
+            # Check if the folder already exists
+            if mailbox_name in existing_folders:
+                email_folder = existing_folders[mailbox_name]
+            else:
+                # Create a new EmailFolder entry if it doesn't exist
+                email_folder = EmailFolder(
+                    user_id=user_id,
+                    email_account_id=email_account_id,
+                    folder_name=mailbox_name,
+                    email_count=0  # Initialize with 0, will update later
+                )
+                db.session.add(email_folder)
+                db.session.commit()  # Commit to get the ID
+                existing_folders[mailbox_name] = email_folder  # Add to existing folders
+            folders_to_scan.append((mailbox_name, email_folder.id))
+        if job is not None:
+            job.folders_total = len(folders_to_scan)
+
+        # Folders whose scan raised; the others are still scanned (list.append is thread-safe)
+        failed_folders = []
+
+        def scan_folder(mailbox_name, email_folder_id):
             try:
-                # Check if the folder already exists
-                if mailbox_name in existing_folders:
-                    email_folder = existing_folders[mailbox_name]
-                else:
-                    # Create a new EmailFolder entry if it doesn't exist
-                    email_folder = EmailFolder(
-                        user_id=user_id,
-                        email_account_id=account.id,
-                        folder_name=mailbox_name,
-                        email_count=0  # Initialize with 0, will update later
-                    )
-                    db.session.add(email_folder)
-                    db.session.commit()  # Commit to get the ID
-                    existing_folders[mailbox_name] = email_folder  # Add to existing folders
-
-                # Use SELECT with readonly=True to get the number of messages without fetching all IDs
-                status, data = email_client.select(mailbox_name, readonly=True)
-                if status == 'OK':
-                    if start_date and end_date:
-                        status, email_ids_data = email_client.search(None, f'(SINCE "{start_date.strftime("%d-%b-%Y")}" BEFORE "{end_date.strftime("%d-%b-%Y")}")')
-                    else:
-                        status, email_ids_data = email_client.search(None, "ALL")
-                    if status == "OK":
-                        # Convert email_ids_data from bytes to a list of strings
-                        email_ids = email_ids_data[0].decode().split() if email_ids_data[0] else []
-
-                        # Fetch emails in batches
-                        batch_size = 20  # Define the number of emails to fetch at once
-                        
-                        for i in range(0, len(email_ids), batch_size):
-                            logger.info(f"email batch: {i} of {len(email_ids)}")
-                            try:
-                                # Check if scan_status is "stopping"
-                                if scan_status.get((user_id, account.id)) == 'stopping':
-                                    return {'success': False, 'error': 'stopped by user request'}
-
-                                batch_ids = email_ids[i:i + batch_size]
-                                batch_ids_str = ','.join(batch_ids)
-
-                                # Retry logic for fetching emails
-                                retries = 3
-                                while retries > 0:
-                                    try:
-                                        # Fetch the entire raw email content
-                                        status, msg_data = email_client.fetch(batch_ids_str, "(BODY.PEEK[])")
-                                        if status == 'OK':
-                                            break
-                                    except Exception as e:
-                                        logger.warning(f"Error fetching emails: {e}")
-                                        retries -= 1
-                                        if retries == 0:
-                                            raise Exception("Failed to fetch emails after multiple attempts")
-
-                                for response_part in msg_data:
-                                    try:
-                                        if isinstance(response_part, tuple):
-                                            raw_email_data = response_part[1]
-                                            email_message = BytesParser(policy=default).parsebytes(raw_email_data)
-
-                                            # Extract email metadata
-                                            metadata = {
-                                                "From": email_message.get("From"),
-                                                "To": email_message.get("To"),
-                                                "Date": email_message.get("Date"),
-                                                "Subject": email_message.get("Subject")
-                                            }
-
-                                            email_id = response_part[0].split()[0].decode()
-                                            sender = metadata["From"]
-                                            sender_email = getaddresses([sender])[0][1].lower()
-
-                                            to_recipients = email_message.get_all('To', [])
-                                            cc_recipients = email_message.get_all('Cc', [])
-                                            bcc_recipients = email_message.get_all('Bcc', [])
-                                            all_recipients = getaddresses(to_recipients + cc_recipients + bcc_recipients)
-                                            all_recipients_emails = [email[1].lower() for email in all_recipients if email[1]]
-
-                                            # Add sender and recipients to the unique email addresses set
-                                            if sender_email:
-                                                unique_email_addresses.add(sender_email)
-                                            unique_email_addresses.update(all_recipients_emails)
-
-                                            # Check if the Date header is present and valid
-                                            try:
-                                                email_date = parsedate_to_datetime(metadata["Date"]).strftime('%Y-%m-%d %H:%M:%S')
-                                            except Exception as e:
-                                                email_date = '1970-01-01 00:00:00'
-
-                                            body = email_message.get_body(preferencelist=('plain'))
-                                            if body is not None:
-                                                content = body.get_content()
-                                            else:
-                                                body = email_message.get_body(preferencelist=('html'))
-                                                if body is not None:
-                                                    html_content = body.get_content()
-                                                    soup = BeautifulSoup(html_content, 'html.parser')
-                                                    content = soup.get_text()
-                                                else:
-                                                    content = "No content available"
-
-                                            email_subject = email_message['Subject']
-                                            email_body = ' '.join(content.split())
-                                            text_content = f"{email_subject} {email_body}"
-
-                                            # Fetch or create EmailAddress for sender
-                                            if sender_email not in existing_email_addresses:
-                                                sender_email_address = EmailAddress(
-                                                    email_address=sender_email,
-                                                    user_id=user_id,
-                                                    email_account_id=account.id,
-                                                    count=1  # Initialize count
-                                                )
-                                                db.session.add(sender_email_address)
-                                                db.session.commit()
-                                                existing_email_addresses[sender_email] = sender_email_address
-                                            else:
-                                                sender_email_address = existing_email_addresses[sender_email]
-                                                sender_email_address.count += 1  # Increment count
-
-                                            # Fetch or create EmailAddress for each receiver
-                                            receiver_email_addresses = []
-                                            for address in all_recipients_emails:
-                                                if address not in existing_email_addresses:
-                                                    email_address = EmailAddress(
-                                                        email_address=address,
-                                                        user_id=user_id,
-                                                        email_account_id=account.id,
-                                                        count=1  # Initialize count
-                                                    )
-                                                    db.session.add(email_address)
-                                                    db.session.commit()
-                                                    existing_email_addresses[address] = email_address
-                                                else:
-                                                    email_address = existing_email_addresses[address]
-                                                    email_address.count += 1  # Increment count
-                                                receiver_email_addresses.append(email_address)
-
-                                            # Create a new email record
-                                            email = Email(
-                                                user_id=user_id,
-                                                email_account_id=account.id,
-                                                email_folder_id=email_folder.id,
-                                                email_date=email_date,
-                                                sender_id=sender_email_address.id,
-                                                receivers=receiver_email_addresses,
-                                                raw_data=raw_email_data,
-                                                email_subject=email_subject[:250],
-                                                text_content=text_content
-                                            )
-                                            db.session.add(email)
-                                            db.session.commit()
-
-                                    except Exception as e:
-                                        logger.error(f"Error processing email {email_id}: {e}")
-                                        continue
-                                # Insert new email addresses into the EmailAddress table
-                                new_email_addresses = unique_email_addresses - set(existing_email_addresses.keys())
-                                for email_address in new_email_addresses:
-                                    if email_address not in existing_email_addresses:
-                                        new_email_address = EmailAddress(user_id=user_id, email_account_id=account.id, email_address=email_address)
-                                        db.session.add(new_email_address)
-                                        existing_email_addresses[email_address] = new_email_address
-
-                                # Update the email count for the folder
-                                # email_folder.email_count += len(batch_ids)
-                                db.session.commit()  # Commit after processing each batch
-                            except Exception as e:
-                                logger.error(f"Error processing emails in batch {i}: {e}")
-                                # continue
-
+                completed = ingest_folder(pool, pipeline, user_id, email_account_id, mailbox_name, email_folder_id,
+                                          sync_mode, start_date, end_date, headers_first=headers_first,
+                                          discovery=mailboxes_with_emails[mailbox_name], resume=resume,
+                                          gmail_labels=mailbox_name == all_mail)
+                if completed and job is not None:
+                    job.folder_done()
+                return completed
             except Exception as e:
                 logger.error(f"Error processing emails in mailbox {mailbox_name}: {e}")
-                # continue
-
+                db.session.rollback()
+                failed_folders.append(mailbox_name)
+                if job is not None:
+                    job.folder_failed(mailbox_name)
+                return True
+
+        if pool_size > 1 and len(folders_to_scan) > 1:
+            app = current_app._get_current_object()
+            folder_queue = queue.Queue()
+            for folder in folders_to_scan:
+                folder_queue.put(folder)
+
+            def worker():
+                # Each worker gets its own app context and therefore its own DB session
+                with app.app_context():
+                    while scan_status.get((user_id, email_account_id)) != 'stopping':
+                        try:
+                            mailbox_name, email_folder_id = folder_queue.get_nowait()
+                        except queue.Empty:
+                            return
+                        if not scan_folder(mailbox_name, email_folder_id):
+                            return
+
+            logger.info(f"Scanning {len(folders_to_scan)} folders over {pool_size} connections")
+            with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                workers = [executor.submit(worker) for _ in range(min(pool_size, len(folders_to_scan)))]
+                for future in workers:
+                    future.result()
+        else:
+            for mailbox_name, email_folder_id in folders_to_scan:
+                if not scan_folder(mailbox_name, email_folder_id):
+                    break
+
+        # Raises if the writer failed, so the scan is not reported as a success
+        pipeline.close()
+        if scan_status.get((user_id, email_account_id)) == 'stopping':
+            return {'success': False, 'error': 'stopped by user request', 'failed_folders': failed_folders}
+        if failed_folders:
+            return {'success': False, 'error': f"{len(failed_folders)} of {len(folders_to_scan)} folders failed: "
+                                               f"{', '.join(failed_folders)}", 'failed_folders': failed_folders}
         return {'success': True}
 
     except Exception as e:
@@ -428,6 +1012,12 @@ def read_imap_emails(account, user_id):
         return {'success': False, 'error': str(e)}
 
     finally:
-        if account.provider == 'IMAP':
-            email_client.logout()
+        if pipeline is not None:
+            # Persist whatever was already fetched, even when stopped (a no-op after the close above)
+            try:
+                pipeline.close()
+            except Exception as e:
+                logger.error(f"Error closing the ingest pipeline: {e}")
+        if pool is not None:
+            pool.close_all()
         scan_status[(user_id, account.id)] = 'stopped'
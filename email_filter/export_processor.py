@@ -18,7 +18,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from flask import current_app
 
 # Local Application Imports
-from .models import Email, EmailAddress, Filter, AIPrompt, Result, EmailAccount
+from .models import Email, EmailBlob, EmailAddress, Filter, AIPrompt, Result, ResultLog, EmailAccount, email_participants
 from .extensions import db
 from .aws import (
     SpotInstanceManager,
@@ -27,8 +27,10 @@ from .aws import (
     upload_file_to_s3,
     generate_presigned_url,
 )
-from email_filter.logger import update_log_entry
+from email_filter.logger import flush_log, update_log_entry
 from email_filter.globals import processing_status
+from email_filter.blob_store import rehydrate_attachments
+from email_filter.raw_codec import decode_raw_data
 
 
 # Load environment variables from .env file
@@ -69,7 +71,7 @@ logger = logging.getLogger(__name__)
 
 def log_debug(user_id, email_account_id, message):
     if DEBUG_MODE:
-        update_log_entry(user_id, email_account_id, f"DEBUG: {message}")
+        update_log_entry(user_id, email_account_id, f"DEBUG: {message}", debug=True)
 
 def stop(user_id, email_account_id):
     log_debug(user_id, email_account_id, "Entering stop function")
@@ -154,9 +156,9 @@ async def process_emails(user_id, email_account_id):
                 result.name = mbox_filename
                 result.file_url = presigned_url
                 result.status = 'finished'
-                result.log_entry = result.log_entry + '\nProcessing finished'
                 db.session.add(result)
             db.session.commit()
+            update_log_entry(user_id, email_account_id, "Processing finished", status='finished')
         except Exception as e:
             log_entry = f"Error generating files: {e}"
             update_log_entry(user_id, email_account_id, log_entry, status='error')
@@ -183,6 +185,9 @@ def preprocess_cleanup(user_id, email_account_id):
         return
 
     try:
+        # Write the queued log lines of the previous run before its Result goes away
+        flush_log()
+
         # Delete existing Result entry for the user and account
         existing_results = Result.query.filter_by(user_id=user_id, email_account_id=email_account_id)
         if existing_results:
@@ -192,7 +197,8 @@ def preprocess_cleanup(user_id, email_account_id):
                     # Delete existing file from S3
                     delete_file_from_s3(bucket_name, result.name)
 
-                # delete the result entry
+                # delete the result entry and its log
+                ResultLog.query.filter_by(result_id=result.id).delete()
                 db.session.delete(result)
             db.session.commit()        
     except Exception as e:
@@ -219,52 +225,34 @@ def process_email_addresses(user_id, email_account_id):
     total_included = 0
     total_excluded = 0
 
-    # Subquery for emails to include
-    include_subquery = db.session.query(Email.id).join(
-        EmailAddress, Email.sender_id == EmailAddress.id
+    # Subquery for emails to include: the address is their sender or one of their receivers
+    include_subquery = db.session.query(email_participants.c.email_id).join(
+        EmailAddress, email_participants.c.email_address_id == EmailAddress.id
     ).filter(
+        email_participants.c.email_account_id == email_account_id,
         EmailAddress.user_id == user_id,
         EmailAddress.email_account_id == email_account_id,
-        EmailAddress.action == 'include',
-        Email.action == 'ignore'
-    ).union(
-        db.session.query(Email.id).join(
-            Email.receivers
-        ).filter(
-            EmailAddress.user_id == user_id,
-            EmailAddress.email_account_id == email_account_id,
-            EmailAddress.action == 'include',
-            Email.action == 'ignore'
-        )
+        EmailAddress.action == 'include'
     ).subquery()
 
     # Update emails to include
-    include_emails = db.session.query(Email).filter(Email.id.in_(include_subquery)).all()
+    include_emails = db.session.query(Email).filter(Email.id.in_(include_subquery), Email.action == 'ignore').all()
     for email in include_emails:
         email.action = 'include'
         total_included += 1
 
-    # Subquery for emails to exclude
-    exclude_subquery = db.session.query(Email.id).join(
-        EmailAddress, Email.sender_id == EmailAddress.id
+    # Subquery for emails to exclude: the address is their sender or one of their receivers
+    exclude_subquery = db.session.query(email_participants.c.email_id).join(
+        EmailAddress, email_participants.c.email_address_id == EmailAddress.id
     ).filter(
+        email_participants.c.email_account_id == email_account_id,
         EmailAddress.user_id == user_id,
         EmailAddress.email_account_id == email_account_id,
-        EmailAddress.action == 'exclude',
-        Email.action == 'ignore'
-    ).union(
-        db.session.query(Email.id).join(
-            Email.receivers
-        ).filter(
-            EmailAddress.user_id == user_id,
-            EmailAddress.email_account_id == email_account_id,
-            EmailAddress.action == 'exclude',
-            Email.action == 'ignore'
-        )
+        EmailAddress.action == 'exclude'
     ).subquery()
 
     # Update emails to exclude
-    exclude_emails = db.session.query(Email).filter(Email.id.in_(exclude_subquery)).all()
+    exclude_emails = db.session.query(Email).filter(Email.id.in_(exclude_subquery), Email.action == 'ignore').all()
     for email in exclude_emails:
         email.action = 'exclude'
         total_excluded += 1
@@ -634,12 +622,22 @@ def generate_files(user_id, email_account_id):
         mbox_path = os.path.join(tempfile.gettempdir(), mbox_filename)
         mbox = mailbox.mbox(mbox_path, create=True)
 
+        headers_only_count = db.session.query(Email.id).filter_by(
+            user_id=user_id, email_account_id=email_account_id, action='include', headers_only=True
+        ).count()
+        if headers_only_count:
+            update_log_entry(user_id, email_account_id, f"{headers_only_count} included emails were scanned headers-only and are exported without their body. Clear the emails and rescan without headers_first to fetch them.")
+
         try:
-            query = db.session.query(Email).filter_by(
-                user_id=user_id, email_account_id=email_account_id, action='include'
+            # Only the raw messages are read, joined from the narrow email table
+            query = db.session.query(EmailBlob.raw_data).join(Email, Email.id == EmailBlob.email_id).filter(
+                Email.user_id == user_id,
+                Email.email_account_id == email_account_id,
+                Email.action == 'include'
             )
-            for email in query.yield_per(100):
-                mbox.add(mailbox.mboxMessage(email.raw_data))
+            for raw_data, in query.yield_per(100):
+                # Decompress the stored message and put back the attachments moved to the blob store
+                mbox.add(mailbox.mboxMessage(rehydrate_attachments(decode_raw_data(raw_data))))
         finally:
             mbox.close()
 
@@ -1,4 +1,7 @@
 # Define scan_status as a global variable
 scan_status = {}
 
+# Background scan jobs by job id (see scan_jobs)
+scan_jobs = {}
+
 processing_status = {}
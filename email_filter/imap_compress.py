@@ -0,0 +1,90 @@
+import os
+import zlib
+import imaplib
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+# Negotiate COMPRESS=DEFLATE (RFC 4978) when the server offers it
+IMAP_COMPRESS = os.getenv("IMAP_COMPRESS", "true").lower() == "true"
+
+# zlib level for what we send; commands are tiny, so favour speed
+IMAP_COMPRESS_LEVEL = int(os.getenv("IMAP_COMPRESS_LEVEL", 1))
+
+# Bytes read from the socket per recv call
+RECV_SIZE = 64 * 1024
+
+
+class DeflateStream:
+    """Raw DEFLATE stream over an IMAP connection's socket, with the read/readline/send calls imaplib uses."""
+
+    def __init__(self, sock, level=IMAP_COMPRESS_LEVEL):
+        self.sock = sock
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        self._buffer = bytearray()
+
+    def send(self, data):
+        # Sync-flush every command so the server can decompress it right away
+        self.sock.sendall(self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def read(self, size):
+        while len(self._buffer) < size and self._fill():
+            pass
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self):
+        start = 0
+        while True:
+            end = self._buffer.find(b'\n', start)
+            if end >= 0:
+                break
+            start = len(self._buffer)
+            if not self._fill():
+                end = len(self._buffer) - 1
+                break
+        data = bytes(self._buffer[:end + 1])
+        del self._buffer[:end + 1]
+        return data
+
+    def _fill(self):
+        """Read and inflate more data from the socket. False when the connection was closed."""
+        chunk = self.sock.recv(RECV_SIZE)
+        if not chunk:
+            return False
+        self._buffer += self._decompressor.decompress(chunk)
+        return True
+
+
+def enable_compression(email_client):
+    """
+    Switch an authenticated IMAP connection to COMPRESS=DEFLATE if the server advertises it.
+    Returns True when the connection is now compressed.
+    """
+    if 'COMPRESS=DEFLATE' not in email_client.capabilities:
+        return False
+
+    # imaplib does not know the command, allow it in the authenticated states
+    imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+    try:
+        status, data = email_client._simple_command('COMPRESS', 'DEFLATE')
+    except email_client.error as e:
+        logger.warning(f"COMPRESS DEFLATE refused: {e}")
+        return False
+    if status != 'OK':
+        logger.warning(f"COMPRESS DEFLATE refused: {data}")
+        return False
+
+    # Everything after the tagged OK is compressed in both directions
+    stream = DeflateStream(email_client.sock)
+    email_client.read = stream.read
+    email_client.readline = stream.readline
+    email_client.send = stream.send
+    return True
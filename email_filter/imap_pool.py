@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import queue
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from imaplib import IMAP4
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+# Maximum number of concurrent IMAP connections per provider. Providers enforce their
+# own per-account connection limits (Gmail allows 15, iCloud is much stricter), so keep
+# these below the provider limit to leave room for the user's own mail clients.
+IMAP_POOL_SIZES = {
+    'GMAIL': int(os.getenv("IMAP_POOL_SIZE_GMAIL", 8)),
+    'APPLE': int(os.getenv("IMAP_POOL_SIZE_APPLE", 3)),
+    'OFFICE': int(os.getenv("IMAP_POOL_SIZE_OFFICE", 4)),
+}
+DEFAULT_IMAP_POOL_SIZE = int(os.getenv("IMAP_POOL_SIZE", 2))
+
+# Backoff after a throttling response: doubles from the base delay up to the maximum (seconds)
+THROTTLE_BACKOFF_BASE = float(os.getenv("THROTTLE_BACKOFF_BASE", 5))
+THROTTLE_BACKOFF_MAX = float(os.getenv("THROTTLE_BACKOFF_MAX", 300))
+
+# Consecutive throttling responses tolerated before giving up
+THROTTLE_MAX_RETRIES = int(os.getenv("THROTTLE_MAX_RETRIES", 8))
+
+# Server responses that mean "slow down" rather than a real failure
+THROTTLE_PATTERN = re.compile(
+    r'too many (simultaneous )?connections|\[THROTTLED\]|\[UNAVAILABLE\]|\[LIMIT\]|rate limit|'
+    r'bandwidth limit|try again later|server busy|server unavailable',
+    re.IGNORECASE
+)
+
+# Monotonic time until which each provider is cooling down after throttling us
+provider_cooldowns = {}
+
+
+def get_pool_size(provider):
+    """Return the connection pool size configured for a provider."""
+    return max(1, IMAP_POOL_SIZES.get(provider, DEFAULT_IMAP_POOL_SIZE))
+
+
+def is_throttle_error(error):
+    """True when an exception or IMAP response text says the server is throttling us."""
+    if isinstance(error, (list, tuple)):
+        error = b' '.join(part if isinstance(part, bytes) else str(part).encode() for part in error if part)
+    if isinstance(error, bytes):
+        error = error.decode(errors='ignore')
+    return bool(THROTTLE_PATTERN.search(str(error)))
+
+
+def get_provider_cooldown(provider):
+    """Seconds until the provider's throttling cooldown ends (0 when it is not cooling down)."""
+    return max(0.0, provider_cooldowns.get(provider, 0) - time.monotonic())
+
+
+class ThrottleBackoff:
+    """Exponential backoff with jitter for throttling responses, shared by the connections of one account."""
+
+    def __init__(self, provider=None, base=THROTTLE_BACKOFF_BASE, maximum=THROTTLE_BACKOFF_MAX,
+                 max_retries=THROTTLE_MAX_RETRIES):
+        self.provider = provider
+        self.base = base
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def wait(self, error):
+        """Sleep after a throttling response. Raises the error once max_retries is exceeded in a row."""
+        with self._lock:
+            self.failures += 1
+            failures = self.failures
+            delay = min(self.maximum, self.base * 2 ** (failures - 1))
+            if self.provider:
+                # Let the scan scheduler hold back new scans for this provider meanwhile
+                provider_cooldowns[self.provider] = max(provider_cooldowns.get(self.provider, 0),
+                                                        time.monotonic() + delay)
+        if failures > self.max_retries:
+            raise error if isinstance(error, BaseException) else Exception(f"Throttled by server: {error}")
+        delay *= random.uniform(0.5, 1.0)
+        logger.warning(f"Throttled by server, backing off {delay:.0f}s (attempt {failures}): {error}")
+        time.sleep(delay)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+
+class IMAPConnectionPool:
+    """A bounded pool of authenticated IMAP connections for one account."""
+
+    def __init__(self, connect, size, provider=None):
+        self._connect = connect
+        self.size = size
+        # Lowered to the number of open connections when the server refuses more
+        self.limit = size
+        self.backoff = ThrottleBackoff(provider)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def acquire(self):
+        """
+        Take an idle connection, opening a new one while below the pool size. When the server
+        throttles new connections, back off and retry, or wait for one of the open connections.
+        """
+        self._slots.acquire()
+        while True:
+            try:
+                return self._idle.get(timeout=1) if self._at_limit() else self._idle.get_nowait()
+            except queue.Empty:
+                if self._at_limit():
+                    continue
+
+            try:
+                email_client = self._connect()
+            except Exception as e:
+                if not is_throttle_error(e):
+                    self._slots.release()
+                    raise
+                with self._lock:
+                    if self._connections:
+                        # The server allows no more connections for this account, share the open ones
+                        self.limit = len(self._connections)
+                        logger.warning(f"Server refused more connections, limiting the pool to {self.limit}: {e}")
+                        continue
+                try:
+                    self.backoff.wait(e)
+                except Exception:
+                    self._slots.release()
+                    raise
+                continue
+
+            self.backoff.success()
+            with self._lock:
+                self._connections.append(email_client)
+            return email_client
+
+    def _at_limit(self):
+        with self._lock:
+            return len(self._connections) >= self.limit
+
+    def release(self, email_client, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable."""
+        if discard:
+            self._close(email_client)
+        else:
+            self._idle.put(email_client)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block."""
+        email_client = self.acquire()
+        try:
+            yield email_client
+        except (IMAP4.abort, OSError):
+            # The connection is broken, do not hand it out again
+            self.release(email_client, discard=True)
+            raise
+        except BaseException:
+            self.release(email_client)
+            raise
+        else:
+            self.release(email_client)
+
+    def close_all(self):
+        """Log out of every connection opened by the pool."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for email_client in connections:
+            try:
+                email_client.logout()
+            except Exception as e:
+                logger.debug(f"Error logging out of IMAP connection: {e}")
+
+    def _close(self, email_client):
+        with self._lock:
+            if email_client in self._connections:
+                self._connections.remove(email_client)
+        try:
+            email_client.logout()
+        except Exception as e:
+            logger.debug(f"Error logging out of IMAP connection: {e}")
@@ -0,0 +1,760 @@
+import os
+import json
+import queue
+import hashlib
+import logging
+import threading
+import unicodedata
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+from email.policy import default
+from email.utils import getaddresses, parsedate_to_datetime
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import OperationalError
+from .extensions import db
+from .models import Email, EmailAddress, EmailBlob, EmailFolder, email_folder_links, email_participants, email_receivers
+from .blob_store import externalize_attachments
+from .raw_codec import encode_raw_data
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of processes used to parse MIME messages (0 parses in the writer thread)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))
+
+# Maximum number of fetched messages waiting to be parsed and written
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 200))
+
+# Maximum bytes of raw messages held between fetch and commit
+PIPELINE_MAX_BYTES = int(os.getenv("PIPELINE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Maximum number of emails the writer inserts per transaction
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 500))
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+
+def get_email_addresses(email_message):
+    """
+    Return the lower-cased sender address and the To/Cc/Bcc addresses of a parsed message,
+    cut to the 255 characters EmailAddress.email_address stores.
+    """
+    sender = email_message.get("From")
+    sender_email = getaddresses([sender])[0][1].lower()[:255]
+
+    to_recipients = email_message.get_all('To', [])
+    cc_recipients = email_message.get_all('Cc', [])
+    bcc_recipients = email_message.get_all('Bcc', [])
+    all_recipients = getaddresses(to_recipients + cc_recipients + bcc_recipients)
+    all_recipients_emails = [email[1].lower()[:255] for email in all_recipients if email[1]]
+    return sender_email, all_recipients_emails
+
+
+def address_key(address):
+    """
+    Return the form under which EmailAddress.email_address values compare equal: MySQL's default
+    collation (utf8mb4_0900_ai_ci) ignores case and accents, so "José@x" and "jose@x" are one row.
+    """
+    decomposed = unicodedata.normalize('NFKD', address[:255])
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def normalize_message_id(message_id):
+    """Normalize a Message-ID header for de-duplication: no angle brackets or folding whitespace."""
+    if not message_id:
+        return None
+    message_id = ''.join(str(message_id).split()).strip('<>')
+    return message_id[:255] or None
+
+
+def parse_message_id(header_data):
+    """Return the normalized Message-ID of a header-only fetch."""
+    email_message = BytesParser(policy=default).parsebytes(header_data, headersonly=True)
+    return normalize_message_id(email_message.get('Message-ID'))
+
+
+def parse_header_addresses(header_data):
+    """Parse the addresses from a header-only fetch, without touching any body parts."""
+    email_message = BytesParser(policy=default).parsebytes(header_data, headersonly=True)
+    return get_email_addresses(email_message)
+
+
+def parse_raw_email(raw_email_data):
+    """
+    Parse a raw RFC 822 message into the address, subject, date and text fields stored on Email.
+    Runs in the parse process pool, so it must stay a top-level function returning plain values.
+    """
+    email_message = BytesParser(policy=default).parsebytes(raw_email_data)
+
+    sender_email, all_recipients_emails = get_email_addresses(email_message)
+
+    # Check if the Date header is present and valid
+    try:
+        email_date = parsedate_to_datetime(email_message.get("Date")).strftime('%Y-%m-%d %H:%M:%S')
+    except Exception:
+        email_date = '1970-01-01 00:00:00'
+
+    body = email_message.get_body(preferencelist=('plain'))
+    if body is not None:
+        content = body.get_content()
+    else:
+        body = email_message.get_body(preferencelist=('html'))
+        if body is not None:
+            html_content = body.get_content()
+            soup = BeautifulSoup(html_content, 'html.parser')
+            content = soup.get_text()
+        else:
+            content = "No content available"
+
+    # Header values are str subclasses that cannot be pickled back to the parent process
+    email_subject = str(email_message['Subject'] or '')
+    email_body = ' '.join(content.split())
+
+    # With ATTACHMENT_STORE set, large attachments are stored outside the database
+    try:
+        stored_data = externalize_attachments(raw_email_data)
+    except Exception as e:
+        logger.warning(f"Failed to externalize attachments, storing the message inline: {e}")
+        stored_data = raw_email_data
+    # and with RAW_DATA_CODEC set, the message is stored compressed
+    stored_data = encode_raw_data(stored_data)
+
+    return {
+        'sender': sender_email,
+        'recipients': all_recipients_emails,
+        'email_date': email_date,
+        'email_subject': email_subject,
+        'text_content': f"{email_subject} {email_body}",
+        'message_id': normalize_message_id(email_message.get('Message-ID')),
+        'content_hash': hashlib.sha256(raw_email_data).hexdigest(),
+        'raw_size': len(raw_email_data),
+        'raw_data': stored_data if stored_data != raw_email_data else None,
+    }
+
+
+def merge_date_ranges(ranges):
+    """Merge [start, end) ranges of ISO date strings into sorted, non-overlapping ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class IngestPipeline:
+    """
+    Bounded producer/consumer pipeline for storing fetched emails.
+
+    Fetch threads submit raw messages, a process pool parses them and a single writer
+    thread persists them in submission order. The writer buffers emails until the next
+    checkpoint (the end of a fetch batch), then inserts them with multi-row INSERTs and
+    commits them together with the checkpoint.
+
+    A message already stored for the account (same Message-ID and content hash) is not
+    stored again: its folder is added to email_folder_links instead. add_folders links an
+    email to further folders the same way, e.g. to its Gmail labels.
+    """
+
+    def __init__(self, user_id, email_account_id, parse_workers=PARSE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                 max_bytes=PIPELINE_MAX_BYTES):
+        self.user_id = user_id
+        self.email_account_id = email_account_id
+        self.parse_workers = parse_workers
+        self.max_bytes = max_bytes
+        self._inflight_bytes = 0
+        self._inflight = threading.Condition()
+        self._app = current_app._get_current_object()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._writer = None
+        self._closed = False
+        # Exception that stopped the writer thread, raised again by submit and close
+        self.error = None
+        self.address_ids = {}
+        self._pending = []
+        self._pending_links = []
+        self._pending_folders = []
+        self._new_addresses = []
+        # Folders with writes since the last commit, and folders that lost a batch write or commit:
+        # a failed folder is not checkpointed any further, so the next scan fetches the lost UIDs
+        # again. A message that cannot be parsed or stored on its own is only counted in errors.
+        self._uncommitted_folders = set()
+        self.failed_folders = set()
+        self.written = 0
+        self.errors = 0
+        # Progress counters for scan jobs: messages fetched or linked, and bytes fetched
+        self.fetched = 0
+        self.fetched_bytes = 0
+
+    def start(self):
+        """Start the writer thread."""
+        self._writer = threading.Thread(target=self._write_loop, name=f"ingest-writer-{self.email_account_id}", daemon=True)
+        self._writer.start()
+        return self
+
+    def submit(self, email_folder_id, uid, raw_email_data, headers_only=False):
+        """
+        Queue a fetched message for parsing and writing. Blocks while the pipeline is full.
+        headers_only marks a message whose body was never fetched (raw_email_data holds its headers).
+        """
+        size = len(raw_email_data)
+        with self._inflight:
+            # A message larger than the whole budget is still let through on its own
+            while self._inflight_bytes and self._inflight_bytes + size > self.max_bytes and self.error is None:
+                self._inflight.wait()
+            self._raise_error()
+            self._inflight_bytes += size
+            self.fetched += 1
+            self.fetched_bytes += size
+
+        if self.parse_workers > 0:
+            parsed = self._get_executor().submit(parse_raw_email, raw_email_data)
+        else:
+            parsed = None
+        self._queue.put(('email', email_folder_id, uid, raw_email_data, parsed, headers_only))
+
+    def link(self, email_folder_id, uid, message_id, raw_size):
+        """Queue a link from a folder to the stored email with this Message-ID and size, instead of fetching it."""
+        self._raise_error()
+        with self._inflight:
+            self.fetched += 1
+        self._queue.put(('link', email_folder_id, uid, message_id, raw_size))
+
+    def add_folders(self, email_folder_id, uid, folder_ids):
+        """Queue links from more folders (e.g. Gmail labels) to the email submitted or linked for this folder and UID."""
+        self._queue.put(('folders', email_folder_id, uid, folder_ids))
+
+    def checkpoint(self, email_folder_id, last_uid=None, highest_modseq=None, complete=False, synced_range=None):
+        """
+        Queue a folder checkpoint to be committed after the messages submitted before it.
+        complete marks the end of the folder, so the next scan no longer resumes it.
+        synced_range is the (start, end) date range the completed scan covered.
+        """
+        self._queue.put(('checkpoint', email_folder_id, last_uid, highest_modseq, complete, synced_range))
+
+    def close(self):
+        """Write everything still queued, then stop the writer and the parse pool. Raises the writer's error, if any."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            if self._writer is not None:
+                self._writer.join()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Ingest writer for account {self.email_account_id} failed: {self.error}") from self.error
+
+    def _release(self, size):
+        with self._inflight:
+            self._inflight_bytes -= size
+            self._inflight.notify_all()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawn rather than fork: the parent holds threads, sockets and DB connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _write_loop(self):
+        with self._app.app_context():
+            try:
+                self._run()
+            except Exception as e:
+                # Unblock and fail the producers instead of leaving them waiting on a dead writer
+                logger.error(f"Ingest writer for account {self.email_account_id} failed: {e}")
+                with self._inflight:
+                    self.error = e
+                    self._inflight.notify_all()
+                self._discard_queue()
+            finally:
+                db.session.remove()
+
+    def _discard_queue(self):
+        """Drop queued items until close() is called, so producers blocked on the full queue get through."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if item[0] == 'email':
+                self._release(len(item[3]))
+
+    def _run(self):
+        # Compact map of existing email addresses (by address_key) to their ids, only touched by this thread
+        self.address_ids = {
+            address_key(address): address_id
+            for address, address_id in db.session.query(EmailAddress.email_address, EmailAddress.id).filter_by(
+                user_id=self.user_id, email_account_id=self.email_account_id
+            )
+        }
+
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                # Fetching is slower than writing, store what is buffered and free its bytes
+                try:
+                    self._flush()
+                    self._commit()
+                except Exception as e:
+                    logger.error(f"Error writing email batch: {e}")
+                    self._rollback()
+                continue
+            if item is None:
+                break
+            try:
+                if item[0] == 'email':
+                    self._add_email(*item[1:])
+                elif item[0] == 'link':
+                    self._add_link(*item[1:])
+                elif item[0] == 'folders':
+                    self._pending_folders.append(item[1:])
+                else:
+                    self._write_checkpoint(*item[1:])
+            except Exception as e:
+                # A message that fails to parse is skipped; a failed commit marks its folders in _rollback
+                self.errors += 1
+                logger.error(f"Error writing {item[0]} for folder {item[1]} UID {item[2]}: {e}")
+                self._rollback()
+
+        try:
+            self._flush()
+            self._commit()
+        except Exception as e:
+            logger.error(f"Error writing final email batch: {e}")
+            self._rollback()
+
+    def _rollback(self):
+        """Roll back the transaction, marking the folders it wrote to as failed, and forget uncommitted address ids."""
+        db.session.rollback()
+        for address in self._new_addresses:
+            self.address_ids.pop(address, None)
+        self._new_addresses = []
+        self.failed_folders |= self._uncommitted_folders
+        self._uncommitted_folders = set()
+
+    def _commit(self):
+        db.session.commit()
+        self._new_addresses = []
+        self._uncommitted_folders = set()
+
+    def _upsert_addresses(self, addresses, address_counts, sent_counts, received_counts):
+        """
+        Add per-batch count deltas to EmailAddress with a single INSERT ... ON DUPLICATE KEY UPDATE,
+        creating unseen addresses on the way, then record the ids of the new addresses.
+        The counts are keyed by address_key, addresses maps each key to the spelling to store.
+        """
+        if not address_counts:
+            return
+        email_address_table = EmailAddress.__table__
+        stmt = mysql_insert(email_address_table).values([
+            {
+                'user_id': self.user_id,
+                'email_account_id': self.email_account_id,
+                'email_address': addresses[key],
+                'action': 'ignore',
+                'count': count,
+                'sent_count': sent_counts[key],
+                'received_count': received_counts[key],
+            }
+            for key, count in address_counts.items()
+        ])
+        stmt = stmt.on_duplicate_key_update(
+            count=email_address_table.c.count + stmt.inserted.count,
+            sent_count=email_address_table.c.sent_count + stmt.inserted.sent_count,
+            received_count=email_address_table.c.received_count + stmt.inserted.received_count
+        )
+        db.session.execute(stmt)
+
+        new_keys = [key for key in address_counts if key not in self.address_ids]
+        for i in range(0, len(new_keys), 1000):
+            batch = new_keys[i:i + 1000]
+            rows = db.session.query(EmailAddress.email_address, EmailAddress.id).filter(
+                EmailAddress.user_id == self.user_id,
+                EmailAddress.email_account_id == self.email_account_id,
+                EmailAddress.email_address.in_([addresses[key] for key in batch])
+            ).all()
+            for address, address_id in rows:
+                self.address_ids[address_key(address)] = address_id
+                self._new_addresses.append(address_key(address))
+            for key in batch:
+                if key not in self.address_ids:
+                    # The row was stored under a spelling the collation folds differently from address_key
+                    self.address_ids[key] = db.session.query(EmailAddress.id).filter(
+                        EmailAddress.user_id == self.user_id,
+                        EmailAddress.email_account_id == self.email_account_id,
+                        EmailAddress.email_address == addresses[key]
+                    ).scalar()
+                    self._new_addresses.append(key)
+
+    def _add_email(self, email_folder_id, uid, raw_email_data, parsed, headers_only):
+        try:
+            record = parsed.result() if parsed is not None else parse_raw_email(raw_email_data)
+        except Exception:
+            self._release(len(raw_email_data))
+            raise
+        record['headers_only'] = headers_only
+        if headers_only:
+            # Headers alone cannot be matched against a full copy of the message
+            record['content_hash'] = None
+            record['raw_size'] = None
+        self._pending.append((email_folder_id, uid, raw_email_data, record))
+        if len(self._pending) + len(self._pending_links) >= WRITE_BATCH_SIZE:
+            self._flush()
+            self._commit()
+
+    def _add_link(self, email_folder_id, uid, message_id, raw_size):
+        self._pending_links.append((email_folder_id, uid, message_id, raw_size))
+        if len(self._pending) + len(self._pending_links) >= WRITE_BATCH_SIZE:
+            self._flush()
+            self._commit()
+
+    def _flush(self):
+        """Insert the pending emails, falling back to one email per transaction if the batch fails."""
+        if self._pending:
+            pending, self._pending = self._pending, []
+            try:
+                self._insert_emails(pending)
+                self._uncommitted_folders.update(item[0] for item in pending)
+            except Exception as e:
+                logger.warning(f"Bulk insert of {len(pending)} emails failed, retrying one by one: {e}")
+                self._rollback()
+                for item in pending:
+                    try:
+                        self._insert_emails([item])
+                        self._commit()
+                    except Exception as e:
+                        self.errors += 1
+                        logger.error(f"Error writing email for folder {item[0]} UID {item[1]}: {e}")
+                        if isinstance(e, OperationalError):
+                            # The database failed (connection, lock wait, deadlock), not this message
+                            self.failed_folders.add(item[0])
+                        self._rollback()
+            finally:
+                self._release(sum(len(item[2]) for item in pending))
+
+        if self._pending_links:
+            pending_links, self._pending_links = self._pending_links, []
+            try:
+                # Savepoint, so a failed link does not roll back the emails inserted above
+                with db.session.begin_nested():
+                    self._link_by_message_id(pending_links)
+                self._uncommitted_folders.update(item[0] for item in pending_links)
+            except Exception as e:
+                self.errors += len(pending_links)
+                logger.error(f"Error linking {len(pending_links)} duplicate emails: {e}")
+                self.failed_folders.update(item[0] for item in pending_links)
+
+        if self._pending_folders:
+            pending_folders, self._pending_folders = self._pending_folders, []
+            try:
+                with db.session.begin_nested():
+                    self._link_folders(pending_folders)
+                self._uncommitted_folders.update(item[0] for item in pending_folders)
+            except Exception as e:
+                self.errors += len(pending_folders)
+                logger.error(f"Error adding folders to {len(pending_folders)} emails: {e}")
+                self.failed_folders.update(item[0] for item in pending_folders)
+
+    def _insert_emails(self, items):
+        """Insert emails and their receiver links with multi-row INSERTs (not committed)."""
+        # Copies of an email that is already stored (or earlier in this batch) only get a folder link
+        content_hashes = list({record['content_hash'] for _, _, _, record in items if record['content_hash']})
+        stored_ids = {}
+        for i in range(0, len(content_hashes), 1000):
+            for email_id, message_id, content_hash in db.session.query(Email.id, Email.message_id, Email.content_hash).filter(
+                Email.email_account_id == self.email_account_id,
+                Email.content_hash.in_(content_hashes[i:i + 1000])
+            ).order_by(Email.id):
+                stored_ids.setdefault((message_id, content_hash), email_id)
+
+        # Headers-only emails have no content hash, so match them by folder and UID. A resumed scan
+        # can fetch some of them again (they are written ahead of the body batch checkpoints), and a
+        # scan without headers_first fetches their body
+        folder_uids = {}
+        for email_folder_id, uid, _, record in items:
+            if uid:
+                folder_uids.setdefault(email_folder_id, []).append(str(uid))
+        stored_headers = {}
+        for email_folder_id, uids in folder_uids.items():
+            for i in range(0, len(uids), 1000):
+                for email_id, imap_id in db.session.query(Email.id, Email.email_imap_id).filter(
+                    Email.email_account_id == self.email_account_id,
+                    Email.email_folder_id == email_folder_id,
+                    Email.email_imap_id.in_(uids[i:i + 1000]),
+                    Email.headers_only.is_(True)
+                ):
+                    stored_headers[(email_folder_id, imap_id)] = email_id
+
+        new_items = []
+        first_copies = {}
+        duplicates = []
+        upgrades = []
+        for item in items:
+            email_folder_id, uid, raw_email_data, record = item
+            key = (record['message_id'], record['content_hash']) if record['content_hash'] else None
+            stored_header_id = stored_headers.get((email_folder_id, str(uid))) if uid else None
+            if stored_header_id is not None:
+                if not record['headers_only']:
+                    # Fill in the body of the headers-only row, its addresses are already counted
+                    upgrades.append((stored_header_id, raw_email_data, record))
+                    if key is not None:
+                        stored_ids.setdefault(key, stored_header_id)
+                continue
+            if key is not None and (key in stored_ids or key in first_copies):
+                duplicates.append((key, email_folder_id, uid))
+                continue
+            if key is not None:
+                first_copies[key] = (email_folder_id, str(uid) if uid else None)
+            new_items.append(item)
+
+        # Count every address once per email and apply the batch's deltas in one statement
+        addresses = {}
+        address_counts = Counter()
+        sent_counts = Counter()
+        received_counts = Counter()
+        for email_folder_id, uid, raw_email_data, record in new_items:
+            for address in (record['sender'], *record['recipients']):
+                addresses.setdefault(address_key(address), address)
+            sender = address_key(record['sender'])
+            recipients = {address_key(address) for address in record['recipients']}
+            address_counts.update({sender, *recipients})
+            sent_counts[sender] += 1
+            received_counts.update(recipients)
+        self._upsert_addresses(addresses, address_counts, sent_counts, received_counts)
+        self._add_stored_counts(Counter(email_folder_id for email_folder_id, _, _, _ in new_items))
+
+        rows = []
+        senders = {}
+        receivers = {}
+        raw_data = {}
+        new_ids = {}
+        for email_folder_id, uid, raw_email_data, record in new_items:
+            sender_id = self.address_ids[address_key(record['sender'])]
+            receiver_ids = list(dict.fromkeys(self.address_ids[address_key(address)] for address in record['recipients']))
+
+            row = {
+                'user_id': self.user_id,
+                'email_account_id': self.email_account_id,
+                'email_folder_id': email_folder_id,
+                'email_imap_id': str(uid) if uid else None,
+                'email_date': record['email_date'],
+                'sender_id': sender_id,
+                'action': 'ignore',
+                'headers_only': record['headers_only'],
+                'email_subject': record['email_subject'][:250],
+                'text_content': record['text_content'],
+                'message_id': record['message_id'],
+                'content_hash': record['content_hash'],
+                'raw_size': record['raw_size'],
+            }
+            stored_data = record['raw_data'] or raw_email_data
+            if uid:
+                rows.append(row)
+                senders[(email_folder_id, row['email_imap_id'])] = sender_id
+                receivers[(email_folder_id, row['email_imap_id'])] = receiver_ids
+                raw_data[(email_folder_id, row['email_imap_id'])] = stored_data
+            else:
+                # Without a UID the new row cannot be looked up again, insert it on its own
+                email_id = db.session.execute(Email.__table__.insert(), row).inserted_primary_key[0]
+                new_ids[(email_folder_id, None)] = email_id
+                db.session.execute(EmailBlob.__table__.insert(), {'email_id': email_id, 'raw_data': stored_data})
+                self._insert_receivers(email_id, sender_id, receiver_ids)
+
+        if rows:
+            db.session.execute(Email.__table__.insert(), rows)
+
+            # Look up the new ids by folder and UID to link the receivers (newest row wins)
+            imap_ids_by_folder = {}
+            for email_folder_id, imap_id in receivers:
+                imap_ids_by_folder.setdefault(email_folder_id, []).append(imap_id)
+            links = []
+            participants = []
+            blobs = []
+            for email_folder_id, imap_ids in imap_ids_by_folder.items():
+                email_ids = dict((imap_id, email_id) for email_id, imap_id in db.session.query(Email.id, Email.email_imap_id).filter(
+                    Email.email_folder_id == email_folder_id,
+                    Email.email_imap_id.in_(imap_ids)
+                ).order_by(Email.id))
+                for imap_id in imap_ids:
+                    new_ids[(email_folder_id, imap_id)] = email_ids[imap_id]
+                    blobs.append({'email_id': email_ids[imap_id], 'raw_data': raw_data[(email_folder_id, imap_id)]})
+                    links.extend(
+                        {'email_id': email_ids[imap_id], 'email_address_id': receiver_id}
+                        for receiver_id in receivers[(email_folder_id, imap_id)]
+                    )
+                    participants.extend(self._participant_rows(
+                        email_ids[imap_id], senders[(email_folder_id, imap_id)], receivers[(email_folder_id, imap_id)]
+                    ))
+            db.session.execute(EmailBlob.__table__.insert(), blobs)
+            if links:
+                db.session.execute(email_receivers.insert(), links)
+            db.session.execute(email_participants.insert(), participants)
+
+        if upgrades:
+            self._upgrade_headers_only(upgrades)
+
+        self._insert_folder_links([
+            (stored_ids[key] if key in stored_ids else new_ids[first_copies[key]], email_folder_id, uid)
+            for key, email_folder_id, uid in duplicates
+        ])
+        self.written += len(items)
+
+    def _upgrade_headers_only(self, upgrades):
+        """Store the fetched body of (email_id, raw_email_data, record) emails that were stored headers-only."""
+        email_table = Email.__table__
+        db.session.execute(email_table.update().where(email_table.c.id == bindparam('b_id')).values(
+            headers_only=False,
+            email_date=bindparam('b_email_date'),
+            email_subject=bindparam('b_email_subject'),
+            text_content=bindparam('b_text_content'),
+            message_id=bindparam('b_message_id'),
+            content_hash=bindparam('b_content_hash'),
+            raw_size=bindparam('b_raw_size'),
+        ), [{
+            'b_id': email_id,
+            'b_email_date': record['email_date'],
+            'b_email_subject': record['email_subject'][:250],
+            'b_text_content': record['text_content'],
+            'b_message_id': record['message_id'],
+            'b_content_hash': record['content_hash'],
+            'b_raw_size': record['raw_size'],
+        } for email_id, raw_email_data, record in upgrades])
+        blob_table = EmailBlob.__table__
+        db.session.execute(blob_table.update().where(blob_table.c.email_id == bindparam('b_id')).values(
+            raw_data=bindparam('b_raw_data')
+        ), [{'b_id': email_id, 'b_raw_data': record['raw_data'] or raw_email_data} for email_id, raw_email_data, record in upgrades])
+
+    def _link_by_message_id(self, pending_links):
+        """Link folders to the stored emails matched by Message-ID and size before their body was fetched."""
+        message_ids = list({message_id for _, _, message_id, _ in pending_links})
+        stored_ids = {}
+        for i in range(0, len(message_ids), 1000):
+            for email_id, message_id, raw_size in db.session.query(Email.id, Email.message_id, Email.raw_size).filter(
+                Email.email_account_id == self.email_account_id,
+                Email.message_id.in_(message_ids[i:i + 1000])
+            ).order_by(Email.id):
+                stored_ids.setdefault((message_id, raw_size), email_id)
+
+        links = []
+        for email_folder_id, uid, message_id, raw_size in pending_links:
+            email_id = stored_ids.get((message_id, raw_size))
+            if email_id is None:
+                self.errors += 1
+                logger.error(f"No stored email to link for folder {email_folder_id} UID {uid} ({message_id})")
+                continue
+            links.append((email_id, email_folder_id, uid))
+        self._insert_folder_links(links)
+        self.written += len(links)
+
+    def _link_folders(self, pending_folders):
+        """Link more folders to the emails stored (or linked) for the given folder and UID."""
+        imap_ids = {}
+        for email_folder_id, uid, folder_ids in pending_folders:
+            imap_ids.setdefault(email_folder_id, []).append(str(uid))
+
+        email_ids = {}
+        for email_folder_id, folder_imap_ids in imap_ids.items():
+            for i in range(0, len(folder_imap_ids), 1000):
+                batch = folder_imap_ids[i:i + 1000]
+                for email_id, imap_id in db.session.query(Email.id, Email.email_imap_id).filter(
+                    Email.email_account_id == self.email_account_id,
+                    Email.email_folder_id == email_folder_id,
+                    Email.email_imap_id.in_(batch)
+                ):
+                    email_ids[(email_folder_id, imap_id)] = email_id
+                for email_id, imap_id in db.session.query(email_folder_links.c.email_id, email_folder_links.c.email_imap_id).filter(
+                    email_folder_links.c.email_folder_id == email_folder_id,
+                    email_folder_links.c.email_imap_id.in_(batch)
+                ):
+                    email_ids.setdefault((email_folder_id, imap_id), email_id)
+
+        links = []
+        for email_folder_id, uid, folder_ids in pending_folders:
+            email_id = email_ids.get((email_folder_id, str(uid)))
+            if email_id is None:
+                logger.warning(f"No stored email to add folders to for folder {email_folder_id} UID {uid}")
+                continue
+            links.extend((email_id, folder_id, None) for folder_id in folder_ids)
+        self._insert_folder_links(links)
+
+    def _insert_folder_links(self, links):
+        """Insert (email_id, email_folder_id, uid) links, skipping an email's own folder and existing links."""
+        if not links:
+            return
+        email_ids = list({email_id for email_id, _, _ in links})
+        known = set()
+        for i in range(0, len(email_ids), 1000):
+            batch = email_ids[i:i + 1000]
+            known.update(db.session.query(Email.id, Email.email_folder_id).filter(Email.id.in_(batch)).all())
+            known.update(db.session.query(email_folder_links.c.email_id, email_folder_links.c.email_folder_id).filter(
+                email_folder_links.c.email_id.in_(batch)
+            ).all())
+
+        rows = []
+        for email_id, email_folder_id, uid in links:
+            if (email_id, email_folder_id) in known:
+                continue
+            known.add((email_id, email_folder_id))
+            rows.append({'email_id': email_id, 'email_folder_id': email_folder_id, 'email_imap_id': str(uid) if uid else None})
+        if rows:
+            db.session.execute(email_folder_links.insert(), rows)
+            self._add_stored_counts(Counter(row['email_folder_id'] for row in rows))
+
+    def _add_stored_counts(self, folder_counts):
+        """Add the emails stored or linked in this batch to EmailFolder.stored_count."""
+        for email_folder_id, count in folder_counts.items():
+            db.session.execute(EmailFolder.__table__.update().where(EmailFolder.id == email_folder_id).values(
+                stored_count=EmailFolder.stored_count + count
+            ))
+
+    def _participant_rows(self, email_id, sender_id, receiver_ids):
+        rows = [{'email_account_id': self.email_account_id, 'email_address_id': sender_id, 'email_id': email_id,
+                 'role': 'sender'}]
+        rows.extend({'email_account_id': self.email_account_id, 'email_address_id': receiver_id, 'email_id': email_id,
+                     'role': 'receiver'} for receiver_id in receiver_ids)
+        return rows
+
+    def _insert_receivers(self, email_id, sender_id, receiver_ids):
+        if receiver_ids:
+            db.session.execute(email_receivers.insert(), [
+                {'email_id': email_id, 'email_address_id': receiver_id} for receiver_id in receiver_ids
+            ])
+        db.session.execute(email_participants.insert(), self._participant_rows(email_id, sender_id, receiver_ids))
+
+    def _write_checkpoint(self, email_folder_id, last_uid, highest_modseq, complete, synced_range):
+        self._flush()
+        if email_folder_id in self.failed_folders:
+            # Keep the checkpoint of the last committed batch, the next scan resumes from there
+            logger.warning(f"Not checkpointing folder {email_folder_id} past UID {last_uid}: some of its emails were not stored")
+            self._commit()
+            return
+        email_folder = db.session.get(EmailFolder, email_folder_id)
+        if last_uid is not None:
+            # Rescans and date-range deltas fetch UIDs below the checkpoint, never move it back
+            email_folder.last_uid = max(email_folder.last_uid or 0, last_uid)
+            email_folder.scan_progress_uid = last_uid
+        if highest_modseq is not None:
+            email_folder.highest_modseq = highest_modseq
+        if complete:
+            email_folder.scan_progress_uid = None
+        if synced_range is not None:
+            ranges = json.loads(email_folder.synced_ranges) if email_folder.synced_ranges else []
+            email_folder.synced_ranges = json.dumps(merge_date_ranges(ranges + [list(synced_range)]))
+        self._commit()
@@ -1,9 +1,136 @@
 from datetime import datetime
-from .models import Result
+from .models import Result, ResultLog
 from .extensions import db
+from dotenv import load_dotenv
+from flask import current_app
+import os
+import time
+import queue
+import atexit
 import inspect
+import logging
+import threading
 
-def update_log_entry(user_id, email_account_id, log_entry, status='processing'):
+# Load environment variables from .env file
+load_dotenv()
+
+# Maximum number of log lines waiting to be written; callers block when it is full (DEBUG lines are dropped)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# The log writer commits when this many lines are buffered, or after LOG_FLUSH_INTERVAL seconds
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", 200))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1))
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+
+class LogSink:
+    """
+    Buffers update_log_entry lines and writes them from a background thread, one transaction
+    per batch, so hot loops never wait on the database or share its session.
+    """
+
+    def __init__(self, app, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_FLUSH_BATCH, interval=LOG_FLUSH_INTERVAL):
+        self._app = app
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name='log-writer', daemon=True)
+        self._writer.start()
+
+    def put(self, user_id, email_account_id, line, status, debug=False, wait=False):
+        """Queue a line; with wait, block until the batch holding it is written (not the whole queue)."""
+        if debug:
+            try:
+                self._queue.put_nowait((user_id, email_account_id, line, status, None))
+            except queue.Full:
+                # Overloaded: debug lines are not worth slowing the caller down
+                self.dropped += 1
+            return
+        written = threading.Event() if wait else None
+        self._queue.put((user_id, email_account_id, line, status, written))
+        if written is not None:
+            written.wait()
+
+    def flush(self):
+        """Wait until every line queued so far is committed."""
+        self._queue.join()
+
+    def _write_loop(self):
+        with self._app.app_context():
+            while True:
+                entries = [self._queue.get()]
+                deadline = time.monotonic() + self.interval
+                # A status change is written right away, so readers of Result.status see it
+                while len(entries) < self.batch_size and entries[-1][3] == 'processing':
+                    try:
+                        entries.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                try:
+                    self._write(entries)
+                except Exception as e:
+                    logger.error(f"Error writing {len(entries)} log lines: {e}")
+                    db.session.rollback()
+                finally:
+                    for entry in entries:
+                        if entry[4] is not None:
+                            entry[4].set()
+                        self._queue.task_done()
+
+    def _write(self, entries):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            logger.warning(f"Dropped {dropped} debug log lines, the log writer could not keep up")
+
+        jobs = {}
+        for user_id, email_account_id, line, status, _ in entries:
+            # Log to console or file
+            print(f"Log Entry: {status} | {line}")
+            jobs.setdefault((user_id, email_account_id), []).append((line, status))
+
+        for (user_id, email_account_id), job_entries in jobs.items():
+            # Update or create the Result entry, then append the lines without rewriting the log
+            result = Result.query.filter_by(user_id=user_id, email_account_id=email_account_id).first()
+            if result is None:
+                result = Result(user_id=user_id, email_account_id=email_account_id)
+                db.session.add(result)
+                db.session.flush()
+            result.status = job_entries[-1][1]
+            db.session.execute(ResultLog.__table__.insert(), [
+                {'result_id': result.id, 'created_date': datetime.utcnow(), 'line': line} for line, _ in job_entries
+            ])
+        db.session.commit()
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink():
+    """Return the process's LogSink, starting it on first use (needs an app context)."""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = LogSink(current_app._get_current_object())
+            atexit.register(_sink.flush)
+        return _sink
+
+
+def flush_log():
+    """Wait until the queued log lines are written, e.g. before Result rows are deleted."""
+    if _sink is not None:
+        _sink.flush()
+
+
+def update_log_entry(user_id, email_account_id, log_entry, status='processing', debug=False):
+    """
+    Append a line to the account's processing log and set its status. Lines are written in
+    the background; a status other than 'processing' waits until it is stored. debug lines
+    are dropped instead of blocking when the log writer falls behind.
+    """
     if user_id is None:
         caller = inspect.stack()[1].function
         print(f"ERROR: update_log_entry: User ID cannot be None. Called from {caller}")
@@ -14,17 +141,21 @@ def update_log_entry(user_id, email_account_id, log_entry, status='processing'):
         return
     # Add a timestamp to the log entry
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = f"[{timestamp}] {log_entry}\n"
-
-    # Log to console or file
-    print(f"Log Entry: {status} | {log_entry.strip()}")
-
-    # Update or create the Result entry
-    result = Result.query.filter_by(user_id=user_id, email_account_id=email_account_id).first()
-    if result:
-        result.log_entry += log_entry
-        result.status = status
-    else:
-        result = Result(user_id=user_id, email_account_id=email_account_id, log_entry=log_entry, status=status)
-        db.session.add(result)
-    db.session.commit()
+    log_entry = f"[{timestamp}] {log_entry}"
+
+    get_log_sink().put(user_id, email_account_id, log_entry, status, debug=debug, wait=status != 'processing')
+
+
+def get_log_lines(result, after=0):
+    """Return the (id, line) log lines of a Result appended after the line with id after."""
+    return db.session.query(ResultLog.id, ResultLog.line).filter(
+        ResultLog.result_id == result.id,
+        ResultLog.id > after
+    ).order_by(ResultLog.id).all()
+
+
+def get_log_text(result):
+    """Return the whole log of a Result and the id of its last line."""
+    lines = get_log_lines(result)
+    text = (result.log_entry or '') + ''.join(f"{line}\n" for _, line in lines)
+    return text, lines[-1][0] if lines else 0
@@ -0,0 +1,236 @@
+import os
+import re
+import mmap
+import click
+import logging
+from email.header import decode_header, make_header
+from dotenv import load_dotenv
+from flask.cli import with_appcontext
+from .extensions import db
+from .models import EmailAccount, EmailFolder
+from email_filter.ingest_pipeline import IngestPipeline, parse_message_id
+from email_filter.email_processor import find_stored_copies, get_label_folders
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of imported messages between folder checkpoints
+IMPORT_CHECKPOINT_EVERY = int(os.getenv("IMPORT_CHECKPOINT_EVERY", 500))
+
+# Imported folders are named "Import/<mbox file or directory>" so they never mix with IMAP folders
+IMPORT_FOLDER_PREFIX = 'Import/'
+
+# Google Takeout's X-Gmail-Labels names for Gmail's system labels, mapped to their IMAP names
+TAKEOUT_SYSTEM_LABELS = {
+    'Inbox': '\\Inbox',
+    'Sent': '\\Sent',
+    'Drafts': '\\Draft',
+    'Important': '\\Important',
+    'Starred': '\\Starred',
+    'Spam': '\\Spam',
+    'Trash': '\\Trash',
+    'Opened': '\\Seen',
+    'Unread': '\\Unseen',
+    'Archived': '\\Archived',
+}
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+_MBOX_ESCAPED_FROM = re.compile(rb'^>(>*From )', re.MULTILINE)
+_GMAIL_LABELS_HEADER = re.compile(rb'^X-Gmail-Labels:[ \t]*(.*(?:\r?\n[ \t].*)*)', re.MULTILINE | re.IGNORECASE)
+
+
+def iter_mbox_messages(path):
+    """Yield the raw messages of an mbox file, splitting a memory map of it on "From " lines."""
+    with open(path, 'rb') as mbox_file:
+        if os.fstat(mbox_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(mbox_file.fileno(), 0, access=mmap.ACCESS_READ) as mbox:
+            start = 0 if mbox[:5] == b'From ' else mbox.find(b'\nFrom ')
+            while start >= 0:
+                # Skip the "From " separator line itself
+                body_start = mbox.find(b'\n', start + 1)
+                if body_start < 0:
+                    return
+                end = mbox.find(b'\nFrom ', body_start)
+                raw_email_data = mbox[body_start + 1:end + 1 if end >= 0 else len(mbox)]
+                # Drop the blank line mbox writers add before the next "From " line, it is not
+                # part of the message (and would change its size and content hash)
+                if raw_email_data.endswith(b'\r\n\r\n'):
+                    raw_email_data = raw_email_data[:-2]
+                elif raw_email_data.endswith(b'\n\n'):
+                    raw_email_data = raw_email_data[:-1]
+                # Undo the ">From " quoting of body lines (mboxo/mboxrd)
+                yield _MBOX_ESCAPED_FROM.sub(rb'\1', raw_email_data)
+                start = end
+
+
+def iter_eml_messages(path):
+    """Yield (relative directory, raw message) for the .eml files below a directory, in name order."""
+    for directory, subdirectories, files in os.walk(path):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.eml'):
+                with open(os.path.join(directory, name), 'rb') as eml_file:
+                    yield os.path.relpath(directory, path), eml_file.read()
+
+
+def get_header_end(raw_email_data):
+    """Return the offset of the blank line ending the headers of a message (its length if there is none)."""
+    header_end = raw_email_data.find(b'\n\n')
+    crlf_header_end = raw_email_data.find(b'\r\n\r\n')
+    if header_end < 0 or 0 <= crlf_header_end < header_end:
+        header_end = crlf_header_end
+    return header_end if header_end >= 0 else len(raw_email_data)
+
+
+def parse_takeout_labels(raw_email_data):
+    """Return the X-Gmail-Labels of a Google Takeout message as IMAP-style labels (\\Inbox, ...)."""
+    match = _GMAIL_LABELS_HEADER.search(raw_email_data, 0, get_header_end(raw_email_data))
+    if not match:
+        return []
+    value = re.sub(r'\r?\n[ \t]', ' ', match.group(1).decode(errors='replace'))
+    try:
+        value = str(make_header(decode_header(value)))
+    except Exception:
+        pass
+    labels = []
+    for label in value.split(','):
+        label = label.strip()
+        if not label:
+            continue
+        if label.startswith('Category '):
+            label = '\\' + label
+        labels.append(TAKEOUT_SYSTEM_LABELS.get(label, label))
+    return labels
+
+
+def get_import_folder(user_id, email_account_id, name):
+    """Return the EmailFolder an archive (or one of its directories) is imported into, creating it."""
+    folder_name = f'"{IMPORT_FOLDER_PREFIX}{name}"'[:255]
+    email_folder = EmailFolder.query.filter_by(user_id=user_id, email_account_id=email_account_id,
+                                               folder_name=folder_name).first()
+    if email_folder is None:
+        email_folder = EmailFolder(user_id=user_id, email_account_id=email_account_id, folder_name=folder_name,
+                                   email_count=0)
+        db.session.add(email_folder)
+        db.session.commit()
+    return email_folder
+
+
+def import_archive(account, user_id, path, resume=True):
+    """
+    Import a local .mbox file, or a directory of .eml files, into the Email table.
+
+    Messages go through the same IngestPipeline as IMAP scans, so they are parsed in the
+    process pool, de-duplicated and bulk-inserted the same way. Each message is numbered
+    in file order and stored with that number as its email_imap_id. The folder checkpoint
+    advances every IMPORT_CHECKPOINT_EVERY messages, so with resume an interrupted import
+    continues where it stopped. A message already stored for the account (same Message-ID
+    and size) is only linked to the import folder, like a copy found by an IMAP scan.
+    X-Gmail-Labels of Google Takeout exports are mapped to folders like the labels of a
+    Gmail scan.
+    """
+    email_account_id = account.id
+    pipeline = IngestPipeline(user_id, email_account_id).start()
+    try:
+        if os.path.isdir(path):
+            messages = iter_eml_messages(path)
+            root_name = os.path.basename(os.path.normpath(path))
+        else:
+            messages = (('.', raw_email_data) for raw_email_data in iter_mbox_messages(path))
+            root_name = os.path.splitext(os.path.basename(path))[0]
+
+        folders = {}
+        counters = {}
+        chunk = []
+
+        def end_chunk():
+            # Submit the chunk (all from one folder), linking the copies that are already stored,
+            # then link it to its label folders and checkpoint it
+            email_folder_id = chunk[-1][0]
+            message_ids = {}
+            for _, uid, raw_email_data, _ in chunk:
+                message_id = parse_message_id(raw_email_data[:get_header_end(raw_email_data)])
+                if message_id:
+                    message_ids[uid] = message_id
+            sizes = {uid: len(raw_email_data) for _, uid, raw_email_data, _ in chunk}
+            stored_ids = find_stored_copies(email_account_id, message_ids, sizes)
+            for _, uid, raw_email_data, _ in chunk:
+                if uid in stored_ids:
+                    pipeline.link(email_folder_id, uid, message_ids[uid], sizes[uid])
+                else:
+                    pipeline.submit(email_folder_id, uid, raw_email_data)
+            if stored_ids:
+                logger.info(f"Linking {len(stored_ids)} imported emails that are already stored")
+
+            chunk_labels = {uid: labels for _, uid, _, labels in chunk if labels}
+            if chunk_labels:
+                label_folders = get_label_folders(user_id, email_account_id, chunk_labels, sorted(chunk_labels))
+                for uid, folder_ids in label_folders.items():
+                    pipeline.add_folders(email_folder_id, uid, folder_ids)
+            pipeline.checkpoint(email_folder_id, last_uid=chunk[-1][1])
+            chunk.clear()
+
+        imported = 0
+        for directory, raw_email_data in messages:
+            if directory not in folders:
+                if chunk:
+                    end_chunk()
+                name = root_name if directory == '.' else f"{root_name}/{directory.replace(os.sep, '/')}"
+                email_folder = get_import_folder(user_id, email_account_id, name)
+                last_uid = email_folder.last_uid if resume else None
+                folders[directory] = (email_folder.id, last_uid or 0)
+                counters[directory] = 0
+            email_folder_id, last_uid = folders[directory]
+            counters[directory] += 1
+            uid = counters[directory]
+            if uid <= last_uid:
+                continue
+
+            chunk.append((email_folder_id, uid, raw_email_data, parse_takeout_labels(raw_email_data)))
+            imported += 1
+            if len(chunk) >= IMPORT_CHECKPOINT_EVERY:
+                end_chunk()
+
+        if chunk:
+            end_chunk()
+        for directory, (email_folder_id, last_uid) in folders.items():
+            email_folder = db.session.get(EmailFolder, email_folder_id)
+            email_folder.email_count = max(email_folder.email_count, counters[directory])
+            pipeline.checkpoint(email_folder_id, complete=True)
+        db.session.commit()
+        # Raises if the writer failed, so the import is not reported as a success
+        pipeline.close()
+
+        logger.info(f"Imported {imported} emails from {path}")
+        return {'success': True, 'imported': imported}
+
+    except Exception as e:
+        logger.error(f"Error importing {path}: {e}")
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+    finally:
+        # Persist whatever was already read, even after an error (a no-op after the close above)
+        try:
+            pipeline.close()
+        except Exception as e:
+            logger.error(f"Error closing the ingest pipeline: {e}")
+
+
+@click.command('import-archive')
+@click.argument('email_account_id', type=int)
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--restart', is_flag=True, help='Import from the first message instead of resuming.')
+@with_appcontext
+def import_archive_command(email_account_id, path, restart):
+    """Import a local .mbox file or a directory of .eml files into an email account."""
+    account = db.session.get(EmailAccount, email_account_id)
+    if account is None:
+        raise click.ClickException(f"Email account {email_account_id} not found")
+    result = import_archive(account, account.user_id, path, resume=not restart)
+    if not result['success']:
+        raise click.ClickException(result['error'])
+    click.echo(f"Imported {result['imported']} emails")
@@ -65,6 +65,19 @@ class EmailFolder(db.Model):
     # Table Columns
     folder_name = db.Column(db.String(255), nullable=False)
     email_count = db.Column(db.Integer, nullable=False)
+    # Emails stored under this folder plus the emails linked to it, kept up at insert and delete
+    stored_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # IMAP sync checkpoints, used by incremental scans to fetch only new UIDs
+    uid_validity = db.Column(db.BigInteger, nullable=True)
+    last_uid = db.Column(db.BigInteger, nullable=True)
+    highest_modseq = db.Column(db.BigInteger, nullable=True)
+
+    # Last UID committed by a scan that has not finished the folder yet; a restarted scan continues after it
+    scan_progress_uid = db.Column(db.BigInteger, nullable=True)
+
+    # JSON list of the [start, end) date ranges already ingested, so a widened range only fetches the difference
+    synced_ranges = db.Column(db.Text, nullable=True)
 
     # Constraints
     __table_args__ = (
@@ -74,8 +87,9 @@ class EmailFolder(db.Model):
 class Email(db.Model):
     __tablename__ = 'email'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, index=True)
-    email_account_id = db.Column(db.Integer, index=True)
+    # Indexed through the composite indexes below, which all lead with these columns
+    user_id = db.Column(db.Integer)
+    email_account_id = db.Column(db.Integer)
     email_folder_id = db.Column(db.Integer, db.ForeignKey('email_folder.id', ondelete='CASCADE'), nullable=False)
 
     # Table Columns
@@ -84,19 +98,44 @@ class Email(db.Model):
     sender_id = db.Column(db.Integer, db.ForeignKey('email_address.id'), nullable=False)
     receivers = db.relationship('EmailAddress', secondary='email_receivers', backref='emails')
     action = db.Column(Enum('include', 'ignore', 'exclude', name='email_action'), nullable=False, default='ignore')
-    raw_data = db.Column(LONGBLOB, nullable=False)
+    # The raw message lives in email_blob and is only loaded when it is accessed
+    blob = db.relationship('EmailBlob', uselist=False, lazy='select', passive_deletes=True)
+    # True when only the headers were fetched because an address rule already excluded the email
+    headers_only = db.Column(db.Boolean, nullable=False, default=False)
     email_subject = db.Column(db.String(255), nullable=False)
     text_content = db.Column(LONGTEXT, nullable=True)
 
+    # De-duplication key across folders: normalized Message-ID plus SHA-256 of the raw message
+    message_id = db.Column(db.String(255), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    raw_size = db.Column(db.Integer, nullable=True)
+
     # Constraints
     __table_args__ = (
         db.Index('ix_email_text_content', 'text_content', mysql_prefix='FULLTEXT'),
+        db.Index('ix_email_folder_imap_id', 'email_folder_id', 'email_imap_id'),
+        db.Index('ix_email_account_message_id', 'email_account_id', 'message_id'),
+        db.Index('ix_email_account_content_hash', 'email_account_id', 'content_hash'),
+        # Account counts, UPDATE action, prompt paging and the export all filter on these
+        db.Index('ix_email_user_account_action', 'user_id', 'email_account_id', 'action'),
+        # Folder counts
+        db.Index('ix_email_account_folder', 'email_account_id', 'email_folder_id'),
     )
 
     # String Representation
     def __repr__(self):
         return f"<Email {self.id}>"
 
+class EmailBlob(db.Model):
+    __tablename__ = 'email_blob'
+    # One row per Email, so counts, filters and action updates never read the raw messages
+    email_id = db.Column(db.Integer, db.ForeignKey('email.id', ondelete='CASCADE'), primary_key=True)
+    raw_data = db.Column(LONGBLOB, nullable=False)
+
+    # String Representation
+    def __repr__(self):
+        return f"<EmailBlob {self.email_id}>"
+
 class EmailAddress(db.Model):
     # Table Identifiers
     id = db.Column(db.Integer, primary_key=True)
@@ -107,10 +146,17 @@ class EmailAddress(db.Model):
     email_address = db.Column(db.String(255), nullable=False, index=True)
     action = db.Column(Enum('include', 'ignore', 'exclude', name='email_action'), nullable=False, default='ignore')
     count = db.Column(db.Integer, default=0)
+    # Emails sent from and to this address, kept up at insert and delete like count
+    sent_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    received_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # Constraints
     __table_args__ = (
         db.UniqueConstraint('user_id', 'email_account_id', 'email_address', name='uq_email_address_email_address'),
+        # Addresses with an include/exclude rule
+        db.Index('ix_email_address_account_action', 'user_id', 'email_account_id', 'action'),
+        # The address list, most used first
+        db.Index('ix_email_address_account_count', 'email_account_id', 'count'),
     )
 
 class Filter(db.Model):
@@ -144,13 +190,43 @@ class Result(db.Model):
     # Table Columns
     name = db.Column(db.String(255), nullable=True)
     created_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Log of runs from before result_log; new lines are appended as ResultLog rows
     log_entry = db.Column(LONGTEXT, nullable=True)
     status = db.Column(db.String(255), nullable=True)
     file_url = db.Column(LONGTEXT, nullable=True)
     zip_password = db.Column(db.String(255), nullable=True)
 
+class ResultLog(db.Model):
+    __tablename__ = 'result_log'
+    # Append-only log lines of a Result; the id orders them and lets readers fetch only newer lines
+    id = db.Column(db.BigInteger, primary_key=True)
+    result_id = db.Column(db.Integer, db.ForeignKey('result.id', ondelete='CASCADE'), nullable=False)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    line = db.Column(db.Text, nullable=False)
+
+    # Constraints
+    __table_args__ = (
+        db.Index('ix_result_log_result_id', 'result_id', 'id'),
+    )
+
 # Secondary table for email receivers
 email_receivers = db.Table('email_receivers',
     db.Column('email_id', db.Integer, db.ForeignKey('email.id'), primary_key=True),
     db.Column('email_address_id', db.Integer, db.ForeignKey('email_address.id'), primary_key=True)
 )
+
+# Every address an email was sent from or to, so "sender or receiver" is one index range scan
+email_participants = db.Table('email_participants',
+    db.Column('email_account_id', db.Integer, primary_key=True),
+    db.Column('email_address_id', db.Integer, db.ForeignKey('email_address.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('email_id', db.Integer, db.ForeignKey('email.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('role', Enum('sender', 'receiver', name='participant_role'), primary_key=True),
+    db.Index('ix_email_participants_email', 'email_id')
+)
+
+# Secondary table for the other folders a de-duplicated email was found in
+email_folder_links = db.Table('email_folder_links',
+    db.Column('email_id', db.Integer, db.ForeignKey('email.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('email_folder_id', db.Integer, db.ForeignKey('email_folder.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('email_imap_id', db.String(255), nullable=True)
+)
@@ -0,0 +1,51 @@
+import os
+import zlib
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Compression of email_blob.raw_data at rest: 'zlib', 'zstd' (needs the zstandard package) or empty for none
+RAW_DATA_CODEC = os.getenv("RAW_DATA_CODEC", "").lower()
+RAW_DATA_COMPRESSION_LEVEL = os.getenv("RAW_DATA_COMPRESSION_LEVEL")
+
+# Compressed values start with a NUL byte and a codec id. A stored RFC 822 message starts
+# with header text, so rows written before compression was enabled are read unchanged.
+CODEC_PREFIXES = {
+    'zlib': b'\x00z',
+    'zstd': b'\x00s',
+}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("RAW_DATA_CODEC=zstd needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def encode_raw_data(raw_data, codec=None):
+    """Compress a message for email_blob.raw_data with the configured codec (unchanged when there is none)."""
+    codec = RAW_DATA_CODEC if codec is None else codec
+    if not codec:
+        return raw_data
+    if codec == 'zlib':
+        level = int(RAW_DATA_COMPRESSION_LEVEL or 6)
+        return CODEC_PREFIXES['zlib'] + zlib.compress(raw_data, level)
+    if codec == 'zstd':
+        level = int(RAW_DATA_COMPRESSION_LEVEL or 3)
+        return CODEC_PREFIXES['zstd'] + _zstandard().ZstdCompressor(level=level).compress(raw_data)
+    raise ValueError(f"Unknown RAW_DATA_CODEC: {codec}")
+
+
+def decode_raw_data(raw_data):
+    """Return the message stored in email_blob.raw_data, decompressing it if it was stored compressed."""
+    if raw_data[:1] != b'\x00':
+        return raw_data
+    prefix = bytes(raw_data[:2])
+    if prefix == CODEC_PREFIXES['zlib']:
+        return zlib.decompress(raw_data[2:])
+    if prefix == CODEC_PREFIXES['zstd']:
+        return _zstandard().ZstdDecompressor().decompress(raw_data[2:])
+    return raw_data
@@ -2,15 +2,16 @@ import os
 from flask import render_template, url_for, flash, redirect, request, jsonify, send_from_directory
 from flask_login import login_user, current_user, logout_user, login_required
 from .forms import RegistrationForm, LoginForm, EmailAccountForm, CSRFTokenForm, JobForm
-from .models import Filter, EmailAccount, EmailAddress, User, Email, EmailFolder, AIPrompt, Result, email_receivers
+from .models import Filter, EmailAccount, EmailAddress, User, Email, EmailBlob, EmailFolder, AIPrompt, Result, email_folder_links, email_participants, email_receivers
 from datetime import datetime
-from .email_processor import read_imap_emails
+from .scan_jobs import submit_scan, get_account_job
 from imaplib import IMAP4_SSL
 from email.policy import default
 from . import bcrypt, db
-from email_filter.globals import scan_status, processing_status
+from email_filter.globals import scan_status, scan_jobs, processing_status
 from .export_processor import process_emails, stop
-from sqlalchemy import or_, func, case, distinct, and_
+from .logger import get_log_lines, get_log_text
+from sqlalchemy import func, case, distinct, and_
 from sqlalchemy.orm import aliased
 from email_filter.aws import SpotInstanceManager, delete_file_from_s3
 import logging
@@ -41,11 +42,31 @@ def init_routes(app):
             try:
                 email_account_id = int(email_account_id)
                 results = Result.query.filter_by(user_id=current_user.id, email_account_id=email_account_id).all()
-                
+
+                if request.args.get('after') is not None:
+                    # Live update: only the status and the log lines after the ones the page already shows
+                    if not results:
+                        return jsonify(success=True, status='not started', result_id=0, reset=True, lines=[], last_log_id=0)
+                    result = results[0]
+                    after = int(request.args.get('after', 0))
+                    # A new run replaces the Result, so send its whole log instead
+                    reset = request.args.get('result_id', type=int) != result.id
+                    if reset:
+                        log_entry, last_log_id = get_log_text(result)
+                        lines = [log_entry] if log_entry else []
+                    else:
+                        log_lines = get_log_lines(result, after)
+                        lines = [f"{line}\n" for _, line in log_lines]
+                        last_log_id = log_lines[-1][0] if log_lines else after
+                    return jsonify(success=True, status=result.status, result_id=result.id, reset=reset,
+                                   lines=lines, last_log_id=last_log_id)
+
                 if results:
+                    log_entry, last_log_id = get_log_text(results[0])
                     process_data = {
                         'status': results[0].status,
-                        'log_entry': results[0].log_entry,
+                        'log_entry': log_entry,
+                        'last_log_id': last_log_id,
                         'id': results[0].id,
                         'name': results[0].name,
                         'file_url': results[0].file_url,
@@ -55,6 +76,7 @@ def init_routes(app):
                     process_data = {
                         'status': 'not started',
                         'log_entry': '',
+                        'last_log_id': 0,
                         'id': '0',
                         'name': None,
                         'file_url': None,
@@ -81,9 +103,11 @@ def init_routes(app):
                 result = Result.query.filter_by(user_id=current_user.id, email_account_id=email_account_id).first()
                 
                 if result:
+                    log_entry, last_log_id = get_log_text(result)
                     process_data = {
                         'status': result.status,
-                        'log_entry': result.log_entry,
+                        'log_entry': log_entry,
+                        'last_log_id': last_log_id,
                         'id': result.id,
                         'name': result.name,
                         'file_url': result.file_url,
@@ -346,12 +370,31 @@ def init_routes(app):
                     )
                 )
 
+                # Delete the extra folder links of de-duplicated emails for the batch
+                db.session.execute(
+                    email_folder_links.delete().where(
+                        email_folder_links.c.email_id.in_([email_id[0] for email_id in batch])
+                    )
+                )
+
+                # Delete the sender/receiver rows for the batch
+                db.session.execute(
+                    email_participants.delete().where(
+                        email_participants.c.email_id.in_([email_id[0] for email_id in batch])
+                    )
+                )
+
+                # Delete the raw messages for the batch
+                EmailBlob.query.filter(EmailBlob.email_id.in_([email_id[0] for email_id in batch])).delete(synchronize_session=False)
+
                 # Delete emails for the batch
                 Email.query.filter(Email.id.in_([email_id[0] for email_id in batch])).delete(synchronize_session=False)
                 db.session.commit()
 
-            # Set count to 0 for all email addresses instead of deleting them
-            EmailAddress.query.filter_by(user_id=current_user.id, email_account_id=email_account_id).update({'count': 0})
+            # Set the counts to 0 for all email addresses instead of deleting them
+            EmailAddress.query.filter_by(user_id=current_user.id, email_account_id=email_account_id).update(
+                {'count': 0, 'sent_count': 0, 'received_count': 0}
+            )
             db.session.commit()
 
             # Delete email folders
@@ -372,7 +415,54 @@ def init_routes(app):
         if email_account.user_id != current_user.id:
             return jsonify({'success': False, 'message': 'Unauthorized action'}), 403
 
-        return read_imap_emails(email_account, current_user.id)
+        options = get_scan_options()
+        if options is None:
+            return jsonify({'success': False, 'message': 'Invalid scan mode'}), 400
+
+        # The scan runs as a background job, poll /scan_jobs/<job_id> for its progress
+        job = submit_scan(current_user.id, email_account_id, **options)
+        return jsonify({'success': True, 'job_id': job.job_id, 'job': job.to_dict()}), 202
+
+    @app.route('/scan_all_accounts', methods=['POST'])
+    @login_required
+    def scan_all_accounts():
+        options = get_scan_options()
+        if options is None:
+            return jsonify({'success': False, 'message': 'Invalid scan mode'}), 400
+
+        # The scheduler runs them within the global and per-provider scan limits
+        jobs = [
+            submit_scan(current_user.id, account.id, **options)
+            for account in EmailAccount.query.filter_by(user_id=current_user.id).all()
+        ]
+        return jsonify({'success': True, 'jobs': [job.to_dict() for job in jobs]}), 202
+
+    def get_scan_options():
+        """Read the scan options from the query string, or None when the mode is invalid."""
+        # 'incremental' (default) only fetches new UIDs, 'full' re-reads every folder
+        sync_mode = request.args.get('mode', 'incremental')
+        if sync_mode not in ['incremental', 'full']:
+            return None
+
+        return {
+            'sync_mode': sync_mode,
+            # ?parallel=true ingests several folders at once over a pool of IMAP connections
+            'parallel': request.args.get('parallel', 'false').lower() == 'true',
+            # ?headers_first=true skips downloading the body of emails excluded by an address rule
+            'headers_first': request.args.get('headers_first', 'false').lower() == 'true',
+            # ?resume=false starts folders left unfinished by a stopped or failed scan over
+            'resume': request.args.get('resume', 'true').lower() != 'false',
+            # ?gmail_all_mail=false walks Gmail labels as separate folders instead of reading All Mail once
+            'gmail_all_mail': request.args.get('gmail_all_mail', 'true').lower() != 'false',
+        }
+
+    @app.route('/scan_jobs/<job_id>', methods=['GET'])
+    @login_required
+    def scan_job_status(job_id):
+        job = scan_jobs.get(job_id)
+        if job is None or job.user_id != current_user.id:
+            return jsonify({'success': False, 'message': 'Scan job not found'}), 404
+        return jsonify({'success': True, 'job': job.to_dict()})
 
 
     def test_email_connection_logic(email_address, password, email_type, server, port):
@@ -442,13 +532,11 @@ def init_routes(app):
         folder_data = []
 
         for folder in folders:
-            email_count = folder.email_count
-            found_count = Email.query.filter_by(email_account_id=email_account_id, email_folder_id=folder.id).count()
-
+            # stored_count includes the emails first stored under another folder and linked to this one
             folder_data.append({
                 'folder_name': folder.folder_name,
-                'email_count': email_count,
-                'found_count': found_count
+                'email_count': folder.email_count,
+                'found_count': folder.stored_count
             })
 
         return jsonify({'folders': folder_data})
@@ -458,7 +546,8 @@ def init_routes(app):
     def check_scan_status(email_account_id):
         email_account_id = int(email_account_id)
         status = scan_status.get((current_user.id, email_account_id), 'stopped')
-        return jsonify({'status': status})
+        job = get_account_job(current_user.id, email_account_id)
+        return jsonify({'status': status, 'job': job.to_dict() if job is not None else None})
 
     @app.route('/stop_scan/<int:email_account_id>', methods=['POST'])
     @login_required
@@ -787,23 +876,17 @@ def init_routes(app):
             email_str = email_address.email_address
 
             # Query emails where the email address is in the sender or receivers
-            emails = Email.query.filter(
-                or_(
-                    Email.sender_id == email_address.id,
-                    Email.receivers.any(EmailAddress.id == email_address.id)
-                )
-            ).slice(start, end).all()
+            email_ids_query = db.session.query(email_participants.c.email_id).filter(
+                email_participants.c.email_account_id == email_address.email_account_id,
+                email_participants.c.email_address_id == email_address.id
+            ).distinct()
+            email_ids = email_ids_query.order_by(email_participants.c.email_id).slice(start, end).all()
 
             email_data = [{
-                'id': email.id
-            } for email in emails]
+                'id': id[0]
+            } for id in email_ids]
 
-            total_emails = Email.query.filter(
-                or_(
-                    Email.sender_id == email_address.id,
-                    Email.receivers.any(EmailAddress.id == email_address.id)
-                )
-            ).count()
+            total_emails = email_ids_query.count()
 
             return jsonify(success=True, email_ids=email_data, total=total_emails)
         except Exception as e:
@@ -873,12 +956,10 @@ def init_routes(app):
                 return jsonify(success=False, message='Email address not found'), 404
 
             # Get only email IDs where this address is either sender or receiver
-            email_ids = db.session.query(Email.id).filter(
-                or_(
-                    Email.sender_id == email_address.id,
-                    Email.receivers.any(EmailAddress.id == email_address.id)
-                )
-            ).all()
+            email_ids = db.session.query(email_participants.c.email_id).filter(
+                email_participants.c.email_account_id == email_address.email_account_id,
+                email_participants.c.email_address_id == email_address.id
+            ).distinct().all()
 
             # Convert list of tuples to list of dicts directly
             email_data = [{'id': id[0]} for id in email_ids]
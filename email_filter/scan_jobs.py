@@ -0,0 +1,211 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+from flask import current_app
+from .extensions import db
+from .models import EmailAccount
+from email_filter.globals import scan_status, scan_jobs
+from email_filter.email_processor import read_imap_emails
+from email_filter.imap_pool import get_provider_cooldown
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of account scans that run at once in this process; more jobs wait queued
+SCAN_JOB_WORKERS = int(os.getenv("SCAN_JOB_WORKERS", 4))
+
+# Number of account scans that run at once per provider. Each scan opens its own pool of
+# connections (see IMAP_POOL_SIZES), and providers throttle many logins from one host.
+SCAN_JOB_PROVIDER_LIMITS = {
+    'GMAIL': int(os.getenv("SCAN_JOBS_GMAIL", 3)),
+    'APPLE': int(os.getenv("SCAN_JOBS_APPLE", 2)),
+    'OFFICE': int(os.getenv("SCAN_JOBS_OFFICE", 2)),
+}
+DEFAULT_SCAN_JOB_PROVIDER_LIMIT = int(os.getenv("SCAN_JOBS_PER_PROVIDER", 2))
+
+# Seconds a finished job stays queryable
+SCAN_JOB_RETENTION = int(os.getenv("SCAN_JOB_RETENTION", 24 * 60 * 60))
+
+# Use the global logger
+logger = logging.getLogger(__name__)
+
+# Scheduler state: jobs waiting to start and the running jobs per provider
+_pending = []
+_running = Counter()
+_scheduler = None
+_scheduler_lock = threading.Condition()
+
+
+class ScanJob:
+    """A background read_imap_emails run for one account, with its progress."""
+
+    def __init__(self, user_id, email_account_id, provider, options):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.email_account_id = email_account_id
+        self.provider = provider
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.folders_total = 0
+        self.folders_done = 0
+        self.failed_folders = []
+        self.pipeline = None
+        self.app = None
+        self._lock = threading.Lock()
+
+    def folder_done(self):
+        with self._lock:
+            self.folders_done += 1
+
+    def folder_failed(self, mailbox_name):
+        with self._lock:
+            self.failed_folders.append(mailbox_name)
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        pipeline = self.pipeline
+        messages = pipeline.fetched if pipeline is not None else 0
+        bytes_fetched = pipeline.fetched_bytes if pipeline is not None else 0
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        return {
+            'job_id': self.job_id,
+            'email_account_id': self.email_account_id,
+            'provider': self.provider,
+            'status': self.status,
+            'error': self.error,
+            'folders_total': self.folders_total,
+            'folders_done': self.folders_done,
+            'failed_folders': list(self.failed_folders),
+            'messages': messages,
+            'bytes': bytes_fetched,
+            'written': pipeline.written if pipeline is not None else 0,
+            'errors': pipeline.errors if pipeline is not None else 0,
+            'elapsed': round(elapsed, 1),
+            'messages_per_sec': round(messages / elapsed, 1) if elapsed else 0,
+        }
+
+
+def get_provider_scan_limit(provider):
+    """Return the number of scans allowed to run at once for a provider."""
+    return max(1, SCAN_JOB_PROVIDER_LIMITS.get(provider, DEFAULT_SCAN_JOB_PROVIDER_LIMIT))
+
+
+def _start_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_schedule_loop, name='scan-scheduler', daemon=True)
+            _scheduler.start()
+
+
+def _schedule_loop():
+    while True:
+        with _scheduler_lock:
+            _dispatch()
+            # Woken by new and finished jobs, and periodically for ended provider cooldowns
+            _scheduler_lock.wait(timeout=1)
+
+
+def _dispatch():
+    """Start queued jobs in submission order while the global and per-provider limits allow (lock held)."""
+    for job in list(_pending):
+        if scan_status.get((job.user_id, job.email_account_id)) == 'stopping':
+            # Stopped while still queued, no need to wait for a free slot
+            _pending.remove(job)
+            job.status = 'stopped'
+            job.finished_at = time.time()
+            scan_status[(job.user_id, job.email_account_id)] = 'stopped'
+            continue
+        if sum(_running.values()) >= SCAN_JOB_WORKERS:
+            return
+        if _running[job.provider] >= get_provider_scan_limit(job.provider):
+            continue
+        if get_provider_cooldown(job.provider) > 0:
+            # The provider throttled a running scan, do not add load until it backs off
+            continue
+        _pending.remove(job)
+        _running[job.provider] += 1
+        threading.Thread(target=_run_scan, args=(job,), name=f"scan-job-{job.email_account_id}", daemon=True).start()
+
+
+def _prune_jobs():
+    """Forget jobs that finished longer than SCAN_JOB_RETENTION ago (lock held)."""
+    cutoff = time.time() - SCAN_JOB_RETENTION
+    for job_id, job in list(scan_jobs.items()):
+        if job.finished_at and job.finished_at < cutoff:
+            scan_jobs.pop(job_id, None)
+
+
+def get_account_job(user_id, email_account_id):
+    """Return the most recent job of an account, or None."""
+    # Under the lock: submit_scan and _prune_jobs change scan_jobs from other threads
+    with _scheduler_lock:
+        jobs = [job for job in scan_jobs.values() if job.user_id == user_id and job.email_account_id == email_account_id]
+    return max(jobs, key=lambda job: job.created_at) if jobs else None
+
+
+def submit_scan(user_id, email_account_id, **options):
+    """
+    Queue a scan of the account and return its ScanJob. options are passed on to read_imap_emails.
+    An account that is already queued or scanning gets its current job back instead of a second scan.
+    Jobs start in submission order within SCAN_JOB_WORKERS and the provider's limit.
+    """
+    account = db.session.get(EmailAccount, email_account_id)
+    _start_scheduler()
+    with _scheduler_lock:
+        _prune_jobs()
+        job = get_account_job(user_id, email_account_id)
+        if job is not None and job.active:
+            return job
+
+        job = ScanJob(user_id, email_account_id, account.provider, options)
+        job.app = current_app._get_current_object()
+        scan_jobs[job.job_id] = job
+        scan_status[(user_id, email_account_id)] = 'running'
+        _pending.append(job)
+        _scheduler_lock.notify_all()
+    return job
+
+
+def _run_scan(job):
+    try:
+        _scan(job)
+    finally:
+        with _scheduler_lock:
+            _running[job.provider] -= 1
+            _scheduler_lock.notify_all()
+
+
+def _scan(job):
+    with job.app.app_context():
+        try:
+            job.status = 'running'
+            job.started_at = time.time()
+            account = db.session.get(EmailAccount, job.email_account_id)
+            result = read_imap_emails(account, job.user_id, job=job, **job.options)
+            if result.get('success'):
+                job.status = 'finished'
+            elif result.get('error') == 'stopped by user request':
+                job.status = 'stopped'
+            else:
+                job.status = 'failed'
+                job.error = result.get('error')
+        except Exception as e:
+            logger.error(f"Error in scan job {job.job_id}: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+            scan_status[(job.user_id, job.email_account_id)] = 'stopped'
+        finally:
+            job.finished_at = time.time()
+            db.session.remove()
@@ -352,7 +352,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     })
                     .then(data => {
                         if (data.success) {
-                            displayFlashMessage('Scanned emails.', 'success');
+                            displayFlashMessage('Scan started.', 'success');
                         } else {
                             displayFlashMessage('Failed to scan emails: ' + data.error, 'danger');
                         }
@@ -972,6 +972,11 @@ document.addEventListener('DOMContentLoaded', function() {
         const url = new URL(`/process_email_results`, window.location.origin);
         url.searchParams.append('email_account_id', selectedAccountId);
 
+        // Only ask for the log lines after the last one shown
+        const logElement = document.getElementById('processResultsLog');
+        url.searchParams.append('after', logElement ? logElement.dataset.lastLogId || 0 : 0);
+        url.searchParams.append('result_id', logElement ? logElement.dataset.resultId || 0 : 0);
+
         fetch(url, {
                 method: 'GET',
                 headers: {
@@ -984,29 +989,28 @@ document.addEventListener('DOMContentLoaded', function() {
                         throw new Error(errorData.message || 'Unknown error occurred');
                     });
                 }
-                return response.text();
+                return response.json();
             })
-            .then(html => {
-                const parser = new DOMParser();
-                const doc = parser.parseFromString(html, 'text/html');
-                const statusElement = doc.querySelector('#processResultsStatus');
-                const logElement = doc.querySelector('#processResultsLog');
-
+            .then(data => {
                 const liveResultsUpdateToggle = document.getElementById('liveResultsUpdateToggle');
                 const resultsRunningIndicator = document.getElementById('resultsRunningIndicator');
                 const stopResultsButton = document.getElementById('stopResultsButton');
                 const processResultsButton = document.getElementById('processResultsButton');
+                const currentStatusElement = document.getElementById('processResultsStatus');
+                const currentLogElement = document.getElementById('processResultsLog');
 
-                if (statusElement && logElement) {
-                    const status = statusElement.textContent.trim();
-                    const logEntry = logElement.value.trim();
-
-                    const currentStatusElement = document.getElementById('processResultsStatus');
-                    const currentLogElement = document.getElementById('processResultsLog');
+                if (data.success) {
+                    const status = `Status: ${data.status}`;
 
                     if (currentStatusElement && currentLogElement) {
                         currentStatusElement.textContent = status;
-                        currentLogElement.value = logEntry;
+                        if (data.reset) {
+                            currentLogElement.value = data.lines.join('');
+                        } else if (data.lines.length) {
+                            currentLogElement.value += data.lines.join('');
+                        }
+                        currentLogElement.dataset.resultId = data.result_id;
+                        currentLogElement.dataset.lastLogId = data.last_log_id;
                     } else {
                         console.error('Process results elements not found in the current document.');
                     }
@@ -1031,7 +1035,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
 
                 } else {
-                    console.error('Failed to extract process data from HTML.');
+                    console.error('Failed to retrieve process data.');
                 }
             })
             .catch(error => {
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
+from sqlalchemy.ext.compiler import compiles
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_filter.extensions import db  # noqa: E402
+
+# Manual scripts that connect to real servers when imported, run them directly instead
+collect_ignore = ['test_imap.py', 'test_imap copy.py', 'test_icloud_imap copy.py']
+
+
+# The MySQL column types the models use, rendered for the SQLite test database
+@compiles(LONGTEXT, 'sqlite')
+def _compile_longtext(element, compiler, **kw):
+    return 'TEXT'
+
+
+@compiles(LONGBLOB, 'sqlite')
+def _compile_longblob(element, compiler, **kw):
+    return 'BLOB'
+
+
+@pytest.fixture
+def sqlite_app(tmp_path):
+    """An app context on a SQLite file holding every table, for code that only uses portable SQL."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'email_filter.db'}"
+    db.init_app(app)
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def add_functions(connection, record):
+            connection.create_function('greatest', 2, max)
+
+        db.create_all()
+        yield app
+        db.session.remove()
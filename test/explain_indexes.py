@@ -0,0 +1,98 @@
+"""
+Index regression check: runs EXPLAIN on the hot Email queries and fails when one stops using its index.
+
+Needs the app's database (see config.py) with the indexes from README.txt, and an account with
+enough stored emails for the optimizer to prefer the indexes (on a nearly empty table a full scan
+is cheaper and the check would fail). Keep the queries here in step with export_processor.py and
+routes.py when those change:
+
+    python test/explain_indexes.py --email-account-id 3
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, text, update
+from email_filter import create_app, db
+from email_filter.models import Email, EmailAccount, EmailAddress, EmailBlob, email_participants
+
+
+def hot_queries(user_id, email_account_id, email_folder_id, email_address_id):
+    """(name, statement, {table: index it must use}) for the queries that run against big tables."""
+    return [
+        ('account email count (process_emails)',
+         db.session.query(func.count(Email.id)).filter_by(user_id=user_id, email_account_id=email_account_id),
+         {'email': 'ix_email_user_account_action'}),
+        ('reset actions (preprocess_cleanup)',
+         update(Email).where(Email.user_id == user_id, Email.email_account_id == email_account_id).values(action='ignore'),
+         {'email': 'ix_email_user_account_action'}),
+        ('prompt batch (process_prompts)',
+         db.session.query(Email.id).filter_by(user_id=user_id, email_account_id=email_account_id, action='ignore').limit(100),
+         {'email': 'ix_email_user_account_action'}),
+        ('export (generate_files)',
+         db.session.query(EmailBlob.raw_data).join(Email, Email.id == EmailBlob.email_id).filter(
+             Email.user_id == user_id, Email.email_account_id == email_account_id, Email.action == 'include'),
+         {'email': 'ix_email_user_account_action', 'email_blob': 'PRIMARY'}),
+        ('folder emails (delete_folder_emails)',
+         db.session.query(Email.id).filter_by(user_id=user_id, email_account_id=email_account_id,
+                                              email_folder_id=email_folder_id),
+         {'email': 'ix_email_account_folder'}),
+        ('address list (email_addresses)',
+         db.session.query(EmailAddress).filter_by(email_account_id=email_account_id).order_by(EmailAddress.count.desc()),
+         {'email_address': 'ix_email_address_account_count'}),
+        ('address rules (process_email_addresses)',
+         db.session.query(email_participants.c.email_id).join(
+             EmailAddress, email_participants.c.email_address_id == EmailAddress.id).filter(
+             email_participants.c.email_account_id == email_account_id,
+             EmailAddress.user_id == user_id, EmailAddress.email_account_id == email_account_id,
+             EmailAddress.action == 'include'),
+         {'email_address': 'ix_email_address_account_action', 'email_participants': 'PRIMARY'}),
+        ('sender or receiver (get_emails_for_address)',
+         db.session.query(email_participants.c.email_id).filter(
+             email_participants.c.email_account_id == email_account_id,
+             email_participants.c.email_address_id == email_address_id).distinct(),
+         {'email_participants': 'PRIMARY'}),
+    ]
+
+
+def explain(statement):
+    statement = getattr(statement, 'statement', statement)
+    sql = statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    return [dict(row) for row in db.session.execute(text(f"EXPLAIN {sql}")).mappings()]
+
+
+def run(args):
+    app = create_app()
+    with app.app_context():
+        account = db.session.get(EmailAccount, args.email_account_id)
+        if account is None:
+            print(f"Email account {args.email_account_id} not found")
+            return 1
+        email = Email.query.filter_by(email_account_id=account.id).first()
+        if email is None:
+            print(f"Email account {account.id} has no stored emails")
+            return 1
+
+        failures = []
+        for name, statement, expected in hot_queries(account.user_id, account.id, email.email_folder_id,
+                                                     email.sender_id):
+            plan = explain(statement)
+            used = {row['table']: row['key'] for row in plan}
+            print(f"{name}:")
+            for row in plan:
+                print(f"    {str(row['table']):<16} type={str(row['type']):<8} key={row['key']} rows={row['rows']}")
+            for table, index in expected.items():
+                if used.get(table) != index:
+                    failures.append(f"{name}: {table} uses {used.get(table) or 'no index'} instead of {index}")
+
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--email-account-id', type=int, required=True, help='account whose stored emails are queried')
+    sys.exit(run(parser.parse_args()))
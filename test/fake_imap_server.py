@@ -0,0 +1,337 @@
+"""
+Local IMAP stand-in serving generated mailboxes, for measuring ingest without a real provider.
+
+It speaks enough IMAP4rev1 for read_imap_emails: CAPABILITY, LOGIN, LIST, STATUS,
+SELECT/EXAMINE, UID SEARCH (ALL, UID n:*, SINCE/BEFORE) and UID FETCH of UID,
+RFC822.SIZE, BODY.PEEK[], BODY.PEEK[HEADER.FIELDS (...)] and X-GM-LABELS. With gmail=True
+it advertises X-GM-EXT-1 and serves every message once from "[Gmail]/All Mail", with the
+folders as labels.
+
+    python test/fake_imap_server.py --folders 5 --messages 500 --port 1143
+"""
+import re
+import ssl
+import time
+import random
+import argparse
+import threading
+import socketserver
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import format_datetime
+
+WORDS = ("invoice meeting project update quarterly report schedule budget review contract "
+         "shipment order account travel family weekend dinner lunch photos school newsletter "
+         "sale offer security alert password reset delivery receipt payment reminder").split()
+
+ALL_MAIL = '[Gmail]/All Mail'
+
+
+class FakeMessage:
+    def __init__(self, uid, date, raw, labels=()):
+        self.uid = uid
+        self.date = date
+        self.raw = raw
+        self.labels = list(labels)
+
+    def header(self, fields):
+        """Return the requested header fields, as BODY[HEADER.FIELDS (...)] would."""
+        head = self.raw.split(b'\r\n\r\n', 1)[0]
+        wanted = {field.upper().encode() for field in fields}
+        lines = []
+        keep = False
+        for line in head.split(b'\r\n'):
+            if line[:1] in (b' ', b'\t'):
+                if keep:
+                    lines.append(line)
+                continue
+            keep = line.split(b':', 1)[0].strip().upper() in wanted
+            if keep:
+                lines.append(line)
+        return b'\r\n'.join(lines) + b'\r\n\r\n'
+
+
+def generate_message(rng, uid, folder, addresses, size_median, size_sigma, html_ratio, attachment_ratio,
+                     attachment_size, start_date):
+    """Build one message of roughly lognormal body size, HTML or plain, with an optional attachment."""
+    date = start_date + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+    body_size = max(200, int(rng.lognormvariate(0, size_sigma) * size_median))
+    text = ' '.join(rng.choice(WORDS) for _ in range(body_size // 7))
+
+    message = EmailMessage()
+    message['From'] = rng.choice(addresses)
+    message['To'] = ', '.join(rng.sample(addresses, rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        message['Cc'] = rng.choice(addresses)
+    message['Subject'] = f"{folder} {' '.join(rng.choice(WORDS) for _ in range(5))}"
+    message['Date'] = format_datetime(date)
+    message['Message-ID'] = f"<{uid}.{rng.getrandbits(64):016x}@bench.invalid>"
+    if rng.random() < html_ratio:
+        message.set_content(text)
+        message.add_alternative(f"<html><body><p>{text}</p><script>x()</script></body></html>", subtype='html')
+    else:
+        message.set_content(text)
+    if rng.random() < attachment_ratio:
+        message.add_attachment(rng.randbytes(attachment_size), maintype='application', subtype='octet-stream',
+                               filename=f"attachment-{uid}.bin")
+    return FakeMessage(uid, date, message.as_bytes(policy=SMTP))
+
+
+def generate_mailboxes(folders=5, messages_per_folder=200, size_median=8000, size_sigma=1.0, html_ratio=0.5,
+                       attachment_ratio=0.1, attachment_size=200 * 1024, duplicate_ratio=0.0, addresses=200,
+                       gmail=False, seed=1):
+    """
+    Generate {mailbox name: [FakeMessage]} deterministically from seed. duplicate_ratio copies that
+    share of each folder's messages into the next folder (or, with gmail, gives them a second label).
+    """
+    rng = random.Random(seed)
+    address_pool = [f"user{i}@example{i % 17}.com" for i in range(addresses)]
+    start_date = datetime(2023, 1, 1).astimezone()
+    names = ['INBOX'] + [f"Folder {i}" for i in range(1, folders)]
+
+    mailboxes = {name: [] for name in names}
+    for index, name in enumerate(names):
+        for _ in range(messages_per_folder):
+            uid = len(mailboxes[name]) + 1
+            message = generate_message(rng, uid, name, address_pool, size_median, size_sigma, html_ratio,
+                                       attachment_ratio, attachment_size, start_date)
+            message.labels = [name]
+            mailboxes[name].append(message)
+            if duplicate_ratio and rng.random() < duplicate_ratio:
+                other = names[(index + 1) % len(names)]
+                if gmail:
+                    message.labels.append(other)
+                else:
+                    mailboxes[other].append(FakeMessage(len(mailboxes[other]) + 1, message.date, message.raw, [other]))
+
+    if gmail:
+        all_mail = [message for name in names for message in mailboxes[name]]
+        for uid, message in enumerate(all_mail, start=1):
+            message.uid = uid
+        mailboxes = {ALL_MAIL: all_mail, **{name: [] for name in names}}
+    return mailboxes
+
+
+def tokenize(text):
+    """Split an IMAP command's arguments into atoms, quoted strings and parenthesized lists."""
+    return [quoted if quoted is not None else atom
+            for quoted, atom in re.findall(r'"((?:[^"\\]|\\.)*)"|(\([^)]*\)|[^\s]+)', text)]
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        if self.server.ssl_context is not None:
+            self.request = self.server.ssl_context.wrap_socket(self.request, server_side=True)
+        super().setup()
+        self.selected = None
+
+    def send(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode())
+
+    def handle(self):
+        self.send('* OK [CAPABILITY IMAP4rev1] Fake IMAP ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode(errors='replace').rstrip('\r\n').split(' ', 2)
+            if len(parts) < 2:
+                continue
+            tag, command = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ''
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.server.count(command)
+            try:
+                if command == 'LOGOUT':
+                    self.send(f'* BYE logging out\r\n{tag} OK LOGOUT completed\r\n')
+                    return
+                handler = getattr(self, f'do_{command.lower()}', None)
+                if handler is None:
+                    self.send(f'{tag} BAD unknown command\r\n')
+                else:
+                    handler(tag, args)
+            except Exception as e:
+                self.send(f'{tag} BAD {e}\r\n')
+            self.wfile.flush()
+
+    def capabilities(self):
+        return 'IMAP4rev1 AUTH=PLAIN' + (' X-GM-EXT-1' if self.server.gmail else '')
+
+    def do_capability(self, tag, args):
+        self.send(f'* CAPABILITY {self.capabilities()}\r\n{tag} OK CAPABILITY completed\r\n')
+
+    def do_noop(self, tag, args):
+        self.send(f'{tag} OK NOOP completed\r\n')
+
+    def do_login(self, tag, args):
+        self.send(f'{tag} OK [CAPABILITY {self.capabilities()}] LOGIN completed\r\n')
+
+    def do_list(self, tag, args):
+        for name in self.server.mailboxes:
+            flags = '\\HasNoChildren \\All' if name == ALL_MAIL else '\\HasNoChildren'
+            self.send(f'* LIST ({flags}) "/" "{name}"\r\n')
+        self.send(f'{tag} OK LIST completed\r\n')
+
+    def mailbox(self, name):
+        if name not in self.server.mailboxes:
+            raise ValueError(f"no mailbox {name}")
+        return self.server.mailboxes[name]
+
+    def do_status(self, tag, args):
+        name = tokenize(args)[0]
+        messages = self.mailbox(name)
+        uid_next = messages[-1].uid + 1 if messages else 1
+        self.send(f'* STATUS "{name}" (MESSAGES {len(messages)} UIDVALIDITY {self.server.uid_validity} '
+                  f'UIDNEXT {uid_next})\r\n{tag} OK STATUS completed\r\n')
+
+    def do_select(self, tag, args, command='SELECT'):
+        name = tokenize(args)[0]
+        messages = self.mailbox(name)
+        self.selected = name
+        uid_next = messages[-1].uid + 1 if messages else 1
+        self.send(f'* {len(messages)} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY {self.server.uid_validity}]\r\n'
+                  f'* OK [UIDNEXT {uid_next}]\r\n{tag} OK [READ-ONLY] {command} completed\r\n')
+
+    def do_examine(self, tag, args):
+        self.do_select(tag, args, command='EXAMINE')
+
+    def do_uid(self, tag, args):
+        command, _, rest = args.partition(' ')
+        messages = self.mailbox(self.selected)
+        if command.upper() == 'SEARCH':
+            self.send(f"* SEARCH {' '.join(str(m.uid) for m in self.search(messages, rest))}\r\n"
+                      f"{tag} OK SEARCH completed\r\n")
+        elif command.upper() == 'FETCH':
+            uid_set, _, items = rest.partition(' ')
+            self.fetch(messages, parse_uid_set(uid_set), items.upper())
+            self.send(f'{tag} OK FETCH completed\r\n')
+        else:
+            self.send(f'{tag} BAD unsupported UID command\r\n')
+
+    def search(self, messages, criteria):
+        match = re.search(r'UID (\d+)(?::(\d+|\*))?', criteria)
+        if match:
+            low = int(match.group(1))
+            high = match.group(2)
+            high = None if high == '*' else int(high) if high else low
+            messages = [m for m in messages if m.uid >= low and (high is None or m.uid <= high)]
+        since = re.search(r'SINCE "?(\d+-\w+-\d+)"?', criteria)
+        before = re.search(r'BEFORE "?(\d+-\w+-\d+)"?', criteria)
+        if since:
+            since_date = datetime.strptime(since.group(1), '%d-%b-%Y').date()
+            messages = [m for m in messages if m.date.date() >= since_date]
+        if before:
+            before_date = datetime.strptime(before.group(1), '%d-%b-%Y').date()
+            messages = [m for m in messages if m.date.date() < before_date]
+        return messages
+
+    def fetch(self, messages, uids, items):
+        header_fields = re.search(r'HEADER\.FIELDS \(([^)]*)\)', items)
+        for seq, message in enumerate(messages, start=1):
+            if not uids(message.uid):
+                continue
+            parts = [f'UID {message.uid}']
+            if 'RFC822.SIZE' in items:
+                parts.append(f'RFC822.SIZE {len(message.raw)}')
+            if 'X-GM-LABELS' in items:
+                labels = ' '.join('"\\\\Inbox"' if label == 'INBOX' else f'"{label}"' for label in message.labels)
+                parts.append(f'X-GM-LABELS ({labels})')
+            literal = None
+            if header_fields:
+                literal = message.header(header_fields.group(1).split())
+                parts.append(f'BODY[HEADER.FIELDS ({header_fields.group(1)})] {{{len(literal)}}}')
+            elif 'BODY.PEEK[]' in items or 'BODY[]' in items:
+                literal = message.raw
+                parts.append(f'BODY[] {{{len(literal)}}}')
+            if literal is None:
+                self.send(f"* {seq} FETCH ({' '.join(parts)})\r\n")
+            else:
+                self.send(f"* {seq} FETCH ({' '.join(parts)}\r\n".encode() + literal + b')\r\n')
+            self.server.count_bytes(len(literal or b''))
+
+
+def parse_uid_set(uid_set):
+    """Return a predicate for an IMAP UID set such as '1:5,7,9:*'."""
+    ranges = []
+    for part in uid_set.split(','):
+        low, _, high = part.partition(':')
+        ranges.append((int(low), None if high == '*' else int(high) if high else int(low)))
+    return lambda uid: any(uid >= low and (high is None or uid <= high) for low, high in ranges)
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Threaded fake IMAP server. Use port 0 for a free port and read it back from .port."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes, host='127.0.0.1', port=0, certfile=None, keyfile=None, latency=0.0, gmail=False):
+        super().__init__((host, port), IMAPHandler)
+        self.mailboxes = mailboxes
+        self.latency = latency
+        self.gmail = gmail
+        self.uid_validity = 1
+        self.ssl_context = None
+        if certfile:
+            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.commands = {}
+        self.bytes_served = 0
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, command):
+        with self._stats_lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+    def count_bytes(self, size):
+        with self._stats_lock:
+            self.bytes_served += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-imap', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_generator_arguments(parser):
+    parser.add_argument('--folders', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=200, help='messages per folder')
+    parser.add_argument('--size-median', type=int, default=8000, help='median body size in bytes')
+    parser.add_argument('--size-sigma', type=float, default=1.0, help='lognormal spread of body sizes')
+    parser.add_argument('--html-ratio', type=float, default=0.5)
+    parser.add_argument('--attachment-ratio', type=float, default=0.1)
+    parser.add_argument('--attachment-size', type=int, default=200 * 1024)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0)
+    parser.add_argument('--gmail', action='store_true', help='serve everything from [Gmail]/All Mail with labels')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every command')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def mailboxes_from_arguments(args):
+    return generate_mailboxes(folders=args.folders, messages_per_folder=args.messages, size_median=args.size_median,
+                              size_sigma=args.size_sigma, html_ratio=args.html_ratio,
+                              attachment_ratio=args.attachment_ratio, attachment_size=args.attachment_size,
+                              duplicate_ratio=args.duplicate_ratio, gmail=args.gmail, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_generator_arguments(parser)
+    parser.add_argument('--port', type=int, default=1143)
+    parser.add_argument('--certfile', help='serve IMAPS with this certificate (PEM, key included)')
+    args = parser.parse_args()
+
+    server = FakeIMAPServer(mailboxes_from_arguments(args), port=args.port, certfile=args.certfile,
+                            latency=args.latency, gmail=args.gmail)
+    print(f"Serving {sum(len(m) for m in server.mailboxes.values())} messages on port {server.port}")
+    server.serve_forever()
@@ -0,0 +1,141 @@
+"""
+Ingest throughput benchmark: runs read_imap_emails against the local fake IMAP server.
+
+Needs the app's database (see config.py). It creates a throwaway user and account, scans the
+generated mailboxes and reports messages/sec, bytes/sec, peak RSS and DB statements per
+message, then deletes what it stored (unless --keep). The thresholds make it exit non-zero,
+so it can guard against ingest regressions:
+
+    python test/ingest_benchmark.py --folders 5 --messages 1000 --parallel --min-messages-per-sec 200
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+from fake_imap_server import FakeIMAPServer, add_generator_arguments, mailboxes_from_arguments
+from email_filter import create_app, db
+from email_filter.models import User, EmailAccount, EmailAddress, EmailFolder
+from email_filter.email_processor import read_imap_emails, delete_folder_emails
+from email_filter.scan_jobs import ScanJob
+
+BENCHMARK_USER = 'ingest-benchmark@example.invalid'
+
+
+def make_certificate(directory):
+    """Create a self-signed certificate for the fake server (imaplib does not verify it)."""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', keyfile, '-out', certfile,
+                    '-days', '1', '-subj', '/CN=localhost'], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (the parse pool), in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return own / scale, children / scale
+
+
+def clean_up(user):
+    for account in EmailAccount.query.filter_by(user_id=user.id).all():
+        for folder in EmailFolder.query.filter_by(user_id=user.id, email_account_id=account.id).all():
+            delete_folder_emails(user.id, account.id, folder.id)
+        EmailAddress.query.filter_by(user_id=user.id, email_account_id=account.id).delete()
+        EmailFolder.query.filter_by(user_id=user.id, email_account_id=account.id).delete()
+        db.session.delete(account)
+    db.session.delete(user)
+    db.session.commit()
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = make_certificate(directory)
+        mailboxes = mailboxes_from_arguments(args)
+        server = FakeIMAPServer(mailboxes, certfile=certfile, keyfile=keyfile, latency=args.latency,
+                                gmail=args.gmail).start()
+        generated = sum(len(messages) for messages in mailboxes.values())
+        generated_bytes = sum(len(message.raw) for messages in mailboxes.values() for message in messages)
+        print(f"Generated {generated} messages ({generated_bytes / 1e6:.1f} MB) in {len(mailboxes)} mailboxes")
+
+        app = create_app()
+        with app.app_context():
+            user = User.query.filter_by(email_address=BENCHMARK_USER).first()
+            if user is not None:
+                clean_up(user)
+            user = User(email_address=BENCHMARK_USER, password='x')
+            db.session.add(user)
+            db.session.commit()
+            account = EmailAccount(user_id=user.id, email_address='bench@bench.invalid', password='x',
+                                   provider='GMAIL' if args.gmail else 'BENCH', imap_server='127.0.0.1',
+                                   imap_port=str(server.port), imap_use_ssl=True)
+            db.session.add(account)
+            db.session.commit()
+
+            statements = [0]
+
+            @event.listens_for(db.engine, 'before_cursor_execute')
+            def count_statement(*_):
+                statements[0] += 1
+
+            job = ScanJob(user.id, account.id, account.provider, {})
+            started = time.perf_counter()
+            result = read_imap_emails(account, user.id, sync_mode='full', parallel=args.parallel,
+                                      headers_first=args.headers_first, job=job)
+            elapsed = time.perf_counter() - started
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+            pipeline = job.pipeline
+            messages = pipeline.fetched if pipeline is not None else 0
+            fetched_bytes = pipeline.fetched_bytes if pipeline is not None else 0
+            own_rss, children_rss = peak_rss_mb()
+            report = {
+                'messages_per_sec': messages / elapsed if elapsed else 0,
+                'statements_per_message': statements[0] / messages if messages else 0,
+            }
+            print(f"Result:               {result}")
+            print(f"Messages:             {messages} in {elapsed:.1f}s ({report['messages_per_sec']:.1f}/s)")
+            print(f"Bytes:                {fetched_bytes / 1e6:.1f} MB ({fetched_bytes / 1e6 / elapsed:.2f} MB/s)")
+            print(f"Written / errors:     {pipeline.written if pipeline else 0} / {pipeline.errors if pipeline else 0}")
+            print(f"Peak RSS:             {own_rss:.0f} MB (parse processes {children_rss:.0f} MB)")
+            print(f"DB statements:        {statements[0]} ({report['statements_per_message']:.2f} per message)")
+            print(f"IMAP commands:        {dict(sorted(server.commands.items()))}")
+
+            if not args.keep:
+                clean_up(user)
+        server.stop()
+
+    failures = []
+    if not result.get('success'):
+        failures.append(f"scan failed: {result.get('error')}")
+    if messages < generated and not args.headers_first:
+        failures.append(f"only {messages} of {generated} messages were fetched")
+    if args.min_messages_per_sec and report['messages_per_sec'] < args.min_messages_per_sec:
+        failures.append(f"{report['messages_per_sec']:.1f} messages/s is below {args.min_messages_per_sec}")
+    if args.max_statements_per_message and report['statements_per_message'] > args.max_statements_per_message:
+        failures.append(f"{report['statements_per_message']:.2f} statements/message is above "
+                        f"{args.max_statements_per_message}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_generator_arguments(parser)
+    parser.add_argument('--parallel', action='store_true', help='ingest several folders at once')
+    parser.add_argument('--headers-first', action='store_true')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark account and its emails')
+    parser.add_argument('--min-messages-per-sec', type=float, default=0)
+    parser.add_argument('--max-statements-per-message', type=float, default=0)
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""Externalizing attachments to a LocalBlobStore and putting them back."""
+import base64
+from email.message import EmailMessage
+
+from email_filter.blob_store import LocalBlobStore, externalize_attachments, rehydrate_attachments
+
+STUB_TEXT = 'X-Email-Filter-Blob: sha256:%s:12' % ('0' * 64)
+
+
+def make_message(text, attachment=b'\x00' * 4096):
+    message = EmailMessage()
+    message['Subject'] = 'Report'
+    message['From'] = 'a@example.com'
+    message['To'] = 'b@example.com'
+    message.set_content(text, cte='7bit')
+    message.add_attachment(attachment, maintype='application', subtype='octet-stream', filename='report.bin')
+    return message.as_bytes()
+
+
+def test_round_trip_restores_the_original_bytes(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    raw = make_message('See attached.\n')
+
+    stored = externalize_attachments(raw, store=store, min_bytes=1024)
+
+    assert len(stored) < len(raw)
+    assert base64.encodebytes(b'\x00' * 4096).strip() not in stored
+    assert rehydrate_attachments(stored, store=store) == raw
+
+
+def test_identical_attachments_are_stored_once(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    externalize_attachments(make_message('First'), store=store, min_bytes=1024)
+    externalize_attachments(make_message('Second'), store=store, min_bytes=1024)
+
+    assert len([path for path in tmp_path.rglob('*') if path.is_file()]) == 1
+
+
+def test_small_attachments_stay_inline(tmp_path):
+    raw = make_message('See attached.\n', attachment=b'tiny')
+    assert externalize_attachments(raw, store=LocalBlobStore(str(tmp_path)), min_bytes=1024) == raw
+
+
+def test_stub_text_in_the_message_is_not_rehydrated(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    raw = make_message(f'A quoted stub:\n{STUB_TEXT}\n')
+
+    stored = externalize_attachments(raw, store=store, min_bytes=1024)
+
+    assert stored.count(b'X-Email-Filter-Blob: sha256:') == 2
+    assert rehydrate_attachments(stored, store=store) == raw
+
+
+def test_stub_text_without_attachments_is_unchanged(tmp_path):
+    raw = make_message(STUB_TEXT, attachment=b'tiny')
+    assert rehydrate_attachments(raw, store=LocalBlobStore(str(tmp_path))) == raw
+
+
+def test_nested_multipart_with_preamble_and_epilogue_round_trips(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    attachment = base64.encodebytes(b'\x01' * 4096).replace(b'\n', b'\r\n')
+    raw = (b'Subject: Nested\r\nContent-Type: multipart/mixed; boundary="outer"\r\n\r\n'
+           b'preamble\r\n--outer\r\nContent-Type: multipart/alternative; boundary="inner"\r\n\r\n'
+           b'--inner\r\nContent-Type: text/plain\r\n\r\nplain\r\n'
+           b'--inner\r\nContent-Type: text/html\r\n\r\n<p>html</p>\r\n--inner--\r\n'
+           b'--outer\r\nContent-Type: image/png\r\nContent-Transfer-Encoding: base64\r\n'
+           b'Content-Disposition: inline; filename="logo.png"\r\n\r\n' + attachment +
+           b'--outer--\r\nepilogue\r\n')
+
+    stored = externalize_attachments(raw, store=store, min_bytes=1024)
+
+    assert attachment not in stored
+    assert b'<p>html</p>' in stored
+    assert rehydrate_attachments(stored, store=store) == raw
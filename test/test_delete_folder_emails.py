@@ -0,0 +1,54 @@
+"""delete_folder_emails, run when a folder's UIDVALIDITY changes, against a SQLite database."""
+from datetime import datetime
+
+from email_filter.extensions import db
+from email_filter.models import (Email, EmailAddress, EmailBlob, EmailFolder, email_folder_links,
+                                 email_participants)
+from email_filter.email_processor import delete_folder_emails
+
+
+def add_email(email_id, email_folder_id, imap_id):
+    db.session.add(Email(id=email_id, user_id=1, email_account_id=1, email_folder_id=email_folder_id,
+                         email_imap_id=imap_id, email_date=datetime(2024, 1, email_id), sender_id=1,
+                         email_subject=f'Email {email_id}'))
+    db.session.add(EmailBlob(email_id=email_id, raw_data=b'Subject: test\r\n\r\n'))
+    db.session.execute(email_participants.insert(), [
+        {'email_account_id': 1, 'email_address_id': 1, 'email_id': email_id, 'role': 'sender'}])
+
+
+def links():
+    return sorted(tuple(row) for row in db.session.query(
+        email_folder_links.c.email_id, email_folder_links.c.email_folder_id, email_folder_links.c.email_imap_id))
+
+
+def test_emails_linked_to_another_folder_move_there(sqlite_app):
+    db.session.add_all([
+        EmailFolder(id=1, user_id=1, email_account_id=1, folder_name='INBOX', email_count=3, stored_count=3),
+        EmailFolder(id=2, user_id=1, email_account_id=1, folder_name='Archive', email_count=2, stored_count=2),
+        EmailAddress(id=1, user_id=1, email_account_id=1, email_address='a@example.com', count=3, sent_count=3),
+    ])
+    # 1 is in both folders (stored under INBOX), 2 only in INBOX, 3 in both (stored under Archive)
+    add_email(1, 1, '5')
+    add_email(2, 1, '6')
+    add_email(3, 2, '10')
+    db.session.execute(email_folder_links.insert(), [
+        {'email_id': 1, 'email_folder_id': 2, 'email_imap_id': '9'},
+        {'email_id': 3, 'email_folder_id': 1, 'email_imap_id': '7'},
+    ])
+    db.session.commit()
+
+    # INBOX's UIDVALIDITY changed
+    delete_folder_emails(1, 1, 1)
+
+    db.session.expire_all()
+    assert db.session.get(Email, 2) is None
+    assert db.session.get(EmailBlob, 2) is None
+    # Archive keeps both of its emails, under its own UIDs
+    moved = db.session.get(Email, 1)
+    assert (moved.email_folder_id, moved.email_imap_id) == (2, '9')
+    assert db.session.get(EmailBlob, 1) is not None
+    assert db.session.get(Email, 3).email_folder_id == 2
+    assert links() == []
+    assert db.session.get(EmailFolder, 1).stored_count == 0
+    assert db.session.get(EmailFolder, 2).stored_count == 2
+    assert db.session.get(EmailAddress, 1).count == 2
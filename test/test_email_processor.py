@@ -0,0 +1,91 @@
+"""Pure helpers of the IMAP scan: FETCH response parsing, fetch planning and date range bookkeeping."""
+import json
+from types import SimpleNamespace
+
+from email_filter.email_processor import (SYNC_RANGE_MAX, SYNC_RANGE_MIN, compress_uid_set, date_range_criteria,
+                                          get_uncovered_ranges, parse_gmail_labels, plan_fetch_batches)
+
+
+def test_parse_gmail_labels():
+    assert parse_gmail_labels(b'1 (X-GM-LABELS (\\Inbox "My Label") UID 5)') == ['\\Inbox', 'My Label']
+    assert parse_gmail_labels(b'1 (X-GM-LABELS () UID 5)') == []
+    assert parse_gmail_labels(b'1 (UID 5)') == []
+
+
+def test_parse_gmail_labels_with_escaped_quotes_and_backslashes():
+    line = b'7 (UID 9 X-GM-LABELS ("Say \\"hi\\"" "back\\\\slash" \\Important Work/2024))'
+    assert parse_gmail_labels(line) == ['Say "hi"', 'back\\slash', '\\Important', 'Work/2024']
+
+
+def test_plan_fetch_batches_splits_on_bytes_and_count():
+    sizes = {uid: 100 for uid in range(1, 11)}
+    assert plan_fetch_batches(list(range(1, 11)), sizes, byte_budget=300, max_count=10,
+                              large_message_bytes=1000) == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]]
+    assert plan_fetch_batches(list(range(1, 11)), sizes, byte_budget=10000, max_count=4,
+                              large_message_bytes=1000) == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+
+
+def test_plan_fetch_batches_gives_large_messages_their_own_batch():
+    sizes = {1: 10, 2: 10, 3: 5000, 4: 10}
+    assert plan_fetch_batches([1, 2, 3, 4], sizes, byte_budget=10000, max_count=10,
+                              large_message_bytes=1000) == [[1, 2], [3], [4]]
+
+
+def test_plan_fetch_batches_edge_cases():
+    assert plan_fetch_batches([], {}) == []
+    # Unknown sizes count as 64KB
+    assert plan_fetch_batches([1, 2, 3], {}, byte_budget=128 * 1024, max_count=10,
+                              large_message_bytes=10 ** 9) == [[1, 2], [3]]
+    # A message over the budget (but not "large") still gets fetched, alone
+    assert plan_fetch_batches([1, 2], {1: 500, 2: 10}, byte_budget=100, max_count=10,
+                              large_message_bytes=1000) == [[1], [2]]
+
+
+def test_compress_uid_set():
+    assert compress_uid_set([1, 2, 3, 4, 5, 7, 9, 10, 11, 12]) == '1:5,7,9:12'
+    assert compress_uid_set([42]) == '42'
+    assert compress_uid_set([]) == ''
+
+
+def folder(synced_ranges, last_uid=100):
+    return SimpleNamespace(last_uid=last_uid,
+                           synced_ranges=json.dumps(synced_ranges) if synced_ranges is not None else None)
+
+
+def test_uncovered_ranges_of_a_folder_never_scanned_or_checkpointed_before_ranges():
+    assert get_uncovered_ranges(None, ('2024-01-01', '2024-02-01')) == []
+    assert get_uncovered_ranges(folder([], last_uid=None), ('2024-01-01', '2024-02-01')) == []
+    # Checkpointed before ranges were recorded: counts as covering everything
+    assert get_uncovered_ranges(folder(None), ('2024-01-01', '2024-02-01')) == []
+
+
+def test_uncovered_ranges_with_nothing_synced():
+    assert get_uncovered_ranges(folder([]), ('2024-01-01', '2024-02-01')) == [('2024-01-01', '2024-02-01')]
+
+
+def test_uncovered_ranges_of_a_widened_range():
+    synced = [['2024-03-01', '2024-04-01']]
+    assert get_uncovered_ranges(folder(synced), ('2024-01-01', '2024-06-01')) == [
+        ('2024-01-01', '2024-03-01'), ('2024-04-01', '2024-06-01')]
+    assert get_uncovered_ranges(folder(synced), ('2024-03-01', '2024-04-01')) == []
+    assert get_uncovered_ranges(folder(synced), ('2024-03-15', '2024-05-01')) == [('2024-04-01', '2024-05-01')]
+
+
+def test_uncovered_ranges_merges_overlapping_and_unsorted_synced_ranges():
+    synced = [['2024-05-01', '2024-07-01'], ['2024-01-01', '2024-03-01'], ['2024-02-01', '2024-04-01']]
+    assert get_uncovered_ranges(folder(synced), ('2023-12-01', '2024-08-01')) == [
+        ('2023-12-01', '2024-01-01'), ('2024-04-01', '2024-05-01'), ('2024-07-01', '2024-08-01')]
+
+
+def test_uncovered_ranges_with_unbounded_sentinels():
+    unbounded = (SYNC_RANGE_MIN, SYNC_RANGE_MAX)
+    assert get_uncovered_ranges(folder([list(unbounded)]), ('2024-01-01', '2024-02-01')) == []
+    assert get_uncovered_ranges(folder([['2024-01-01', '2024-02-01']]), unbounded) == [
+        (SYNC_RANGE_MIN, '2024-01-01'), ('2024-02-01', SYNC_RANGE_MAX)]
+
+
+def test_date_range_criteria_leaves_out_unbounded_ends():
+    assert date_range_criteria(('2024-01-05', '2024-02-01')) == 'SINCE "05-Jan-2024" BEFORE "01-Feb-2024"'
+    assert date_range_criteria((SYNC_RANGE_MIN, '2024-02-01')) == 'BEFORE "01-Feb-2024"'
+    assert date_range_criteria(('2024-01-05', SYNC_RANGE_MAX)) == 'SINCE "05-Jan-2024"'
+    assert date_range_criteria((SYNC_RANGE_MIN, SYNC_RANGE_MAX)) == ''
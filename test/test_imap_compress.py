@@ -0,0 +1,53 @@
+"""DeflateStream, the COMPRESS=DEFLATE wrapper around an IMAP connection's socket."""
+import zlib
+
+from email_filter.imap_compress import DeflateStream
+
+
+class FakeSocket:
+    """Hands out the server's compressed bytes in small chunks and records what is sent."""
+
+    def __init__(self, data, chunk_size=7):
+        self.chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        self.sent = b''
+
+    def recv(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def sendall(self, data):
+        self.sent += data
+
+
+def deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def test_readline_and_read_across_chunks():
+    response = b'* OK ready\r\n* 1 FETCH (UID 5 BODY[] {11}\r\nhello world)\r\nA1 OK done\r\n'
+    stream = DeflateStream(FakeSocket(deflate(response)))
+
+    assert stream.readline() == b'* OK ready\r\n'
+    assert stream.readline() == b'* 1 FETCH (UID 5 BODY[] {11}\r\n'
+    assert stream.read(11) == b'hello world'
+    assert stream.readline() == b')\r\n'
+    assert stream.readline() == b'A1 OK done\r\n'
+
+
+def test_closed_connection_returns_what_is_left():
+    stream = DeflateStream(FakeSocket(deflate(b'* BYE no newline')))
+    assert stream.readline() == b'* BYE no newline'
+    assert stream.readline() == b''
+    assert stream.read(10) == b''
+
+
+def test_each_command_is_flushed_on_its_own():
+    sock = FakeSocket(b'')
+    stream = DeflateStream(sock)
+    decompressor = zlib.decompressobj(-15)
+
+    stream.send(b'A1 NOOP\r\n')
+    assert decompressor.decompress(sock.sent) == b'A1 NOOP\r\n'
+    sent = len(sock.sent)
+    stream.send(b'A2 LOGOUT\r\n')
+    assert decompressor.decompress(sock.sent[sent:]) == b'A2 LOGOUT\r\n'
@@ -0,0 +1,196 @@
+"""Throttle detection and backoff of the IMAP connection pool, with sleeping and jitter stubbed out."""
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import email_filter.imap_pool as imap_pool
+from email_filter.imap_pool import IMAPConnectionPool, ThrottleBackoff, is_throttle_error
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(imap_pool, 'time', SimpleNamespace(monotonic=time.monotonic, sleep=slept.append))
+    monkeypatch.setattr(imap_pool.random, 'uniform', lambda low, high: high)
+    monkeypatch.setattr(imap_pool, 'provider_cooldowns', {})
+    return slept
+
+
+def test_is_throttle_error():
+    assert is_throttle_error(Exception('[THROTTLED] Account exceeded command or bandwidth limits'))
+    assert is_throttle_error(b'Too many simultaneous connections. (Failure)')
+    assert is_throttle_error([b'[UNAVAILABLE] Try again later', None])
+    assert not is_throttle_error(Exception('[AUTHENTICATIONFAILED] Invalid credentials'))
+    assert not is_throttle_error([b'FETCH completed'])
+
+
+def test_backoff_doubles_up_to_the_maximum_and_resets(sleeps):
+    backoff = ThrottleBackoff(base=1, maximum=5, max_retries=10)
+    for _ in range(5):
+        backoff.wait('[THROTTLED]')
+    assert sleeps == [1, 2, 4, 5, 5]
+
+    backoff.success()
+    backoff.wait('[THROTTLED]')
+    assert sleeps[-1] == 1
+
+
+def test_backoff_gives_up_after_max_retries(sleeps):
+    backoff = ThrottleBackoff(base=1, maximum=5, max_retries=2)
+    error = Exception('[THROTTLED]')
+    backoff.wait(error)
+    backoff.wait(error)
+    with pytest.raises(Exception) as raised:
+        backoff.wait(error)
+    assert raised.value is error
+    assert len(sleeps) == 2
+
+
+def test_backoff_sets_the_provider_cooldown(sleeps):
+    ThrottleBackoff('GMAIL', base=10, maximum=60).wait('[THROTTLED]')
+    assert 0 < imap_pool.get_provider_cooldown('GMAIL') <= 10
+    assert imap_pool.get_provider_cooldown('APPLE') == 0
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+class FakeClient:
+    def __init__(self, number):
+        self.number = number
+        self.logged_out = False
+
+    def logout(self):
+        self.logged_out = True
+
+
+def test_pool_shrinks_to_the_connections_the_server_accepted(sleeps):
+    opened = []
+
+    def connect():
+        if len(opened) == 2:
+            raise Exception('Too many simultaneous connections')
+        opened.append(FakeClient(len(opened) + 1))
+        return opened[-1]
+
+    pool = IMAPConnectionPool(connect, 4, provider='GMAIL')
+    first, second = pool.acquire(), pool.acquire()
+    # The third connection is refused, so the pool shares the two it has instead of backing off
+    third = []
+    waiter = threading.Thread(target=lambda: third.append(pool.acquire()))
+    waiter.start()
+    wait_for(lambda: pool.limit == 2)
+    pool.release(first)
+    waiter.join(5)
+    assert third == [first]
+    assert len(opened) == 2
+    assert sleeps == []
+
+
+def numbered_connect():
+    opened = []
+
+    def connect():
+        opened.append(FakeClient(len(opened) + 1))
+        return opened[-1]
+    return connect, opened
+
+
+def test_acquire_reuses_released_connections():
+    connect, opened = numbered_connect()
+    pool = IMAPConnectionPool(connect, 2)
+
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    second = pool.acquire()
+    assert second is not first
+    assert len(opened) == 2
+
+
+def test_acquire_waits_at_the_pool_size():
+    connect, opened = numbered_connect()
+    pool = IMAPConnectionPool(connect, 1)
+    first = pool.acquire()
+
+    waiting = []
+    waiter = threading.Thread(target=lambda: waiting.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert waiting == []
+    pool.release(first)
+    waiter.join(5)
+    assert waiting == [first]
+    assert len(opened) == 1
+
+
+def test_broken_connection_is_discarded():
+    connect, opened = numbered_connect()
+    pool = IMAPConnectionPool(connect, 1)
+
+    with pytest.raises(OSError):
+        with pool.connection():
+            raise OSError('connection reset')
+    assert opened[0].logged_out
+
+    # The slot is free again and a new connection is opened for it
+    with pool.connection() as email_client:
+        assert email_client is opened[1]
+    with pool.connection() as email_client:
+        assert email_client is opened[1]
+
+
+def test_other_errors_keep_the_connection():
+    connect, opened = numbered_connect()
+    pool = IMAPConnectionPool(connect, 1)
+
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError('bad search criteria')
+    with pool.connection() as email_client:
+        assert email_client is opened[0]
+    assert not opened[0].logged_out
+
+
+def test_connect_failure_frees_the_slot():
+    def connect():
+        raise Exception('[AUTHENTICATIONFAILED] Invalid credentials')
+
+    pool = IMAPConnectionPool(connect, 1)
+    for _ in range(2):
+        with pytest.raises(Exception, match='AUTHENTICATIONFAILED'):
+            pool.acquire()
+
+
+def test_reduced_limit_is_shared_by_the_waiting_callers(sleeps):
+    opened = []
+
+    def connect():
+        if opened:
+            raise Exception('[UNAVAILABLE] Too many connections')
+        opened.append(FakeClient(1))
+        return opened[0]
+
+    pool = IMAPConnectionPool(connect, 3)
+    only = pool.acquire()
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(pool.acquire())) for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+    wait_for(lambda: pool.limit == 1)
+    pool.release(only)
+    wait_for(lambda: len(results) == 1)
+    pool.release(results[0])
+    for waiter in waiters:
+        waiter.join(5)
+    assert results == [only, only]
+    assert sleeps == []
+
+    pool.close_all()
+    assert only.logged_out
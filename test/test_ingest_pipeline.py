@@ -0,0 +1,194 @@
+"""Writer checkpoints and stored rows of IngestPipeline, against a SQLite database."""
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from email_filter import ingest_pipeline
+from email_filter.extensions import db
+from email_filter.models import Email, EmailAddress, EmailBlob, EmailFolder, email_receivers
+from email_filter.ingest_pipeline import IngestPipeline, address_key, parse_raw_email
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    # A file, not :memory:, so the writer thread sees the same database
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'ingest.db'}"
+    db.init_app(app)
+    with app.app_context():
+        EmailFolder.__table__.create(db.engine)
+        EmailAddress.__table__.create(db.engine)
+        db.session.add(EmailFolder(id=1, user_id=1, email_account_id=1, folder_name='INBOX', email_count=30))
+        db.session.commit()
+        yield app
+
+
+BAD_CHARSET = b'Subject: test\r\nContent-Type: text/plain; charset="x-bogus"\r\n\r\nbody\r\n'
+
+
+def run_scan(failing_uids, batches, error=OperationalError('INSERT', {}, Exception('lost connection')), raw=None):
+    """
+    Write each batch of UIDs followed by its checkpoint; inserts containing a failing UID raise error.
+    raw maps UIDs to the message submitted for them.
+    """
+    stored = []
+    raw = raw or {}
+
+    def insert_emails(items):
+        if any(uid in failing_uids for _, uid, _, _ in items):
+            raise error
+        stored.extend(uid for _, uid, _, _ in items)
+
+    pipeline = IngestPipeline(1, 1, parse_workers=0)
+    pipeline._insert_emails = insert_emails
+    pipeline.start()
+    for i, batch in enumerate(batches):
+        for uid in batch:
+            pipeline.submit(1, uid, raw.get(uid, b'Subject: test %d\r\n\r\nbody\r\n' % uid))
+        complete = i == len(batches) - 1
+        pipeline.checkpoint(1, last_uid=batch[-1], complete=complete,
+                            synced_range=('2024-01-01', '2025-01-01') if complete else None)
+    pipeline.close()
+    return pipeline, stored
+
+
+def test_checkpoints_advance_when_every_batch_is_stored(app):
+    pipeline, stored = run_scan(set(), [range(1, 11), range(11, 21), range(21, 31)])
+
+    folder = db.session.get(EmailFolder, 1)
+    assert stored == list(range(1, 31))
+    assert pipeline.failed_folders == set()
+    assert folder.last_uid == 30
+    assert folder.scan_progress_uid is None
+
+
+def test_failed_batch_stops_checkpointing_the_folder(app):
+    pipeline, stored = run_scan({14}, [range(1, 11), range(11, 21), range(21, 31)])
+
+    db.session.expire_all()
+    folder = db.session.get(EmailFolder, 1)
+    assert 14 not in stored
+    assert pipeline.failed_folders == {1}
+    # The checkpoint stays at the last batch committed before the failure, the folder is not complete
+    assert folder.last_uid == 10
+    assert folder.scan_progress_uid == 10
+
+    # A resumed scan fetches the UIDs after scan_progress_uid (see ingest_folder), the lost one included
+    resume_from = folder.scan_progress_uid + 1
+    assert resume_from <= 14
+    pipeline, stored = run_scan(set(), [range(resume_from, 21), range(21, 31)])
+
+    db.session.expire_all()
+    folder = db.session.get(EmailFolder, 1)
+    assert 14 in stored
+    assert folder.last_uid == 30
+    assert folder.scan_progress_uid is None
+
+
+def test_message_that_never_parses_is_skipped(app):
+    pipeline, stored = run_scan(set(), [range(1, 11), range(11, 21), range(21, 31)], raw={12: BAD_CHARSET})
+
+    db.session.expire_all()
+    folder = db.session.get(EmailFolder, 1)
+    assert 12 not in stored and len(stored) == 29
+    assert pipeline.errors == 1
+    assert pipeline.failed_folders == set()
+    # Retrying cannot help, so the folder completes instead of fetching its tail on every scan
+    assert folder.last_uid == 30
+    assert folder.scan_progress_uid is None
+    assert folder.synced_ranges == '[["2024-01-01", "2025-01-01"]]'
+
+
+def test_message_that_cannot_be_stored_is_skipped(app):
+    pipeline, stored = run_scan({14}, [range(1, 11), range(11, 21), range(21, 31)], error=KeyError('a@example.com'))
+
+    db.session.expire_all()
+    folder = db.session.get(EmailFolder, 1)
+    assert 14 not in stored and len(stored) == 29
+    assert pipeline.errors == 1
+    assert pipeline.failed_folders == set()
+    assert folder.last_uid == 30
+    assert folder.scan_progress_uid is None
+
+def test_writer_failure_is_raised_by_submit_and_close(app):
+    # The writer's first query fails, so nothing ever frees the byte budget
+    EmailAddress.__table__.drop(db.engine)
+    pipeline = IngestPipeline(1, 1, parse_workers=0, max_bytes=10).start()
+
+    with pytest.raises(RuntimeError, match='Ingest writer'):
+        for uid in range(1, 4):
+            pipeline.submit(1, uid, b'Subject: test\r\n\r\nbody\r\n')
+    with pytest.raises(RuntimeError, match='Ingest writer'):
+        pipeline.close()
+    assert not pipeline._writer.is_alive()
+
+
+def test_full_fetch_upgrades_the_headers_only_row(sqlite_app):
+    header_data = b'From: a@example.com\r\nTo: b@example.com\r\n\r\n'
+    raw_email_data = b'From: a@example.com\r\nTo: b@example.com\r\nSubject: Hello\r\nMessage-ID: <1@example.com>\r\n\r\nbody\r\n'
+    db.session.add_all([
+        EmailFolder(id=1, user_id=1, email_account_id=1, folder_name='INBOX', email_count=1, stored_count=1),
+        EmailAddress(id=1, user_id=1, email_account_id=1, email_address='a@example.com', count=1, sent_count=1),
+        EmailAddress(id=2, user_id=1, email_account_id=1, email_address='b@example.com', count=1, received_count=1),
+        Email(id=1, user_id=1, email_account_id=1, email_folder_id=1, email_imap_id='5', sender_id=1,
+              email_date=datetime(2024, 1, 1), email_subject='', headers_only=True),
+        EmailBlob(email_id=1, raw_data=header_data),
+    ])
+    db.session.commit()
+
+    # The address was changed to include, and a scan without headers_first fetched the body
+    pipeline = IngestPipeline(1, 1, parse_workers=0)
+    pipeline.address_ids = {'a@example.com': 1, 'b@example.com': 2}
+    record = parse_raw_email(raw_email_data)
+    record['headers_only'] = False
+    # MySQL takes the parsed date as a string, SQLite does not
+    record['email_date'] = datetime.strptime(record['email_date'], '%Y-%m-%d %H:%M:%S')
+    pipeline._insert_emails([(1, 5, raw_email_data, record)])
+    db.session.commit()
+
+    db.session.expire_all()
+    assert db.session.query(Email).count() == 1
+    email = db.session.get(Email, 1)
+    assert not email.headers_only
+    assert email.email_subject == 'Hello'
+    assert email.content_hash == record['content_hash']
+    assert db.session.get(EmailBlob, 1).raw_data == (record['raw_data'] or raw_email_data)
+    # Its addresses were counted when the headers were stored
+    assert db.session.get(EmailFolder, 1).stored_count == 1
+    assert db.session.get(EmailAddress, 1).count == 1
+
+
+def test_address_key_matches_the_column():
+    assert address_key('José@Example.com') == address_key('jose@example.com')
+    assert address_key('a' * 300) == 'a' * 255
+
+
+def test_addresses_are_looked_up_as_the_column_stores_them(sqlite_app, monkeypatch):
+    long_address = 'a' * 250 + '@example.com'
+    db.session.add_all([
+        EmailFolder(id=1, user_id=1, email_account_id=1, folder_name='INBOX', email_count=1),
+        EmailAddress(id=1, user_id=1, email_account_id=1, email_address='jose@example.com', count=1),
+        EmailAddress(id=2, user_id=1, email_account_id=1, email_address=long_address[:255], count=1),
+    ])
+    db.session.commit()
+
+    def parse_with_datetime(raw_email_data):
+        # MySQL takes the parsed date as a string, SQLite does not
+        record = parse_raw_email(raw_email_data)
+        record['email_date'] = datetime.strptime(record['email_date'], '%Y-%m-%d %H:%M:%S')
+        return record
+
+    monkeypatch.setattr(ingest_pipeline, 'parse_raw_email', parse_with_datetime)
+    pipeline = IngestPipeline(1, 1, parse_workers=0)
+    # Both addresses are stored already, and ON DUPLICATE KEY UPDATE only runs on MySQL
+    pipeline._upsert_addresses = lambda *args: None
+    pipeline.start()
+    pipeline.submit(1, 5, f'From: JOSÉ@Example.com\r\nTo: {long_address}\r\nDate: Mon, 1 Jan 2024 10:00:00 +0000\r\n\r\nbody\r\n'.encode())
+    pipeline.close()
+
+    assert pipeline.errors == 0
+    email = db.session.query(Email).one()
+    assert email.sender_id == 1
+    assert db.session.query(email_receivers.c.email_address_id).scalar() == 2
@@ -0,0 +1,67 @@
+"""LogSink, the background writer behind update_log_entry, with the database write stubbed out."""
+import threading
+
+import pytest
+from flask import Flask
+
+import email_filter.logger as log
+from email_filter.logger import LogSink
+
+
+class StubSink(LogSink):
+    """Records written lines instead of storing them; writes block while release is clear."""
+
+    def __init__(self, app, **kwargs):
+        self.written = []
+        self.release = threading.Event()
+        self.release.set()
+        self.writing = threading.Event()
+        super().__init__(app, **kwargs)
+
+    def _write(self, entries):
+        self.writing.set()
+        self.release.wait(5)
+        self.written.extend(line for _, _, line, _, _ in entries)
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def test_debug_lines_are_dropped_when_the_queue_is_full(app):
+    sink = StubSink(app, queue_size=2, batch_size=1, interval=0)
+    sink.release.clear()
+    sink.put(1, 1, 'being written', 'processing')
+    sink.writing.wait(5)
+    sink.put(1, 1, 'queued 1', 'processing')
+    sink.put(1, 1, 'queued 2', 'processing')
+
+    # The queue is full: debug lines do not block the caller, they are counted and dropped
+    for i in range(3):
+        sink.put(1, 1, f'debug {i}', 'processing', debug=True)
+    assert sink.dropped == 3
+
+    sink.release.set()
+    sink.flush()
+    assert sink.written == ['being written', 'queued 1', 'queued 2']
+
+
+def test_status_change_waits_until_its_line_is_written(app, monkeypatch):
+    sink = StubSink(app, interval=0.05)
+    monkeypatch.setattr(log, '_sink', sink)
+    sink.release.clear()
+
+    # A processing line returns right away, before it is written
+    log.update_log_entry(1, 1, 'working')
+    assert sink.written == []
+
+    finished = threading.Thread(target=log.update_log_entry, args=(1, 1, 'done'), kwargs={'status': 'finished'})
+    finished.start()
+    finished.join(0.2)
+    assert finished.is_alive()
+
+    sink.release.set()
+    finished.join(5)
+    assert not finished.is_alive()
+    assert [line.split('] ', 1)[1] for line in sink.written] == ['working', 'done']
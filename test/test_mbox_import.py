@@ -0,0 +1,51 @@
+"""Splitting mbox files and reading Google Takeout labels."""
+from email_filter.mbox_import import iter_eml_messages, iter_mbox_messages, parse_takeout_labels
+
+
+def write(tmp_path, data, name='archive.mbox'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_split_on_from_lines(tmp_path):
+    path = write(tmp_path, b'From a@example.com Mon Jan  1 00:00:00 2024\nSubject: 1\n\nfirst\n\n'
+                           b'From b@example.com Tue Jan  2 00:00:00 2024\nSubject: 2\n\nsecond\n')
+    assert list(iter_mbox_messages(path)) == [b'Subject: 1\n\nfirst\n', b'Subject: 2\n\nsecond\n']
+
+
+def test_separator_blank_line_is_not_part_of_the_message(tmp_path):
+    # The same message as IMAP would serve it, with CRLF line breaks
+    message = b'Subject: crlf\r\n\r\nbody\r\n'
+    path = write(tmp_path, b'From a@example.com\r\n' + message + b'\r\nFrom b@example.com\r\n' + message + b'\r\n')
+    assert list(iter_mbox_messages(path)) == [message, message]
+
+
+def test_only_one_trailing_blank_line_is_dropped(tmp_path):
+    path = write(tmp_path, b'From a@example.com\nSubject: 1\n\nends with a blank line\n\n\n')
+    assert list(iter_mbox_messages(path)) == [b'Subject: 1\n\nends with a blank line\n\n']
+
+
+def test_escaped_from_lines_are_unquoted(tmp_path):
+    path = write(tmp_path, b'From a@example.com\nSubject: 1\n\n>From the start\n>>From quoted\nFrom: no\n')
+    assert list(iter_mbox_messages(path)) == [b'Subject: 1\n\nFrom the start\n>From quoted\nFrom: no\n']
+
+
+def test_empty_file_and_leading_garbage(tmp_path):
+    assert list(iter_mbox_messages(write(tmp_path, b'', 'empty.mbox'))) == []
+    path = write(tmp_path, b'junk before the first message\nFrom a@example.com\nSubject: 1\n\nbody\n')
+    assert list(iter_mbox_messages(path)) == [b'Subject: 1\n\nbody\n']
+
+
+def test_eml_directories_in_name_order(tmp_path):
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / '2.eml').write_bytes(b'Subject: 2\n\n')
+    (tmp_path / '1.eml').write_bytes(b'Subject: 1\n\n')
+    (tmp_path / 'notes.txt').write_bytes(b'not a message')
+    assert list(iter_eml_messages(str(tmp_path))) == [('.', b'Subject: 1\n\n'), ('b', b'Subject: 2\n\n')]
+
+
+def test_takeout_labels():
+    raw = b'X-Gmail-Labels: Inbox,Important,Category Updates,Work/2024\nSubject: 1\n\nX-Gmail-Labels: Spam\n'
+    assert parse_takeout_labels(raw) == ['\\Inbox', '\\Important', '\\Category Updates', 'Work/2024']
+    assert parse_takeout_labels(b'Subject: 1\n\nX-Gmail-Labels: Spam\n') == []
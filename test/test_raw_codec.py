@@ -0,0 +1,35 @@
+"""Compression of stored raw messages."""
+import pytest
+
+from email_filter.raw_codec import CODEC_PREFIXES, decode_raw_data, encode_raw_data
+
+RAW = b'Subject: Hello\r\nFrom: a@example.com\r\n\r\n' + b'Lorem ipsum dolor sit amet. ' * 200
+
+
+def test_no_codec_stores_the_message_unchanged():
+    assert encode_raw_data(RAW, codec='') is RAW
+    assert decode_raw_data(RAW) is RAW
+
+
+def test_zlib_round_trip():
+    encoded = encode_raw_data(RAW, codec='zlib')
+    assert encoded.startswith(CODEC_PREFIXES['zlib'])
+    assert len(encoded) < len(RAW)
+    assert decode_raw_data(encoded) == RAW
+
+
+def test_zstd_round_trip():
+    pytest.importorskip('zstandard')
+    encoded = encode_raw_data(RAW, codec='zstd')
+    assert encoded.startswith(CODEC_PREFIXES['zstd'])
+    assert decode_raw_data(encoded) == RAW
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        encode_raw_data(RAW, codec='lzma')
+
+
+def test_unknown_prefix_and_empty_values_are_read_unchanged():
+    assert decode_raw_data(b'\x00xwhatever') == b'\x00xwhatever'
+    assert decode_raw_data(b'') == b''
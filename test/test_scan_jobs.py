@@ -0,0 +1,128 @@
+"""The scan job scheduler, with read_imap_emails replaced by a scan that runs until the test ends it."""
+import time
+import threading
+
+import pytest
+
+import email_filter.scan_jobs as scheduler
+from email_filter.extensions import db
+from email_filter.globals import scan_status
+from email_filter.models import EmailAccount
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def scans(sqlite_app, monkeypatch):
+    """Started scans by account id; setting a scan's event finishes it."""
+    started = {}
+
+    def fake_scan(job):
+        done = threading.Event()
+        job.status = 'running'
+        started[job.email_account_id] = done
+        done.wait(5)
+        job.status = 'finished'
+        job.finished_at = time.time()
+
+    monkeypatch.setattr(scheduler, '_scan', fake_scan)
+    monkeypatch.setattr(scheduler, '_pending', [])
+    monkeypatch.setattr(scheduler, '_running', scheduler.Counter())
+    monkeypatch.setattr(scheduler, 'SCAN_JOB_WORKERS', 2)
+    monkeypatch.setattr(scheduler, 'SCAN_JOB_PROVIDER_LIMITS', {'GMAIL': 1})
+    monkeypatch.setattr(scheduler, 'DEFAULT_SCAN_JOB_PROVIDER_LIMIT', 2)
+    monkeypatch.setattr(scheduler, 'get_provider_cooldown', lambda provider: 0)
+    scheduler.scan_jobs.clear()
+    scan_status.clear()
+    for account_id, provider in [(1, 'GMAIL'), (2, 'GMAIL'), (3, 'OFFICE'), (4, 'OFFICE'), (5, 'OFFICE')]:
+        db.session.add(EmailAccount(id=account_id, user_id=1, email_address=f'user{account_id}@example.com',
+                                    password='secret', provider=provider))
+    db.session.commit()
+    yield started
+
+    def finish_all():
+        # Jobs still queued start as slots free up, finish those too
+        for done in list(started.values()):
+            done.set()
+        return not scheduler._pending and sum(scheduler._running.values()) == 0
+
+    wait_for(finish_all)
+    scheduler.scan_jobs.clear()
+    scan_status.clear()
+
+
+def test_an_account_has_one_active_job(scans):
+    job = scheduler.submit_scan(1, 1)
+    assert scheduler.submit_scan(1, 1) is job
+    wait_for(lambda: 1 in scans)
+    assert scheduler.submit_scan(1, 1) is job
+
+    scans[1].set()
+    wait_for(lambda: job.status == 'finished')
+    assert scheduler.submit_scan(1, 1) is not job
+
+
+def test_provider_limit_and_global_cap(scans):
+    jobs = {account_id: scheduler.submit_scan(1, account_id) for account_id in (1, 2, 3, 4)}
+    wait_for(lambda: len(scans) == 2)
+    # One Gmail scan at a time; the second slot goes to the first Office account
+    assert set(scans) == {1, 3}
+    time.sleep(0.1)
+    assert jobs[2].status == 'queued' and jobs[4].status == 'queued'
+
+    # A finished Gmail scan frees a global slot, but Gmail account 2 starts as its provider is free again
+    scans[1].set()
+    wait_for(lambda: len(scans) == 3)
+    assert set(scans) == {1, 2, 3}
+    assert jobs[4].status == 'queued'
+
+
+def test_provider_in_cooldown_is_held_back(scans, monkeypatch):
+    monkeypatch.setattr(scheduler, 'get_provider_cooldown', lambda provider: 30 if provider == 'GMAIL' else 0)
+    gmail_job = scheduler.submit_scan(1, 1)
+    scheduler.submit_scan(1, 3)
+    wait_for(lambda: 3 in scans)
+    time.sleep(0.1)
+    assert gmail_job.status == 'queued'
+
+    monkeypatch.setattr(scheduler, 'get_provider_cooldown', lambda provider: 0)
+    wait_for(lambda: 1 in scans)
+
+
+def test_stop_while_queued(scans):
+    scheduler.submit_scan(1, 1)
+    wait_for(lambda: 1 in scans)
+    queued = scheduler.submit_scan(1, 2)
+    scan_status[(1, 2)] = 'stopping'
+    wait_for(lambda: queued.status == 'stopped')
+    assert 2 not in scans
+    assert scan_status[(1, 2)] == 'stopped'
+
+
+def test_failed_folders_fail_the_job(sqlite_app, monkeypatch):
+    db.session.add(EmailAccount(id=1, user_id=1, email_address='user1@example.com', password='secret',
+                                provider='GMAIL'))
+    db.session.commit()
+
+    def read_imap_emails(account, user_id, job=None, **options):
+        job.folders_total = 2
+        job.folder_done()
+        job.folder_failed('"Archive"')
+        return {'success': False, 'error': '1 of 2 folders failed: "Archive"', 'failed_folders': ['"Archive"']}
+
+    monkeypatch.setattr(scheduler, 'read_imap_emails', read_imap_emails)
+    job = scheduler.ScanJob(1, 1, 'GMAIL', {})
+    job.app = sqlite_app
+    scheduler._scan(job)
+
+    result = job.to_dict()
+    assert result['status'] == 'failed'
+    assert result['failed_folders'] == ['"Archive"']
+    assert result['folders_done'] == 1
+    assert 'Archive' in result['error']